@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: fp_air_ruimtdata_hpc.R / fp_twr_ruimtdata_hpc.R, reclassify_LGN.py and reclassify_soil.py
+
+This script calculates the footprint features of a new map version (e.g. a new
+LGN release, a revision of the Bodemkaart or a new OWASIS day) for all
+observations, and writes them straight into the final merged dataset. Before, this
+needed the HPC job arrays (fp_air_ruimtdata_hpc.R, fp_twr_ruimtdata_hpc.R),
+datasets_sortrows.R and the reclassification scripts again.
+
+The footprint weights are taken from the stores of footprint_store.py (one for the
+airborne and one for the tower footprints), so every map only takes one sparse
+matrix product per source:
+    categorical maps:   with a class table (csv with the columns code and class),
+                        the fraction of every class in the footprint. The codes
+                        of a class are added up, as in reclassify_LGN.py and
+                        reclassify_soil.py, so the classes are written directly
+                        (e.g. Grs, SuC, ...). Codes that are not in the table
+                        are not assigned to a class
+    continuous maps:    without a class table, the footprint-weighted average,
+                        written to the column <name> (e.g. PeatD, ahn)
+The rows of the merged dataset are linked to the footprints by old_rownames (the
+number of the footprint file). With a date, only the observations of that date
+are calculated (e.g. for the OWASIS map of one day).
+
+The seasonal subsets (SepJan and FebAug) are made again from the merged dataset
+(season_rows in cleaning.py).
+
+Run as:
+    python extract_features.py <map file> <name> [<class table>] [<date>]
+        e.g. python extract_features.py LGN2022.tif LGN LGN_classes.csv
+             python extract_features.py Veendikte_2020.tif PeatD
+             python extract_features.py BBB_2023032.asc BBB - 2023-02-01
+    (use - for no class table)
+
+Input: the new map (.asc or .tif), the class table (.csv) for categorical maps,
+       the stores of the footprint weights and the final merged dataset
+Output: the final merged dataset and seasonal subsets with the new features
+
+Functions:
+    load_class_table:   codes of every class, from a csv file
+    table_from_codes:   class table from a dictionary (as LGNcodes in reclassify_LGN.py)
+    footprint_features: the features of a map for the footprints of a store
+    write_features:     the features into the rows of a source of the merged dataset
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from footprint_store import load_store, read_map, map_values, weighted_mean, class_fractions
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reclassify_and_clean_datasets'))
+from cleaning import season_rows
+
+#%% Class tables
+
+def load_class_table(path):
+    """
+    Returns the class table of a csv file with the columns code and class: a
+    dataframe with the code and class of every code.
+    """
+    table = pd.read_csv(path)
+    return table[['code', 'class']]
+
+
+def table_from_codes(codes):
+    """
+    codes: dictionary with the codes of every class, e.g.
+           {'Grs': [45,1,27,30,46,47], 'Ghs': [8], ...}
+
+    Returns the class table.
+    """
+    return pd.DataFrame([(code, name) for name, values in codes.items() for code in values],
+                        columns=['code', 'class'])
+
+#%% Features
+
+def footprint_features(store, values, map_grid, name, table=None, rows=None):
+    """
+    store: store of the footprint weights (footprint_store.py)
+    values, map_grid: values and grid of the map (read_map)
+    name: name of the feature (continuous maps)
+    table: class table (categorical maps), or None
+    rows: rows of the store (footprints) to calculate (default: all)
+
+    Returns a dataframe with the features, with the number of the footprint file
+    (old_rownames) as index.
+    """
+    cell_values = map_values(store, values, map_grid)
+    index = pd.Index(store['rows'] if rows is None else store['rows'][rows], name='old_rownames')
+
+    if table is None:
+        return pd.DataFrame({name: weighted_mean(store, cell_values, rows)}, index=index)
+
+    # class of every cell, so the codes of a class are added up in one product
+    classes = list(dict.fromkeys(table['class']))
+    class_no = pd.Series(range(len(classes)), index=classes)
+    code_class = pd.Series(class_no[table['class']].to_numpy(), index=table['code'].to_numpy(), dtype=np.float64)
+    cell_classes = code_class.reindex(cell_values).to_numpy()
+
+    fractions = class_fractions(store, cell_classes, np.arange(len(classes)), rows)
+    return pd.DataFrame(fractions, columns=classes, index=index)
+
+
+def write_features(merged, features, source):
+    """
+    merged: final merged dataset
+    features: features of the footprints of a source (footprint_features)
+    source: 'tower' or 'airborne'
+
+    Writes the features into the rows of the source (by old_rownames), and returns
+    the merged dataset. Rows without a footprint in features are not changed.
+    """
+    rows = (merged['source'] == source) & merged['old_rownames'].isin(features.index)
+    for col in features.columns:
+        if col not in merged.columns:
+            merged[col] = np.nan
+        merged.loc[rows, col] = features.loc[merged.loc[rows, 'old_rownames'], col].to_numpy()
+    return merged
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    map_file, name = args[0], args[1]
+    table = load_class_table(args[2]) if len(args) > 2 and args[2] != '-' else None
+    date = pd.to_datetime(args[3]) if len(args) > 3 else None
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    stores = {'airborne': f'{WD}fp_weights_airborne', 'tower': f'{WD}fp_weights_tower'}
+
+    merged = pd.read_csv(f"{WD}merged_0228_final.csv", index_col=0)
+    merged['Datetime'] = pd.to_datetime(merged['Datetime'])
+    values, map_grid = read_map(map_file)
+
+    for source, stem in stores.items():
+        store = load_store(stem)
+
+        # only the footprints of the observations (of the date)
+        obs = merged[merged['source'] == source]
+        if date is not None:
+            obs = obs[obs['Datetime'].dt.normalize() == date]
+        rows = np.nonzero(np.isin(store['rows'], obs['old_rownames']))[0]
+
+        features = footprint_features(store, values, map_grid, name, table, rows)
+        merged = write_features(merged, features, source)
+        print(f'{source}: {len(rows)} footprints, columns {list(features.columns)}')
+
+    # Save the final merged dataset and the seasonal subsets with the new features
+    merged.to_csv(f"{WD}merged_0228_final.csv")
+    merged[season_rows(merged, 'SepJan')].to_csv(f'{WD}merged_SepJan_0228.csv')
+    merged[season_rows(merged, 'FebAug')].to_csv(f'{WD}merged_FebAug_0228.csv')
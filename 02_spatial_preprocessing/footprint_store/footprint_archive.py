@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script packs all footprint files of a folder (<i>.nc, one file per
+observation, written by ffp_airborne.R and ffp_tower.R) into one archive, so that
+the scripts that use the footprints do not have to open tens of thousands of
+small files (slow on Lustre).
+
+Every footprint is truncated to its support: the cells with the highest values
+that together hold frac (default 90%) of the total footprint value, cropped to
+the rectangle around these cells plus one cell (the other cells in the rectangle
+are set to 0). The 5000 m domain of the airborne footprints is therefore reduced to the area
+that contributes to the flux.
+
+The archive consists of:
+    fp_archive_<tag>.npy:       the values of all truncated footprints, one after
+                                the other (float32), read with a memory map, so
+                                only the footprints that are used are read
+    fp_archive_<tag>_index.csv: per footprint, with old_rownames (the number of
+                                the footprint file) as index: the offset and
+                                shape (nlat, nlon) in the values, the lat and lon
+                                of the first cell and the cell size (dlat, dlon),
+                                the total value of the footprint before the
+                                truncation and the fraction that is kept
+    fp_archive_<tag>.json:      the footprint folder and frac
+get_footprint returns the lat, lon and values of one footprint, as read_footprint
+in footprint_store.py, so the archive can be used instead of the files (e.g.
+build_store in footprint_store.py). As only the support is kept, the weights of
+a store of the archive add up to the weight of the support; build_store uses kept
+to also store the weight of the whole footprint (see footprint_store.py).
+
+Run as:
+    python footprint_archive.py <airborne|tower> <frac> <n_workers>
+
+Input: footprint files (.nc)
+Output: the footprint archive
+
+Functions:
+    truncate_footprint: the support of a footprint
+    build_archive:      archive of all footprints of a folder
+    load_archive:       the archive, with a memory map of the values
+    get_footprint:      lat, lon and values of one footprint
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from footprint_store import read_footprint, footprint_files
+
+#%% Truncate
+
+def truncate_footprint(lat, lon, values, frac=0.9):
+    """
+    lat, lon, values: footprint (read_footprint)
+    frac: fraction of the total footprint value to keep
+
+    Returns the lat and lon of the cropped footprint, its values (float32, 0
+    outside the support), the total value before truncation and the fraction
+    that is kept.
+    """
+    total = values.sum()
+    if total == 0:
+        return lat[:1], lon[:1], np.zeros((1, 1), dtype=np.float32), 0.0, 0.0
+
+    # smallest value of the cells with the highest values that hold frac of the total
+    flat = np.sort(values.ravel())[::-1]
+    n_keep = min(int(np.searchsorted(np.cumsum(flat), frac * total)) + 1, len(flat))
+    support = values >= flat[n_keep-1]
+
+    rows = np.nonzero(support.any(axis=1))[0]
+    cols = np.nonzero(support.any(axis=0))[0]
+    # one cell wider on every side, for the bilinear interpolation at the edges
+    r0, r1 = max(rows[0]-1, 0), min(rows[-1]+2, values.shape[0])
+    c0, c1 = max(cols[0]-1, 0), min(cols[-1]+2, values.shape[1])
+    cropped = np.where(support[r0:r1, c0:c1], values[r0:r1, c0:c1], 0).astype(np.float32)
+    return lat[r0:r1], lon[c0:c1], cropped, float(total), float(cropped.sum() / total)
+
+
+def _truncate_file(args):
+    path, frac = args
+    return truncate_footprint(*read_footprint(path), frac)
+
+#%% Archive
+
+def build_archive(fp_folder, stem, frac=0.9, n_workers=1):
+    """
+    fp_folder: folder with the footprint files (<i>.nc)
+    stem: path of the archive, without extension
+    frac: fraction of the total footprint value to keep
+    n_workers: number of worker processes
+
+    Writes the archive, and returns the index.
+    """
+    files = footprint_files(fp_folder)
+    jobs = [(os.path.join(fp_folder, file), frac) for file in files]
+
+    if n_workers == 1:
+        results = [_truncate_file(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_truncate_file, jobs, chunksize=16))
+
+    # the regular grid of a footprint is stored as the first cell and the cell size
+    sizes = np.array([values.size for _, _, values, _, _ in results], dtype=np.int64)
+    index = pd.DataFrame({
+        'offset': np.concatenate([[0], np.cumsum(sizes)[:-1]]),
+        'nlat': [values.shape[0] for _, _, values, _, _ in results],
+        'nlon': [values.shape[1] for _, _, values, _, _ in results],
+        'lat0': [lat[0] for lat, _, _, _, _ in results],
+        'lon0': [lon[0] for _, lon, _, _, _ in results],
+        'dlat': [(lat[1] - lat[0]) if len(lat) > 1 else np.nan for lat, _, _, _, _ in results],
+        'dlon': [(lon[1] - lon[0]) if len(lon) > 1 else np.nan for _, lon, _, _, _ in results],
+        'total': [total for _, _, _, total, _ in results],
+        'kept': [kept for _, _, _, _, kept in results]},
+        index=pd.Index([int(file[:-len('.nc')]) for file in files], name='old_rownames'))
+
+    # the cell size of a footprint of one row or column is taken from the folder
+    index['dlat'] = index['dlat'].fillna(index['dlat'].median())
+    index['dlon'] = index['dlon'].fillna(index['dlon'].median())
+
+    np.save(f'{stem}.npy', np.concatenate([values.ravel() for _, _, values, _, _ in results]))
+    index.to_csv(f'{stem}_index.csv', float_format='%.15g')
+    with open(f'{stem}.json', 'w') as f:
+        json.dump({'fp_folder': fp_folder, 'frac': frac, 'n_footprints': len(index)}, f, indent=4)
+    return index
+
+
+def load_archive(stem):
+    """
+    Returns the archive: a dictionary with the values (memory map) and the index.
+    """
+    with open(f'{stem}.json') as f:
+        meta = json.load(f)
+    return {'values': np.load(f'{stem}.npy', mmap_mode='r'),
+            'index': pd.read_csv(f'{stem}_index.csv', index_col='old_rownames'),
+            'frac': meta['frac']}
+
+
+def get_footprint(archive, rowname):
+    """
+    Returns the lat, lon (centres of the cells) and values [lat, lon] of the
+    footprint of old_rownames rowname. The values are read from the memory map.
+    """
+    entry = archive['index'].loc[rowname]
+    nlat, nlon, offset = int(entry['nlat']), int(entry['nlon']), int(entry['offset'])
+    lat = entry['lat0'] + np.arange(nlat) * entry['dlat']
+    lon = entry['lon0'] + np.arange(nlon) * entry['dlon']
+    values = archive['values'][offset:offset + nlat*nlon].reshape(nlat, nlon)
+    return lat, lon, values.astype(np.float64)
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    source = args[0] if len(args) > 0 else 'airborne'
+    frac = float(args[1]) if len(args) > 1 else 0.9
+    n_workers = int(args[2]) if len(args) > 2 else 1
+
+    path = '/lustre/backup/WUR/ESG/rietm018/thesis/'
+
+    fp_folders = {'airborne': f'{path}fp_airborne_rasters_0907/',
+                  'tower': f'{path}fp_rasters_all_0607/'}
+
+    index = build_archive(fp_folders[source], f'{path}fp_archive_{source}', frac, n_workers)
+    print(f"{source}: {len(index)} footprints, {index['nlat'].mul(index['nlon']).sum()} values, "
+          f"mean kept fraction {index['kept'].mean():.3f}")
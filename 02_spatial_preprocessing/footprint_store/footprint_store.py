@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: calc_ruimt_data_in_fp.R and fp_air_ruimtdata_hpc.R / fp_twr_ruimtdata_hpc.R
+
+This script builds a store of the footprint weights of all observations, so that
+the footprint-weighted values of a map do not have to be calculated again per
+map and per observation in an HPC job array (fp_air_ruimtdata_hpc.R,
+fp_twr_ruimtdata_hpc.R).
+
+The footprints (<i>.nc, one file per observation, written by ffp_airborne.R and
+ffp_tower.R in lat-lon) are read once. Every footprint is converted to the
+weights of the cells of a reference grid in RD coordinates (EPSG:28992), the grid
+of the maps (e.g. the 5 m grid of LGN2020): the footprint value (contribution
+per m2) at the centre of a cell (bilinear, as terra::project), multiplied by the
+area of the cell, as in calc_ruimt_data_in_fp.R. Only the cells with a weight > 0
+are kept, so every footprint is a sparse vector of (cell, weight).
+
+All footprints are stored as one sparse matrix W (CSR, observations x cells),
+with only the columns of the cells that are in at least one footprint:
+    fp_weights_<tag>.npz:       W (scipy.sparse.save_npz), float32
+    fp_weights_<tag>_index.npz: cells (the cell number on the reference grid of
+                                every column: row * ncols + col) and rows (the
+                                number of the footprint file of every row of W,
+                                i.e. old_rownames in the datasets)
+    fp_weights_<tag>.json:      the reference grid and the footprint folder
+The footprint-weighted average of a map is then one sparse matrix-vector
+product: W @ values / W.sum(axis=1), with the values of the map at the cells
+(map_values). As in calc_ruimt_data_in_fp.R, cells where the map is NaN do not
+count for the sum, but do count for the total weight of the footprint.
+
+The transformation between WGS84 (lat-lon) and RD is done with the approximation
+formulas of Schreutelaar and Strang van Hees (accuracy about 1 m), so no
+projection library is needed.
+
+The footprints can also be read from the footprint archive (footprint_archive.py)
+instead of the separate .nc files. The archive only keeps the support of every
+footprint (the cells that hold frac, e.g. 90%, of the footprint), so W.sum(axis=1)
+is then the weight of the support, not of the whole footprint. The store therefore
+also holds the total weight of every whole footprint (total): W.sum(axis=1) for the
+.nc files, and W.sum(axis=1) / kept for the archive, with kept the fraction of the
+footprint that the archive keeps (from the total of the footprint before the
+truncation, see footprint_archive.py). frac is saved with the store, so a store of
+an archive can be recognised.
+
+weighted_mean and class_fractions divide by W.sum(axis=1) by default: for a store
+of an archive this is the average over the support, which is closer to the average
+over the whole footprint than dividing the sum over the support by the total
+weight (as the cells outside the support would then count as NaN cells), and the
+class fractions still add up to 1. With full_footprint=True, they divide by total,
+the denominator of calc_ruimt_data_in_fp.R. For a store of the .nc files, both are
+the same.
+
+Run as:
+    python footprint_store.py <airborne|tower> <n_workers> [archive]
+
+Input: footprint files (.nc) and a map of the reference grid (.asc or .tif)
+Output: the store of the footprint weights
+
+Functions:
+    rd_to_wgs84, wgs84_to_rd:   transformation between RD and WGS84
+    read_footprint:     values of a footprint file (.nc)
+    footprint_weights:  weights of a footprint on the cells of the reference grid
+    grid_weights:       the same, for the values of a footprint (e.g. from the archive)
+    build_store:        weights of all footprints of a folder or archive, as a store
+    save_store, load_store: the store on disk
+    read_map:           values and grid of a map (.asc, or a band of a .tif with rasterio)
+    map_values:         values of a map (in RD or lat-lon) at the cells of the store
+    weighted_mean:      footprint-weighted average of continuous values
+    class_fractions:    footprint-weighted fraction of every class of categorical values
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import numpy as np
+import scipy.sparse as sp
+from scipy.io import netcdf_file
+from concurrent.futures import ProcessPoolExecutor
+
+#%% RD <-> WGS84
+
+# Reference point Amersfoort, in RD and WGS84
+X0, Y0 = 155000, 463000
+phi0, lam0 = 52.15517440, 5.38720621
+
+# Coefficients (p, q, coefficient) of the approximation formulas
+K = [(0, 1, 3235.65389), (2, 0, -32.58297), (0, 2, -0.24750), (2, 1, -0.84978),
+     (0, 3, -0.06550), (2, 2, -0.01709), (1, 0, -0.00738), (4, 0, 0.00530),
+     (2, 3, -0.00039), (4, 1, 0.00033), (1, 1, -0.00012)]
+L = [(1, 0, 5260.52916), (1, 1, 105.94684), (1, 2, 2.45656), (3, 0, -0.81885),
+     (1, 3, 0.05594), (3, 1, -0.05607), (0, 1, 0.01199), (3, 2, -0.00256),
+     (1, 4, 0.00128), (0, 2, 0.00022), (2, 0, -0.00022), (5, 0, 0.00026)]
+R = [(0, 1, 190094.945), (1, 1, -11832.228), (2, 1, -114.221), (0, 3, -32.391),
+     (1, 0, -0.705), (3, 1, -2.340), (1, 3, -0.608), (0, 2, -0.008), (2, 3, 0.148)]
+S = [(1, 0, 309056.544), (0, 2, 3638.893), (2, 0, 73.077), (1, 2, -157.984),
+     (3, 0, 59.788), (0, 1, 0.433), (2, 2, -6.439), (1, 1, -0.032), (0, 4, 0.092),
+     (1, 4, -0.054)]
+
+def rd_to_wgs84(x, y):
+    """
+    Returns lat and lon (degrees) of RD coordinates x and y (m).
+    """
+    dx = (np.asarray(x, dtype=np.float64) - X0) * 1e-5
+    dy = (np.asarray(y, dtype=np.float64) - Y0) * 1e-5
+    lat = phi0 + sum(c * dx**p * dy**q for p, q, c in K) / 3600
+    lon = lam0 + sum(c * dx**p * dy**q for p, q, c in L) / 3600
+    return lat, lon
+
+
+def wgs84_to_rd(lat, lon):
+    """
+    Returns RD coordinates x and y (m) of lat and lon (degrees).
+    """
+    dphi = 0.36 * (np.asarray(lat, dtype=np.float64) - phi0)
+    dlam = 0.36 * (np.asarray(lon, dtype=np.float64) - lam0)
+    x = X0 + sum(c * dphi**p * dlam**q for p, q, c in R)
+    y = Y0 + sum(c * dphi**p * dlam**q for p, q, c in S)
+    return x, y
+
+#%% Footprint weights
+
+def read_footprint(path):
+    """
+    Returns lat, lon (centres of the cells) and the values [lat, lon] of a
+    footprint file, with NaN and negative values set to 0 (as in calc_ruimt_data_in_fp.R).
+    """
+    with netcdf_file(path, 'r', mmap=False) as f:
+        lat = f.variables['lat'][:].astype(np.float64)
+        lon = f.variables['lon'][:].astype(np.float64)
+        var = f.variables['fp_value']
+        values = var[:].astype(np.float64)
+        for attr in ['_FillValue', 'missing_value']:
+            if hasattr(var, attr):
+                values[values == getattr(var, attr)] = np.nan
+    values = values.reshape(len(lat), len(lon))
+    values[~(values > 0)] = 0
+    return lat, lon, values
+
+
+def bilinear(lat, lon, values, plat, plon):
+    """
+    Returns the values of a regular lat-lon grid at the points plat, plon, with
+    bilinear interpolation (0 outside the grid).
+    """
+    fi = (plat - lat[0]) / (lat[1] - lat[0])
+    fj = (plon - lon[0]) / (lon[1] - lon[0])
+    inside = (fi >= 0) & (fi <= len(lat)-1) & (fj >= 0) & (fj <= len(lon)-1)
+
+    i = np.clip(np.floor(fi).astype(np.int64), 0, len(lat)-2)
+    j = np.clip(np.floor(fj).astype(np.int64), 0, len(lon)-2)
+    di, dj = fi - i, fj - j
+    result = (values[i, j] * (1-di) * (1-dj) + values[i+1, j] * di * (1-dj)
+              + values[i, j+1] * (1-di) * dj + values[i+1, j+1] * di * dj)
+    return np.where(inside, result, 0)
+
+
+def footprint_weights(path, grid):
+    """
+    path: footprint file (.nc)
+    grid: reference grid, dictionary with x0 and y0 (top left corner), res,
+          nrows and ncols (see read_map)
+
+    Returns the cell numbers (row * ncols + col) and weights of the cells of the
+    reference grid in the footprint.
+    """
+    return grid_weights(*read_footprint(path), grid)
+
+
+def grid_weights(lat, lon, values, grid):
+    """
+    lat, lon, values: footprint (read_footprint, or get_footprint of footprint_archive.py)
+    grid: reference grid (see read_map)
+
+    Returns the cell numbers and weights of the cells of the reference grid in the
+    footprint.
+    """
+    rows, cols = np.nonzero(values)
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    # bounding box of the footprint in RD, one footprint cell wider on every side
+    ilat = np.arange(max(rows.min()-1, 0), min(rows.max()+2, len(lat)))
+    ilon = np.arange(max(cols.min()-1, 0), min(cols.max()+2, len(lon)))
+    edge_lat = np.concatenate([lat[ilat], lat[ilat], np.full(len(ilon), lat[ilat[0]]), np.full(len(ilon), lat[ilat[-1]])])
+    edge_lon = np.concatenate([np.full(len(ilat), lon[ilon[0]]), np.full(len(ilat), lon[ilon[-1]]), lon[ilon], lon[ilon]])
+    x, y = wgs84_to_rd(edge_lat, edge_lon)
+
+    # cells of the reference grid in the bounding box
+    col0 = max(int(np.floor((x.min() - grid['x0']) / grid['res'])), 0)
+    col1 = min(int(np.floor((x.max() - grid['x0']) / grid['res'])), grid['ncols']-1)
+    row0 = max(int(np.floor((grid['y0'] - y.max()) / grid['res'])), 0)
+    row1 = min(int(np.floor((grid['y0'] - y.min()) / grid['res'])), grid['nrows']-1)
+    if col1 < col0 or row1 < row0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    grid_cols = np.arange(col0, col1+1)
+    grid_rows = np.arange(row0, row1+1)
+
+    # footprint value at the centre of every cell, times the area of the cell
+    cx = grid['x0'] + (grid_cols + 0.5) * grid['res']
+    cy = grid['y0'] - (grid_rows + 0.5) * grid['res']
+    plat, plon = rd_to_wgs84(cx[None, :], cy[:, None])
+    weights = bilinear(lat, lon, values, plat, plon) * grid['res']**2
+
+    keep = weights > 0
+    cells = grid_rows[:, None] * np.int64(grid['ncols']) + grid_cols[None, :]
+    return cells[keep], weights[keep].astype(np.float32)
+
+#%% Store
+
+_grid = None
+_archive = None
+
+def _init_worker(grid, archive_stem=None):
+    global _grid, _archive
+    _grid = grid
+    if archive_stem is not None:
+        from footprint_archive import load_archive
+        _archive = load_archive(archive_stem)
+
+
+def _weights_in_worker(path):
+    return footprint_weights(path, _grid)
+
+
+def _archive_weights_in_worker(rowname):
+    from footprint_archive import get_footprint
+    return grid_weights(*get_footprint(_archive, rowname), _grid)
+
+
+def footprint_files(fp_folder):
+    """
+    Returns the footprint files of a folder, sorted by their number (as mixedsort).
+    """
+    files = [file for file in os.listdir(fp_folder) if file.endswith('.nc')]
+    return sorted(files, key=lambda file: int(file[:-len('.nc')]))
+
+
+def build_store(fp_folder, grid, n_workers=1, archive_stem=None):
+    """
+    fp_folder: folder with the footprint files (<i>.nc)
+    grid: reference grid (see read_map)
+    n_workers: number of worker processes
+    archive_stem: footprint archive (footprint_archive.py) to read the footprints
+                  from, instead of the files of fp_folder (optional)
+
+    Returns the store: a dictionary with W (CSR, footprints x cells), cells (cell
+    number of every column), rows (number of the footprint file of every row),
+    total (weight of every whole footprint), frac (fraction of the footprints
+    that is kept, 1 for the .nc files) and the grid.
+    """
+    if archive_stem is None:
+        files = footprint_files(fp_folder)
+        rows = np.array([int(file[:-len('.nc')]) for file in files], dtype=np.int64)
+        items = [os.path.join(fp_folder, file) for file in files]
+        work = _weights_in_worker
+        frac, kept = 1.0, np.ones(len(rows))
+    else:
+        from footprint_archive import load_archive
+        archive = load_archive(archive_stem)
+        rows = archive['index'].index.to_numpy(dtype=np.int64)
+        items = list(rows)
+        work = _archive_weights_in_worker
+        # fraction of the total value of every footprint that the archive keeps
+        frac, kept = archive['frac'], archive['index']['kept'].to_numpy(dtype=np.float64)
+
+    if n_workers == 1:
+        _init_worker(grid, archive_stem)
+        results = [work(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(grid, archive_stem)) as pool:
+            results = list(pool.map(work, items, chunksize=16))
+
+    # only the columns of the cells that are in a footprint
+    indptr = np.zeros(len(results)+1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(cells) for cells, _ in results])
+    all_cells = np.concatenate([cells for cells, _ in results])
+    cells, indices = np.unique(all_cells, return_inverse=True)
+    data = np.concatenate([weights for _, weights in results])
+
+    W = sp.csr_matrix((data, indices.astype(np.int64), indptr), shape=(len(results), len(cells)))
+    W.sort_indices()
+
+    # weight of the whole footprint, from the weight of the support
+    support = np.asarray(W.sum(axis=1), dtype=np.float64).ravel()
+    total = np.where(kept > 0, support / np.where(kept > 0, kept, 1), support)
+    return {'W': W, 'cells': cells, 'rows': rows, 'total': total, 'frac': frac,
+            'grid': grid, 'fp_folder': fp_folder}
+
+
+def save_store(store, stem):
+    """
+    Saves the store as <stem>.npz, <stem>_index.npz and <stem>.json.
+    """
+    sp.save_npz(f'{stem}.npz', store['W'])
+    np.savez(f'{stem}_index.npz', cells=store['cells'], rows=store['rows'], total=store['total'])
+    with open(f'{stem}.json', 'w') as f:
+        json.dump({'grid': store['grid'], 'fp_folder': store['fp_folder'], 'frac': store['frac'],
+                   'n_footprints': store['W'].shape[0], 'n_cells': store['W'].shape[1],
+                   'nnz': int(store['W'].nnz)}, f, indent=4)
+
+
+def load_store(stem):
+    W = sp.load_npz(f'{stem}.npz').tocsr()
+    with np.load(f'{stem}_index.npz') as f:
+        cells, rows = f['cells'], f['rows']
+        # stores of the .nc files saved before total was stored
+        total = f['total'] if 'total' in f.files else np.asarray(W.sum(axis=1), dtype=np.float64).ravel()
+    with open(f'{stem}.json') as f:
+        meta = json.load(f)
+    return {'W': W, 'cells': cells, 'rows': rows, 'total': total, 'frac': meta.get('frac', 1.0),
+            'grid': meta['grid'], 'fp_folder': meta['fp_folder']}
+
+#%% Maps
+
+def read_map(path, band=1):
+    """
+    Returns the values (2D, float64, nodata as NaN) and the grid of a map: a
+    dictionary with x0 and y0 (top left corner), res, nrows and ncols. ESRI ASCII
+    grids (.asc) are read directly, other formats (e.g. .tif) with rasterio, of
+    which band (1-based) is read, e.g. one layer of a stack of MODIS maps. Maps in
+    lat-lon (e.g. the MODIS maps of read_modis.R) have geographic True in the grid,
+    with x0 and y0 in degrees lon and lat, and res_y the cell size in lat.
+    """
+    if path.endswith('.asc'):
+        header = {}
+        with open(path) as f:
+            for _ in range(6):
+                key, value = f.readline().split()
+                header[key.lower()] = float(value)
+        values = np.loadtxt(path, skiprows=6, dtype=np.float64)
+        res = header['cellsize']
+        nrows, ncols = int(header['nrows']), int(header['ncols'])
+        x0 = header['xllcorner'] if 'xllcorner' in header else header['xllcenter'] - res/2
+        yll = header['yllcorner'] if 'yllcorner' in header else header['yllcenter'] - res/2
+        if 'nodata_value' in header:
+            values[values == header['nodata_value']] = np.nan
+        return values, {'x0': x0, 'y0': yll + nrows*res, 'res': res, 'nrows': nrows, 'ncols': ncols}
+
+    import rasterio
+    with rasterio.open(path) as src:
+        values = src.read(int(band)).astype(np.float64)
+        if src.nodata is not None:
+            values[values == src.nodata] = np.nan
+        t = src.transform
+        map_grid = {'x0': t.c, 'y0': t.f, 'res': t.a, 'nrows': src.height, 'ncols': src.width}
+        if src.crs is not None and src.crs.is_geographic:
+            map_grid.update(geographic=True, res_y=-t.e)
+        return values, map_grid
+
+
+def map_values(store, values, map_grid):
+    """
+    store: store of the footprint weights
+    values: values of the map (2D)
+    map_grid: grid of the map (see read_map), may differ from the reference grid,
+              and may be in lat-lon
+
+    Returns the value of the map at the centre of every cell of the store (NaN
+    outside the map).
+    """
+    grid = store['grid']
+    rows, cols = np.divmod(store['cells'], grid['ncols'])
+    cx = grid['x0'] + (cols + 0.5) * grid['res']
+    cy = grid['y0'] - (rows + 0.5) * grid['res']
+    if map_grid.get('geographic', False):
+        cy, cx = rd_to_wgs84(cx, cy)
+
+    map_cols = np.floor((cx - map_grid['x0']) / map_grid['res']).astype(np.int64)
+    map_rows = np.floor((map_grid['y0'] - cy) / map_grid.get('res_y', map_grid['res'])).astype(np.int64)
+    inside = (map_cols >= 0) & (map_cols < map_grid['ncols']) & (map_rows >= 0) & (map_rows < map_grid['nrows'])
+
+    result = np.full(len(cols), np.nan)
+    result[inside] = values[map_rows[inside], map_cols[inside]]
+    return result
+
+#%% Footprint-weighted values
+
+def footprint_total(store, W, rows=None, full_footprint=False):
+    """
+    Returns the denominator of the footprint-weighted values of the rows of W: the
+    weight of the cells in the store (W.sum(axis=1)), or with full_footprint the
+    weight of the whole footprint (total, see above).
+    """
+    if full_footprint:
+        return store['total'] if rows is None else store['total'][rows]
+    return np.asarray(W.sum(axis=1)).ravel()
+
+
+def weighted_mean(store, cell_values, rows=None, full_footprint=False):
+    """
+    store: store of the footprint weights
+    cell_values: values at the cells of the store (map_values)
+    rows: rows of W (footprints) to calculate (default: all)
+    full_footprint: divide by the weight of the whole footprint instead of the
+                    weight of the cells in the store (only differs for a store
+                    of an archive, see above)
+
+    Returns the footprint-weighted average of every footprint (as
+    calc_ruimt_data_in_fp.R with cat = F).
+    """
+    W = store['W'] if rows is None else store['W'][rows]
+    total = footprint_total(store, W, rows, full_footprint)
+    return (W @ np.nan_to_num(cell_values, nan=0.0)) / total
+
+
+def class_fractions(store, cell_values, codes, rows=None, full_footprint=False):
+    """
+    store: store of the footprint weights
+    cell_values: codes at the cells of the store (map_values)
+    codes: codes of the classes
+    rows: rows of W (footprints) to calculate (default: all)
+    full_footprint: divide by the weight of the whole footprint (see weighted_mean)
+
+    Returns the footprint-weighted fraction of every class of every footprint
+    (footprints x codes, as calc_ruimt_data_in_fp.R with cat = T).
+    """
+    W = store['W'] if rows is None else store['W'][rows]
+    total = footprint_total(store, W, rows, full_footprint)
+
+    # one-hot matrix of the class of every cell (cells x classes)
+    codes = np.asarray(codes, dtype=np.float64)
+    order = np.argsort(codes)
+    pos = np.searchsorted(codes[order], cell_values)
+    pos = np.clip(pos, 0, len(codes)-1)
+    valid = codes[order][pos] == cell_values
+    onehot = sp.csr_matrix((np.ones(valid.sum()), (np.nonzero(valid)[0], order[pos[valid]])),
+                           shape=(len(cell_values), len(codes)))
+
+    return (W @ onehot).toarray() / total[:, None]
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    source = args[0] if len(args) > 0 else 'airborne'
+    n_workers = int(args[1]) if len(args) > 1 else 1
+    from_archive = len(args) > 2 and args[2] == 'archive'
+
+    path = '/lustre/backup/WUR/ESG/rietm018/thesis/'
+
+    fp_folders = {'airborne': f'{path}fp_airborne_rasters_0907/',
+                  'tower': f'{path}fp_rasters_all_0607/'}
+
+    # Reference grid: the grid of LGN2020 (5 m)
+    _, grid = read_map(f'{path}ruimtelijke_data_veenweiden/Landgebruik_LGN2020/LGN2020.tif')
+
+    # Read the footprints from the archive (footprint_archive.py), or from the .nc files
+    archive_stem = f'{path}fp_archive_{source}' if from_archive else None
+    store = build_store(fp_folders[source], grid, n_workers, archive_stem)
+    save_store(store, f'{path}fp_weights_{source}')
+    print(f"{source}: {store['W'].shape[0]} footprints, {store['W'].shape[1]} cells, {store['W'].nnz} weights")
+    if store['frac'] < 1:
+        print(f"footprints truncated to {store['frac']:.0%} of their value (archive): the footprint-weighted "
+              f"values are averages over the support (see weighted_mean)")
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: find_owasis_for_air.R, find_ndvi_for_air.R and calc_ndvi_in_fp.R
+
+This script attaches time-varying drivers (e.g. OWASIS GWS/BBB per day, MODIS
+NDVI/EVI per 16-day composite, KNMI meteorology per site) to the observations,
+with an as-of join on the times. Before, the closest OWASIS day and the two
+closest MODIS composites were found per footprint in the HPC scripts
+(find_owasis_for_air.R, find_ndvi_for_air.R), which read the airborne dataset
+and parsed the dates again for every footprint.
+
+Here, the times of the drivers are sorted once, and for all observations at once
+(per group, e.g. per site or per footprint) the driver times before and after the
+observation are found with a binary search (np.searchsorted):
+    backward:       the last driver time at or before the observation
+    nearest:        the closest driver time (the earlier one if both are equally
+                    close, as find_owasis_for_air.R)
+    interpolate:    linear interpolation between the driver times before and
+                    after the observation, as calc_ndvi_in_fp.R (NaN if one of
+                    the two is missing)
+With a tolerance (in days), drivers that are further away are not used.
+
+asof_join attaches driver values of a table (e.g. KNMI per site and day) to the
+observations. attach_map_driver attaches drivers that are maps (e.g. one OWASIS
+map per day) to the footprints: the footprint-weighted average of every map that
+is needed is calculated with the store of the footprint weights (footprint_store.py),
+only for the footprints that use that map.
+
+The maps are either separate files (e.g. the OWASIS maps, named <yyyydoy>...), or
+the layers of one stacked raster (e.g. NDVI_all.tiff and EVI_all.tiff of
+read_modis.R, in lat-lon), of which the layer names are the yeardoy of the MODIS
+composites (stack_layers).
+
+Run as:
+    python temporal_join.py <map folder | stacked raster> <name> <nearest|interpolate>
+        the maps of the folder are named <yyyydoy>..., as the OWASIS files; the
+        layers of a stacked raster (.tif or .tiff) are named <yyyydoy>, as the
+        MODIS stacks
+
+Input: the maps or table of the driver, the stores of the footprint weights and
+       the final merged dataset
+Output: the final merged dataset with the driver
+
+Functions:
+    bracket:            the driver rows before and after every observation
+    asof_join:          attach the values of a driver table to the observations
+    attach_map_driver:  attach the footprint-weighted values of driver maps to the observations
+    folder_maps:        the dates and files of the maps of a folder
+    stack_layers:       the dates and bands of the layers of a stacked raster
+"""
+#%% Import packages
+
+import os
+import sys
+import logging
+import numpy as np
+import pandas as pd
+
+from footprint_store import load_store, read_map, map_values, weighted_mean
+
+logger = logging.getLogger(__name__)
+
+#%% As-of join
+
+def _seconds(times):
+    return pd.to_datetime(pd.Series(times)).to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+
+def _group_codes(obs, driver, by):
+    """
+    Returns the group number of every observation and every driver row.
+    """
+    if by is None:
+        return np.zeros(len(obs), dtype=np.int64), np.zeros(len(driver), dtype=np.int64)
+    keys = pd.concat([obs[by], driver[by]], ignore_index=True)
+    codes = keys.groupby(by, sort=False, dropna=False).ngroup().to_numpy(dtype=np.int64)
+    return codes[:len(obs)], codes[len(obs):]
+
+
+def bracket(obs_times, obs_groups, drv_times, drv_groups):
+    """
+    obs_times, drv_times: times of the observations and the driver (seconds)
+    obs_groups, drv_groups: group numbers of the observations and the driver
+
+    Returns for every observation the driver row (position in the driver arrays)
+    with the last time at or before the observation (before) and the first time
+    at or after the observation (after), in the same group; -1 if there is none.
+    """
+    if len(obs_times) == 0 or len(drv_times) == 0:
+        none = np.full(len(obs_times), -1, dtype=np.int64)
+        return none, none.copy()
+
+    # one sorted key of group and time, so all groups are searched at once
+    t0 = min(obs_times.min(), drv_times.min())
+    span = max(obs_times.max(), drv_times.max()) - t0 + 1
+    order = np.lexsort((drv_times, drv_groups))
+    drv_key = drv_groups[order] * span + (drv_times[order] - t0)
+    obs_key = obs_groups * span + (obs_times - t0)
+
+    before = np.searchsorted(drv_key, obs_key, side='right') - 1
+    after = np.searchsorted(drv_key, obs_key, side='left')
+
+    ok_before = before >= 0
+    ok_before[ok_before] = drv_groups[order][before[ok_before]] == obs_groups[ok_before]
+    ok_after = after < len(drv_key)
+    ok_after[ok_after] = drv_groups[order][after[ok_after]] == obs_groups[ok_after]
+
+    before = np.where(ok_before, order[np.clip(before, 0, None)], -1)
+    after = np.where(ok_after, order[np.clip(after, 0, len(order)-1)], -1)
+    return before, after
+
+
+def join_weights(obs_times, drv_times, before, after, how='nearest', tolerance=None):
+    """
+    Returns the weights of the driver rows before and after every observation
+    (0 if a row is not used, NaN if the observation gets no value).
+    """
+    has_before, has_after = before >= 0, after >= 0
+    d_before = np.where(has_before, obs_times - drv_times[before], np.inf) / 86400
+    d_after = np.where(has_after, drv_times[after] - obs_times, np.inf) / 86400
+    if tolerance is not None:
+        d_before[d_before > tolerance] = np.inf
+        d_after[d_after > tolerance] = np.inf
+
+    if how == 'backward':
+        w_before = np.where(np.isfinite(d_before), 1.0, np.nan)
+        w_after = np.zeros(len(obs_times))
+    elif how == 'nearest':
+        use_before = d_before <= d_after
+        found = np.isfinite(np.minimum(d_before, d_after))
+        w_before = np.where(found, use_before.astype(np.float64), np.nan)
+        w_after = np.where(found, 1.0 - use_before, np.nan)
+    elif how == 'interpolate':
+        found = np.isfinite(d_before) & np.isfinite(d_after)
+        exact = d_before == 0
+        span = np.where(found & ~exact, d_before + d_after, 1.0)
+        w_before = np.where(exact, 1.0, np.where(found, d_after / span, np.nan))
+        w_after = np.where(exact, 0.0, np.where(found, d_before / span, np.nan))
+    else:
+        raise ValueError(f"Unknown how '{how}', use 'backward', 'nearest' or 'interpolate'")
+    return w_before, w_after
+
+
+def asof_join(obs, driver, on, values, by=None, how='nearest', tolerance=None):
+    """
+    obs: observations (dataframe)
+    driver: driver table, with a row per time (and group)
+    on: column of the times, in obs and driver (or a tuple (obs column, driver column))
+    values: columns of the driver to attach
+    by: columns of the groups (e.g. 'site'), in obs and driver (optional)
+    how: 'backward', 'nearest' or 'interpolate'
+    tolerance: maximum number of days between the observation and the driver
+
+    Returns obs with the driver values.
+    """
+    obs_on, drv_on = (on, on) if isinstance(on, str) else on
+    by = [by] if isinstance(by, str) else by
+
+    obs_times, drv_times = _seconds(obs[obs_on]), _seconds(driver[drv_on])
+    obs_groups, drv_groups = _group_codes(obs, driver, by)
+    before, after = bracket(obs_times, obs_groups, drv_times, drv_groups)
+    w_before, w_after = join_weights(obs_times, drv_times, before, after, how, tolerance)
+
+    obs = obs.copy()
+    for col in values:
+        v = driver[col].to_numpy(dtype=np.float64)
+        v_before = np.where(w_before > 0, v[before], 0)
+        v_after = np.where(w_after > 0, v[after], 0)
+        obs[col] = w_before * v_before + w_after * v_after
+    return obs
+
+#%% Driver maps in the footprints
+
+def attach_map_driver(obs, store, map_times, map_files, name, how='interpolate', tolerance=None, bands=None):
+    """
+    obs: observations of one source, with old_rownames and Datetime
+    store: store of the footprint weights of the source (footprint_store.py)
+    map_times: time of every map
+    map_files: file of every map (read with read_map)
+    name: name of the driver column
+    how, tolerance: see asof_join
+    bands: band of every map in its file, for the layers of a stacked raster
+           (stack_layers). If not given, the first band of every file is read
+
+    Returns the footprint-weighted value of the driver of every observation. Every
+    map is read once, and only for the footprints of the observations that use it.
+    """
+    obs_times, drv_times = _seconds(obs['Datetime']), _seconds(map_times)
+    before, after = bracket(obs_times, np.zeros(len(obs), dtype=np.int64),
+                            drv_times, np.zeros(len(drv_times), dtype=np.int64))
+    w_before, w_after = join_weights(obs_times, drv_times, before, after, how, tolerance)
+
+    # row of the store of every observation
+    store_row = pd.Series(np.arange(len(store['rows'])), index=store['rows'])
+    rows = store_row.reindex(obs['old_rownames']).to_numpy()
+    has_fp = ~np.isnan(rows)
+
+    result = np.where(np.isnan(w_before) | ~has_fp, np.nan, 0.0)
+    for m in np.unique(np.concatenate([before[w_before > 0], after[w_after > 0]])):
+        weight = np.where(before == m, w_before, 0) + np.where(after == m, w_after, 0)
+        use = (weight > 0) & has_fp
+        if not use.any():
+            continue
+        values, map_grid = read_map(map_files[m], 1 if bands is None else bands[m])
+        cell_values = map_values(store, values, map_grid)
+        result[use] += weight[use] * weighted_mean(store, cell_values, rows[use].astype(np.int64))
+        logger.info('%s: %s (band %s), %d observations', name, os.path.basename(map_files[m]),
+                    1 if bands is None else bands[m], use.sum())
+    return result
+
+#%% Maps of the drivers
+
+def folder_maps(map_folder):
+    """
+    Returns the dates and files of the maps of a folder (.asc or .tif), from the
+    yeardoy at the start of the file names (as the OWASIS files).
+    """
+    map_files = sorted(os.path.join(map_folder, file) for file in os.listdir(map_folder)
+                       if file.endswith(('.asc', '.tif')))
+    map_times = pd.to_datetime([os.path.basename(file)[:7] for file in map_files], format='%Y%j')
+    return map_times, map_files
+
+
+def stack_layers(path):
+    """
+    path: stacked raster with one layer per date (e.g. NDVI_all.tiff or EVI_all.tiff
+          of read_modis.R), with the yeardoy of the layer as its name
+
+    Returns the dates and bands (1-based) of the layers, and the file of every
+    layer (the stacked raster), for attach_map_driver.
+    """
+    import rasterio
+    with rasterio.open(path) as src:
+        names = list(src.descriptions)
+    if any(layer is None for layer in names):
+        raise ValueError(f'{path} has layers without a name; the layers of a stacked raster '
+                         f'should be named <yyyydoy> (as in read_modis.R)')
+    map_times = pd.to_datetime([layer[:7] for layer in names], format='%Y%j')
+    bands = list(range(1, len(names)+1))
+    return map_times, [path] * len(names), bands
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    map_folder, name = args[0], args[1]
+    how = args[2] if len(args) > 2 else 'interpolate'
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    stores = {'airborne': f'{WD}fp_weights_airborne', 'tower': f'{WD}fp_weights_tower'}
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # Dates of the maps, from the yeardoy of the layer names of a stacked raster
+    # (MODIS), or from the yeardoy at the start of the file names (OWASIS)
+    if os.path.isfile(map_folder):
+        map_times, map_files, bands = stack_layers(map_folder)
+    else:
+        map_times, map_files = folder_maps(map_folder)
+        bands = None
+
+    merged = pd.read_csv(f"{WD}merged_0228_final.csv", index_col=0)
+    merged['Datetime'] = pd.to_datetime(merged['Datetime'])
+
+    # As in the HPC scripts, the date of the observation is compared to the date of the maps
+    obs_dates = merged[['source', 'old_rownames']].assign(Datetime=merged['Datetime'].dt.normalize())
+    merged[name] = np.nan
+    for source, stem in stores.items():
+        rows = (merged['source'] == source).to_numpy()
+        merged.loc[rows, name] = attach_map_driver(obs_dates[rows], load_store(stem), map_times,
+                                                   map_files, name, how, bands=bands)
+
+    merged.to_csv(f"{WD}merged_0228_final.csv")
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: clean_tower_data.py
+
+This script cleans the tower data in the same way as clean_tower_data.py, but
+streaming: the raw file is read in chunks of rows, so the memory that is needed
+depends on the chunk size and not on the size of the raw file. All sites over all
+years can therefore be cleaned on a login node.
+
+Only the columns that are needed are read (tower_usecols in cleaning.py), so the
+SWC, KNMI and NOBV radiometer columns that are dropped anyway are not parsed. The
+columns are read with fixed types (tower_dtypes in cleaning.py), so a column is
+written in the same way in every chunk.
+
+The cleaning is done in two passes over the data:
+    1. every chunk is read and cleaned with the cleaning steps per row
+       (prepare_tower: OWD >= 0, NDVI/EVI <= 1, the ALB_MS/ALB_RF date exclusion,
+       the PAR swap fixes, etc.). The chunk is written to a temporary file, and
+       the quantile sketch of its CO2flx is merged with the sketches of the
+       other chunks (quantile_sketch.py). Then only the CO2flx column of the
+       temporary file is read again, to collect the values in the bins of the
+       sketch around the quantiles, with which the quantiles are exact
+    2. the temporary file is read in chunks, and the rows outside the 1% and 99%
+       quantiles of CO2flx and the rows with PAR_abs <= 0 or without Tsfc are
+       thrown out. The remaining rows are appended to the output file. In this
+       pass, the values are read and written as text, so they are not changed
+The output has the same rows and values as clean_tower_data.py. The number of
+rows that every quality rule throws out is added up over the chunks and saved
+next to the output (validation.py).
+
+Run as:
+    python clean_tower_data_streaming.py <chunksize>
+
+Input: tower data (already overlaid with reclassified spatial info)
+Output: the cleaned tower dataset, the thresholds of CO2flx (.json) and the
+        validation report (.csv)
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from cleaning import prepare_tower, tower_post_filter, tower_usecols, tower_dtypes, trim_flux, flux_col
+from quantile_sketch import new_sketch, merge_sketches, boundary_values, flux_thresholds, save_thresholds
+from validation import save_report
+
+#%% Streaming cleaning
+
+def clean_tower_streaming(raw_path, out_path, chunksize=100000, report=None):
+    """
+    raw_path: raw tower file (already overlaid with reclassified spatial info)
+    out_path: file of the cleaned tower dataset
+    chunksize: number of rows per chunk
+    report: list to which the validation reports of the chunks are added (optional)
+
+    Returns the thresholds of CO2flx.
+    """
+    # positions of the needed columns, with the index column (position 0)
+    header = pd.read_csv(raw_path, index_col=0, nrows=0).columns
+    needed = tower_usecols(header)
+    usecols = [0] + [i+1 for i, col in enumerate(header) if col in needed]
+
+    # Pass 1: clean every chunk and merge the quantile sketches
+    tmp_path = f'{out_path}.tmp'
+    sketch = None
+    first = True
+    for chunk in pd.read_csv(raw_path, index_col=0, usecols=usecols, dtype=tower_dtypes(needed), chunksize=chunksize):
+        chunk = prepare_tower(chunk, report)
+        chunk['post_ok'] = tower_post_filter(chunk, report)
+
+        chunk_sketch = new_sketch(chunk[flux_col])
+        sketch = chunk_sketch if sketch is None else merge_sketches(sketch, chunk_sketch)
+
+        chunk.to_csv(tmp_path, mode='w' if first else 'a', header=first)
+        first = False
+
+    # exact quantiles from the values in the bins around the quantiles (the
+    # values are read back exactly as they were written)
+    values = [boundary_values(sketch, chunk[flux_col])
+              for chunk in pd.read_csv(tmp_path, usecols=[flux_col], float_precision='round_trip', chunksize=chunksize)]
+    thresholds = flux_thresholds(sketch, np.concatenate(values))
+
+    # Pass 2: throw out rows, and append the others to the output. The values
+    # are read as text and only CO2flx and post_ok are converted for the filter
+    n_rows = 0
+    first = True
+    for chunk in pd.read_csv(tmp_path, index_col=0, dtype=str, keep_default_na=False, chunksize=chunksize):
+        chunk = chunk[(chunk['post_ok'] == 'True').to_numpy()].drop(columns='post_ok')
+        flux = pd.DataFrame({flux_col: np.array([float(v) if v != '' else np.nan for v in chunk[flux_col]]),
+                             'site': chunk['site'].to_numpy()})
+        keep = trim_flux(flux, thresholds['low'], thresholds['high'], 'tower', report)
+
+        # Reset index before saving, only keep recent index
+        chunk = chunk[keep]
+        chunk.index = pd.RangeIndex(n_rows, n_rows + len(chunk))
+        n_rows += len(chunk)
+
+        chunk.to_csv(out_path, mode='w' if first else 'a', header=first)
+        first = False
+
+    os.remove(tmp_path)
+    return thresholds
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    chunksize = int(args[0]) if len(args) > 0 else 100000
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+
+    report = []
+    thresholds = clean_tower_streaming(f"{WD}tower_1129_reclassified.csv", f"{WD}tower_1129_final.csv", chunksize, report)
+
+    # Save the thresholds of CO2flx and the validation report next to the dataset
+    save_thresholds(f"{WD}tower_1129_final_thresholds.json", thresholds)
+    save_report(f"{WD}tower_1129_final.csv", report)
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: clean_tower_data.py, clean_airborne_data.py and merge_airborne_tower.py
+
+This script contains the cleaning steps of the tower and airborne data, so that
+the cleaning scripts (clean_tower_data.py, clean_airborne_data.py) and the
+incremental ingestion of new data (incremental_ingest.py) clean the data in
+exactly the same way.
+
+All steps are done per row (the result of a row does not depend on the other
+rows), except for throwing out the highest and lowest 1% of CO2flx, which needs
+the quantiles of all rows. The cleaning is therefore split in:
+    prepare_tower / prepare_airborne:   all steps per row: calculate the new
+            variables, filter the rows that are thrown out before the CO2flx
+            quantiles are calculated, rename and drop columns
+    tower_post_filter / airborne_post_filter: the rows that are thrown out after
+            the CO2flx quantiles are calculated (so these rows do count for the
+            quantiles)
+    trim_flux:  throw out the highest and lowest 1% of CO2flx, with the 1% and
+                99% quantiles from a quantile sketch (quantile_sketch.py)
+The result is the same as the original order of the steps.
+
+The rows are thrown out with the quality rules of each stage (tower_rules,
+tower_post_rules, airborne_rules, airborne_post_rules and flux_rules), which are
+checked with validation.py. If a report (list) is given, the number of rows that
+every rule throws out is added to it per site.
+
+OWD and Exp_PeatD are calculated with open_water_depth and exp_peat_depth, which
+also work on arrays (e.g. the maps of the model application in 06_model_application).
+
+For merging, merge_sources merges the cleaned tower and airborne data with a
+similar datetime format, and season_rows gives the rows of the seasonal subsets.
+"""
+#%% Import packages
+
+import math
+import numpy as np
+import pandas as pd
+
+from validation import validate
+
+#%% Settings
+
+# column of CO2flx (after prepare_tower/prepare_airborne), of which the 1% and 99%
+# quantiles are calculated. For the tower data, the quantiles used to be
+# calculated from another column (NEECO2) than the one that is trimmed (NEE_CO2)
+flux_col = 'CO2flx'
+
+# Tower sites and periods in which PAR and RPAR were accidentally reversed in
+# preprocessing: (site, year, month, days), with days None for the whole month
+par_swaps = [('HOC', 2021, 10, None), ('HOC', 2021, 11, None),  # 1. HOC 2021-10 and 11
+             ('LDC', 2021, 10, None), ('LDC', 2021, 11, [1, 2]), # 2. LDC 2021-10 and 2021-11-02 and 01
+             ('LDC', 2022, 11, None),                           # 3. LDC 2022-11
+             ('HOH', 2021, 11, None),                           # 4. HOH 2021-11
+             ('HOH', 2022, 11, None), ('HOH', 2022, 12, None),  # 5. HOH 2022-11 and 2022-12
+             # 6. AMM 2022-11: from 27-11 PAR>RPAR, but the calculation is
+             # adjusted for the whole month (only where RPAR>PAR)
+             ('AMM', 2022, 11, None)]
+
+colstodrop_tower = ['filename', 'zm','measuringPeriod', 'hour','F_CO2','CO2_strg', 'SigStr_CO2',
+              'co2_var', 'CH4_strg','h', 'sigmav','sumSOIL', 'NEE_CH4_MDS','NEE_CO2_MDS',
+              'SWC_1_005','SWC_1_015','SWC_1_025','SWC_1_035','SWC_1_045','SWC_1_055',
+              'SWC_1_065','SWC_1_075','SWC_1_085','SWC_1_095','SWC_1_105','SWC_1_115',
+              'WL_cor','CO2_flag','CH4_flag','h2o_flag','H_flag','LE_flag','Tau_flag',
+              'spikes_hf','amp_res_hf','drop_out_hf','abs_lim_hf','skw_kur_hf','skw_kur_sf',
+              'discontinuities_hf','discontinuities_sf','time_lag_hf','time_lag_sf',
+              'non_steady_wind_hf','attack_angle_hf','X.z.d..L','ol','model','x_peak',
+              'x_offset','SWIN_KNMI','Tair_KNMI','PA_KNMI','RH_KNMI','WIND_KNMI',
+              'WINS_KNMI','RAIN_KNMI','SWIN_NOBV1','SWIN_NOBV2','SWIN_NOBV3','SWIN_NOBV4',
+              'SWOUT_NOBV1','SWOUT_NOBV2','SWOUT_NOBV3','SWOUT_NOBV4','LWIN_NOBV1',
+              'LWIN_NOBV2','LWIN_NOBV3','LWIN_NOBV4','LWOUT_NOBV1','LWOUT_NOBV2',
+              'LWOUT_NOBV3','LWOUT_NOBV4','PAR_NOBV1','PAR_NOBV2','PAR_NOBV3',
+              'PAR_NOBV4','RPAR_NOBV1','RPAR_NOBV2','RPAR_NOBV3','RPAR_NOBV4','NIR_NOBV1',
+              'NIR_NOBV2','NIR_NOBV3','NIR_NOBV4','RNIR_NOBV1','RNIR_NOBV2','RNIR_NOBV3',
+              'RNIR_NOBV4','Tair_NOBV1','Tair_NOBV2','Tair_NOBV3','Tair_NOBV4',
+              'RH_NOBV1','RH_NOBV2','RH_NOBV3','RH_NOBV4','WIND_NOBV2','VPD_NOBV3',
+              'VPD_NOBV4','sunrise','sunset','daytime','WINS_f','VPD_EP_f','WIND_EP_f',
+              'WINS_EP_f','UstarThreshold', 'RAIN', 'umean', 'wind_dir', 'WIND_EP',
+              'ustar', 'u_var','v_var','DateTime', 'ET', 'RPAR', 'level_0', 'PAR_abs_temp',
+              'PAR', 'SWIN', 'SWOUT', 'LWIN', 'LWOUT']
+
+colstodrop_airborne = ['level_0','Label', 'zm','wind_dir', 'umean', 'sigmav', 'P',  'ol',
+              'QC_CH4flx', 'QC_filt', 'QC_CO2flx', 'h', 'QC_H', 'QC_LE', 'QC_Ustar',
+              'ahn25_1','Droogtelegging_0', 'Droogtelegging_1', 'Droogtelegging_2',
+              'Droogtelegging_3', 'Droogtelegging_4', 'Droogtelegging_5', 'E_act',
+              'sumSOIL', 'Height', 'WinLen', 'WinLenGPS', 'WinTime','StepLen',
+              'CO2', 'ustar','H', 'LE', 'Net','PAR_i','PAR_r','old_rownames']
+
+#%% Quality rules
+# Every rule returns for every row whether it passes (see validation.py)
+
+# Omit OWASIS values with unrepresentative modeled GWS
+# For ALB_MS and ALB_RF, 01-01-2023 up until 13-01-2023. These values show very
+# low groundwater tables, i.e. very high drainage (highest of the entire dataset),
+# while in this time of the year high groundwater tables are expected
+alb_start, alb_end = pd.to_datetime('2023-01-01'), pd.to_datetime('2023-01-14')
+
+tower_rules = [
+    {'name': 'OWD >= 0', 'check': lambda twr: twr['OWD'] >= 0},
+    {'name': 'not ALB_MS/ALB_RF 2023-01-01 to 13', 'check': lambda twr: ~(
+        twr['site'].isin(['ALB_MS', 'ALB_RF'])
+        & (twr['datetime'] < alb_end) & (twr['datetime'] >= alb_start))},
+    {'name': 'NDVI <= 1', 'check': lambda twr: twr['NDVI'] <= 1},
+    {'name': 'EVI <= 1', 'check': lambda twr: twr['EVI'] <= 1}]
+
+tower_post_rules = [
+    {'name': 'PAR_abs > 0', 'check': lambda twr: twr['PAR_abs'] > 0},
+    {'name': 'Tsfc not NaN', 'check': lambda twr: twr['Tsfc'].notna()}]
+
+airborne_rules = [
+    {'name': 'OWD >= 0', 'check': lambda data: data['OWD'] >= 0},
+    {'name': 'QC_CO2flx <= 6', 'check': lambda data: data['QC_CO2flx'] <= 6},
+    {'name': 'QC_Ustar <= 6', 'check': lambda data: data['QC_Ustar'] <= 6},
+    {'name': 'umean < 20', 'check': lambda data: data['umean'] < 20}]
+
+airborne_post_rules = [
+    {'name': 'BBB not NaN', 'check': lambda data: data['BBB'].notna()}]
+
+
+def flux_rules(low, high):
+    """
+    Returns the rules that throw out the highest and lowest 1% of CO2flx (low and
+    high: the 1% and 99% quantiles).
+    """
+    return [{'name': 'CO2flx > 1% quantile', 'check': lambda data: data[flux_col] > low},
+            {'name': 'CO2flx < 99% quantile', 'check': lambda data: data[flux_col] < high}]
+
+#%% Groundwater
+
+def open_water_depth(ahn, GWS):
+    """
+    Returns OWD (in cm) from the surface height ahn (in cm) and the groundwater
+    level GWS (in m).
+    """
+    return ahn - GWS*100 # ahn in cm, GWS in m
+
+
+def exp_peat_depth(PeatD, OWD):
+    """
+    Returns the Air Exposed Peat Depth: if peat depth < OWD, air exposed peat =
+    peat depth, and if peat depth >= OWD, air exposed peat = OWD.
+    """
+    return np.where(PeatD < OWD, PeatD, OWD)
+
+#%% Tower data
+
+def tower_par_abs(twr):
+    """
+    Calculates PAR_abs. In some instances, PAR and RPAR values were accidentally
+    reversed in preprocessing. For these time periods (par_swaps), the calculation
+    of PAR_abs is adjusted so that PAR_abs is a positive number.
+    """
+    # Create temporary (_temp) PAR_abs column
+    twr.loc[:, 'PAR_abs_temp'] = twr['PAR'] - twr['RPAR']
+
+    # Assign values of PAR_abs_temp to PAR_abs. The manually corrected values are
+    # added to PAR_abs, the original values of PAR_abs remain in PAR_abs_temp
+    twr['PAR_abs'] = twr['PAR_abs_temp']
+
+    for site, year, month, days in par_swaps:
+        # Create a boolean series for the rows for which PAR and RPAR should be reversed
+        rws_to_change = (twr['site'] == site) & (twr['datetime'].dt.year == year) & (twr['datetime'].dt.month == month)
+        if days is not None:
+            rws_to_change &= twr['datetime'].dt.day.isin(days)
+
+        twr.loc[rws_to_change, 'PAR_abs'] = np.where(
+            twr.loc[rws_to_change, 'RPAR'] > twr.loc[rws_to_change, 'PAR'], # where RPAR>PAR (in reality, PAR is > RPAR)
+            twr.loc[rws_to_change, 'RPAR'] - twr.loc[rws_to_change, 'PAR'], # perform RPAR-PAR instead of
+            twr.loc[rws_to_change, 'PAR'] - twr.loc[rws_to_change, 'RPAR'] # the other way around
+        )
+    return twr
+
+
+def prepare_tower(twr, report=None):
+    """
+    twr: tower data (already overlaid with reclassified spatial info)
+    report: list to which the validation report is added (optional)
+
+    Returns the tower data with all cleaning steps per row (see clean_tower_data.py).
+    """
+    # Calculate OWD from GWS and AHN
+    twr['OWD'] = open_water_depth(twr['ahn'], twr['GWS'])
+
+    # Calculate Air Exposed Peat Depth
+    twr['Exp_PeatD'] = exp_peat_depth(twr['PeatD'], twr['OWD'])
+
+    twr['datetime'] = pd.to_datetime(twr['datetime'], format = "%d-%m-%Y %H:%M")
+
+    # Only keep rows with OWD >= 0, without the unrepresentative OWASIS values of
+    # ALB_MS and ALB_RF, and with NDVI <= 1 and EVI <= 1 (tower_rules)
+    twr = twr[validate(twr, tower_rules, 'tower', 'prepare', report)].copy()
+
+    twr = tower_par_abs(twr)
+
+    # Rename columns to match column names of airborne data
+    twr = twr.rename(columns={'DOY':'DoY', 'NEE_CO2':'CO2flx'})
+
+    # Assign new columns that exist in airborne data
+    twr['FPlen_80'] = np.nan
+    twr['FPwgt_max'] = np.nan
+
+    # Drop unnecessary columns (the ones that are read, see tower_usecols)
+    twr = twr.drop([col for col in colstodrop_tower if col in twr.columns], axis=1)
+
+    # Rename row numbers that are connected to the footprint files
+    return twr.rename(columns={'Unnamed: 0':'old_rownames'})
+
+
+def tower_usecols(header):
+    """
+    header: columns of the raw tower file
+
+    Returns the columns that are needed for cleaning: all columns that are not
+    dropped, and PAR and RPAR for calculating PAR_abs.
+    """
+    return [col for col in header if col not in colstodrop_tower or col in ['PAR', 'RPAR']]
+
+
+# Types of the tower columns that are not read as float (tower_dtypes)
+tower_col_types = {'datetime': str, 'site': str, 'Unnamed: 0': 'Int64', 'DOY': 'Int64'}
+
+def tower_dtypes(columns):
+    """
+    columns: columns of the raw tower file that are read (e.g. tower_usecols)
+
+    Returns the type of every column: float for the measurements, and the types of
+    tower_col_types for the others. If the types are inferred, a column of whole
+    numbers is read as int in a chunk of rows without NaNs and as float in a chunk
+    with NaNs (5 or 5.0 in the output), so the cleaned data would depend on how
+    the rows are divided over the chunks.
+    """
+    return {col: tower_col_types.get(col, np.float64) for col in columns}
+
+
+def tower_post_filter(twr, report=None):
+    """
+    Returns the rows to keep: where PAR_abs is > 0 (not NaN) and Tsfc is not NaN.
+    """
+    return validate(twr, tower_post_rules, 'tower', 'post', report)
+
+#%% Airborne data
+
+def prepare_airborne(data, report=None):
+    """
+    data: airborne data (already overlaid with reclassified spatial info)
+    report: list to which the validation report is added (optional)
+
+    Returns the airborne data with all cleaning steps per row (see clean_airborne_data.py).
+    """
+    # Calculate E_sat, i.e. saturation vapor pressure
+    # Mangus's equation is used, recommended by the WMO (2021)
+    # https://library.wmo.int/doc_num.php?explnum_id=11386 , ISBN 978-92-63-10008-5
+    E_sat_hPa = data['Tair'].apply(lambda x: 6.112 * math.exp(17.62 * (x-273.15) / (243.12 + (x-273.15))))
+    E_sat_kPa = E_sat_hPa / 10
+
+    # Calculate VPD from E_sat and E_act
+    data['VPD'] = E_sat_kPa - data['E_act'] # in kPa
+
+    # Calculate absorbed PAR, after resetting the index for indexing with .loc
+    data = data.reset_index()
+    data.loc[:, 'PAR_abs'] = data['PAR_i'] - data['PAR_r']
+
+    # Calculate OWD from GWS and AHN
+    data['OWD'] = open_water_depth(data['ahn'], data['GWS'])
+
+    # Calculate Air Exposed Peat Depth
+    data['Exp_PeatD'] = exp_peat_depth(data['PeatD'], data['OWD'])
+
+    # Change unit Tsfc from K to degrees C
+    data['Tsfc'] = data['Tsfc']-273.15
+
+    # Site names for tower are the tower site names, for airbrone just air
+    data['site'] = 'air'
+
+    # Only keep rows with OWD >= 0, quality flags for CO2 and Ustar, filter
+    # umean<20 (airborne_rules)
+    data = data[validate(data, airborne_rules, 'airborne', 'prepare', report)].copy()
+
+    # set all values NDVI and EVI lower than 0 to 0
+    data['NDVI'] = data['NDVI'].where(data['NDVI']>=0, other=0)
+    data['EVI'] = data['EVI'].where(data['EVI']>=0, other=0)
+
+    # Drop unneccessary columns
+    data = data.drop(colstodrop_airborne, axis='columns')
+
+    # Rename row numbers that are connected to the footprint files
+    return data.rename(columns={'Unnamed: 0':'old_rownames'})
+
+
+def airborne_post_filter(data, report=None):
+    """
+    Returns the rows to keep: without NaNs of the OWASIS variables.
+
+    Note to next user: these NaNs occur in large water bodies, as OWASIS does not
+    model groundwater values in these areas. Needs to be checked in QGIS to ensure
+    NaNs are not caused by something else, but if the NaNs only occur in large
+    lakes, set NAs to 0. This way the CO2 fluxes from large lakes can also be
+    modelled.
+    """
+    return validate(data, airborne_post_rules, 'airborne', 'post', report)
+
+#%% Throw out highest 1% and lowest 1% of CO2flx
+
+def trim_flux(data, low, high, source, report=None):
+    """
+    Returns the rows to keep: where CO2flx is between the 1% and 99% quantiles
+    (low and high, see flux_thresholds in quantile_sketch.py).
+    """
+    return validate(data, flux_rules(low, high), source, 'trim', report)
+
+#%% Merge
+
+def merge_sources(tower, airborne):
+    """
+    Merges the cleaned tower and airborne datasets, and makes the datetime columns
+    in a similar format (column Datetime).
+    """
+    # Specify source of the datasets
+    tower['source']='tower'
+    airborne['source']='airborne'
+
+    merged = pd.concat([tower, airborne])
+
+    # The datetime of the airborne observations are stored in columns Date and Time,
+    # which are NAs for the tower observations
+    # The datetime of the tower observations are stored in the column datetime,
+    # which is NA for the airborne observations
+
+    # First change the format of Date (air) to match datetime (twr)
+    merged['Date'] = pd.to_datetime(merged['Date'], format='%d-%m-%Y')
+    merged['Date'] = merged['Date'].dt.strftime('%Y-%m-%d')
+
+    # Add twr dates to new column
+    merged['Datetime'] = pd.to_datetime(merged['datetime'], format = '%Y-%m-%d %H:%M:%S')
+    # Add air date + time to new column
+    merged['Datetime'] = merged['Datetime'].fillna( pd.to_datetime(merged['Date']  + merged['Time'], format = '%Y-%m-%d %H:%M:%S') )
+
+    # Drop old datetime columns
+    return merged.drop(['Date', 'Time', 'datetime'], axis = 'columns')
+
+
+# months of the seasonal subsets
+season_months = {'SepJan': [9,10,11,12,1], 'FebAug': [2,3,4,5,6,7,8]}
+
+def season_rows(merged, season):
+    """
+    Returns the rows of the seasonal subset SepJan (September - January) or
+    FebAug (February - August).
+    """
+    return merged['Datetime'].dt.month.isin(season_months[season])
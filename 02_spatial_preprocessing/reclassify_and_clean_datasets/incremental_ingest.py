@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: clean_tower_data.py, clean_airborne_data.py and merge_airborne_tower.py
+
+This script adds new tower or airborne data (e.g. a new week of tower data, or a
+new flight campaign) to the merged dataset, without cleaning and merging all data
+again. Only the new rows are cleaned, with the same cleaning steps as the
+cleaning scripts (cleaning.py).
+
+The cleaned data is kept in a store, partitioned per source and per ingested file:
+    store/tower/<name>.csv, store/airborne/<name>.csv
+Every partition holds the rows after the cleaning steps per row (prepare_tower or
+prepare_airborne), with the column post_ok for the rows that are thrown out after
+the CO2flx quantiles are calculated. The 1% and 99% quantiles of CO2flx are the
+only statistics of all rows. For every partition, a quantile sketch of CO2flx
+per month is stored (store/<source>/<name>_sketch.npz, see quantile_sketch.py);
+the thresholds are the quantiles of the merged sketches of all partitions. To
+make the quantiles exact, only the CO2flx column of the partitions with rows in
+the bins of the sketch around the quantiles is read again (quantile_sketch.py).
+
+The validation report of a partition (the rows that every quality rule throws
+out, see validation.py) is stored next to it, as
+store/<source>/<name>_validation.csv. The reports of all partitions are combined
+into the report next to the merged dataset.
+
+The store has a manifest (store/manifest.json) with:
+    partitions: per partition the source, file, the hash of the raw file (a file
+                that is already ingested is skipped), the number of rows and the
+                months of the rows
+    thresholds: the 1% and 99% quantiles of CO2flx per source (also saved next to
+                every output, as <output>_thresholds.json)
+    outputs:    the merged dataset and the seasonal subsets, and whether they are
+                stale, i.e. need to be written again
+After ingesting a partition, only the outputs that depend on it are stale: the
+outputs with the months of the new rows, and the outputs with stored rows that
+may move in or out of the quantiles when the thresholds change (counted with the
+month sketches). A new week of tower data in February therefore does not change
+the SepJan subset, unless the new thresholds change which SepJan rows are thrown
+out. The trained models of the model registry (04_model_evaluation/
+model_registry.py) are stored per hash of the training data, so they are only
+trained again for the outputs that changed.
+
+Run as:
+    python incremental_ingest.py ingest <tower|airborne> <raw file> <name>
+        clean the raw file (already overlaid with reclassified spatial info) and
+        add it as partition <name>
+    python incremental_ingest.py assemble
+        write the stale outputs
+    python incremental_ingest.py status
+        print the partitions, thresholds and outputs
+
+Input: new tower or airborne data (already overlaid with reclassified spatial info)
+Output: the store with the partitions and the manifest, and the final merged
+        dataset and the two seasonal subsets
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+
+from cleaning import (prepare_tower, prepare_airborne, tower_post_filter, airborne_post_filter,
+                      trim_flux, merge_sources, season_rows, season_months, flux_col)
+from quantile_sketch import (new_sketch, merge_sketches, flux_thresholds, count_between, boundary_bins,
+                             boundary_values, save_sketches, load_sketches, save_thresholds)
+from validation import save_report, load_report
+
+#%% Settings
+
+WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+store_dir = f'{WD}store/'
+
+# Outputs: file name and months of the rows
+tag = 'store'
+outputs = {'merged': {'file': f'merged_{tag}_final.csv', 'months': list(range(1, 13))},
+           'SepJan': {'file': f'merged_SepJan_{tag}.csv', 'months': season_months['SepJan']},
+           'FebAug': {'file': f'merged_FebAug_{tag}.csv', 'months': season_months['FebAug']}}
+
+# How every source is read, cleaned and finalized, as in the cleaning scripts
+sources = {'tower': {'read_args': {'index_col': 0}, 'prepare': prepare_tower,
+                     'post_filter': tower_post_filter, 'drop_index': 'index'},
+           'airborne': {'read_args': {'index_col': 0, 'na_values': 'nan'}, 'prepare': prepare_airborne,
+                        'post_filter': airborne_post_filter, 'drop_index': 'X'}}
+
+#%% Manifest
+
+def load_manifest(store_dir):
+    path = f'{store_dir}manifest.json'
+    if not os.path.exists(path):
+        return {'partitions': {}, 'thresholds': {}, 'outputs': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, store_dir):
+    # write to a temporary file first, so the manifest is never half written
+    path = f'{store_dir}manifest.json'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(f'{path}.tmp', path)
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def row_months(data, source):
+    """
+    Returns the month of every row of a partition.
+    """
+    if source == 'tower':
+        return pd.to_datetime(data['datetime']).dt.month
+    return pd.to_datetime(data['Date'], format='%d-%m-%Y').dt.month
+
+
+def source_partitions(manifest, source):
+    return [p for p in manifest['partitions'].values() if p['source'] == source]
+
+#%% Thresholds and stale outputs
+
+def month_sketches(data, source):
+    """
+    Returns the quantile sketch of CO2flx of the rows of every month.
+    """
+    months = row_months(data, source)
+    return {str(month): new_sketch(flux) for month, flux in data[flux_col].groupby(months)}
+
+
+def source_sketches(manifest, source, store_dir):
+    """
+    Returns the month sketches of all partitions of a source.
+    """
+    return [load_sketches(f"{store_dir}{p['sketch']}") for p in source_partitions(manifest, source)]
+
+
+def compute_thresholds(manifest, source, sketches, store_dir):
+    """
+    Returns the 1% and 99% quantiles of CO2flx of all stored rows of a source, from
+    the merged sketches of all partitions and months (in the order of
+    source_partitions). The quantiles are made exact with the values in the bins
+    around the quantiles, read from the partitions that have rows in these bins.
+    """
+    sketch = merge_sketches(*[s for months in sketches for s in months.values()])
+    bins = boundary_bins(sketch)
+
+    values = [np.array([])]
+    for p, months in zip(source_partitions(manifest, source), sketches):
+        if any(np.isin(s['bins'], bins).any() for s in months.values()):
+            flux = pd.read_csv(f"{store_dir}{p['file']}", usecols=[flux_col], float_precision='round_trip')
+            values.append(boundary_values(sketch, flux[flux_col]))
+    return flux_thresholds(sketch, np.concatenate(values))
+
+
+def invalidate(manifest, new_months, old, new, sketches):
+    """
+    Marks the outputs as stale that have rows in the new months, or rows that may
+    be thrown out with the old thresholds but not with the new ones (or the other
+    way around): rows with a CO2flx between the old and new thresholds, counted
+    with the month sketches.
+    """
+    changed_months = set()
+    if old is not None:
+        for months in sketches:
+            for month, sketch in months.items():
+                if (count_between(sketch, old['low'], new['low']) > 0
+                        or count_between(sketch, old['high'], new['high']) > 0):
+                    changed_months.add(int(month))
+
+    for name, output in outputs.items():
+        months = set(output['months'])
+        stale = bool(months & set(new_months)) or bool(months & changed_months)
+        entry = manifest['outputs'].setdefault(name, {'file': output['file'], 'stale': True})
+        entry['stale'] = entry['stale'] or stale
+
+#%% Ingest
+
+def ingest(raw_path, source, name, store_dir):
+    """
+    raw_path: raw tower or airborne file (already overlaid with reclassified spatial info)
+    source: 'tower' or 'airborne'
+    name: name of the partition, e.g. 'tower_2023w07'
+    store_dir: directory of the store
+
+    Cleans the rows of the file and adds them to the store as a new partition, and
+    updates the thresholds and the stale outputs. Returns False if the file is
+    already ingested.
+    """
+    manifest = load_manifest(store_dir)
+    raw_hash = file_hash(raw_path)
+    for key, p in manifest['partitions'].items():
+        if p['raw_hash'] == raw_hash:
+            print(f'{raw_path} is already ingested as {key}')
+            return False
+
+    spec = sources[source]
+    report = []
+    data = spec['prepare'](pd.read_csv(raw_path, **spec['read_args']), report)
+    data['post_ok'] = spec['post_filter'](data, report)
+
+    file = f'{source}/{name}.csv'
+    os.makedirs(f'{store_dir}{source}', exist_ok=True)
+    data.to_csv(f'{store_dir}{file}.tmp')
+    os.replace(f'{store_dir}{file}.tmp', f'{store_dir}{file}')
+    save_report(f'{store_dir}{file}', report)
+
+    # quantile sketch of CO2flx per month, merged with the other partitions for
+    # the thresholds
+    sketch_file = f'{source}/{name}_sketch.npz'
+    sketches = month_sketches(data, source)
+    save_sketches(f'{store_dir}{sketch_file}', sketches)
+
+    months = sorted(int(m) for m in sketches)
+    manifest['partitions'][f'{source}/{name}'] = {
+        'source': source, 'file': file, 'sketch': sketch_file, 'raw': os.path.basename(raw_path),
+        'raw_hash': raw_hash, 'n_rows': len(data), 'months': months,
+        'ingested': datetime.datetime.now().isoformat(timespec='seconds')}
+
+    all_sketches = source_sketches(manifest, source, store_dir)
+    old = manifest['thresholds'].get(source)
+    new = compute_thresholds(manifest, source, all_sketches, store_dir)
+    manifest['thresholds'][source] = new
+    invalidate(manifest, months, old, new, all_sketches)
+
+    save_manifest(manifest, store_dir)
+    print(f'{source}/{name}: {len(data)} rows ingested')
+    return True
+
+#%% Assemble the outputs
+
+def load_source(manifest, source, store_dir, report=None):
+    """
+    Returns the final dataset of a source (as tower_..._final.csv or air_..._final.csv):
+    all partitions, without the rows that are thrown out. The validation reports
+    of the partitions and of trimming CO2flx are added to report (optional).
+    Returns None if no partition of the source is ingested.
+    """
+    spec = sources[source]
+    if len(source_partitions(manifest, source)) == 0:
+        return None
+
+    parts = []
+    for p in source_partitions(manifest, source):
+        parts.append(pd.read_csv(f"{store_dir}{p['file']}", **spec['read_args']))
+        if report is not None:
+            report += load_report(f"{store_dir}{p['file']}")
+    data = pd.concat(parts)
+
+    t = manifest['thresholds'][source]
+    data = data[data['post_ok']].drop(columns='post_ok')
+    data = data[trim_flux(data, t['low'], t['high'], source, report)]
+
+    # Reset index, and only keep recent index
+    data = data.reset_index()
+    return data.drop([spec['drop_index']], axis='columns')
+
+
+def assemble(store_dir, WD, force=False):
+    """
+    Writes the stale outputs (or all outputs if force is True) to WD.
+    """
+    manifest = load_manifest(store_dir)
+    stale = [name for name in outputs
+             if force or manifest['outputs'].get(name, {'stale': True})['stale']]
+    if not stale:
+        print('all outputs are up to date')
+        return
+
+    # the merged dataset needs the data of both sources
+    missing = [source for source in sources if len(source_partitions(manifest, source)) == 0]
+    if missing:
+        raise ValueError(f"No partitions of {' and '.join(missing)} are ingested, so the merged dataset "
+                         f"cannot be assembled. Ingest them first (python incremental_ingest.py ingest <source> <raw file> <name>)")
+
+    report = []
+    merged = merge_sources(load_source(manifest, 'tower', store_dir, report),
+                           load_source(manifest, 'airborne', store_dir, report))
+
+    for name in stale:
+        data = merged if name == 'merged' else merged[season_rows(merged, name)]
+        data.to_csv(f"{WD}{outputs[name]['file']}")
+
+        # Save the thresholds of CO2flx next to the dataset
+        save_thresholds(f"{WD}{outputs[name]['file'].replace('.csv', '_thresholds.json')}", manifest['thresholds'])
+        if name == 'merged':
+            save_report(f"{WD}{outputs[name]['file']}", report)
+        manifest['outputs'][name] = {'file': outputs[name]['file'], 'stale': False, 'n_rows': len(data),
+                                     'partitions': sorted(manifest['partitions']),
+                                     'thresholds': manifest['thresholds'],
+                                     'written': datetime.datetime.now().isoformat(timespec='seconds')}
+        print(f"{outputs[name]['file']}: {len(data)} rows")
+
+    save_manifest(manifest, store_dir)
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    mode = args[0]
+
+    if mode == 'ingest':
+        source, raw_path, name = args[1], args[2], args[3]
+        if source not in sources:
+            raise ValueError(f"Unknown source '{source}', use 'tower' or 'airborne'")
+        ingest(raw_path, source, name, store_dir)
+
+    elif mode == 'assemble':
+        assemble(store_dir, WD)
+
+    elif mode == 'status':
+        manifest = load_manifest(store_dir)
+        for key, p in manifest['partitions'].items():
+            print(f"{key}: {p['n_rows']} rows, months {p['months']}")
+        print('thresholds:', manifest['thresholds'])
+        for name, o in manifest['outputs'].items():
+            print(f"{name}: {'stale' if o['stale'] else 'up to date'}")
+
+    else:
+        raise ValueError(f"Unknown mode '{mode}', use 'ingest', 'assemble' or 'status'")
@@ -15,11 +15,17 @@ seasonal subsets
 
 Edits by arietma:
     - Added creation of seasonal subsets
+    - Moved the merging steps to cleaning.py, which is also used for the
+    incremental ingestion of new data (incremental_ingest.py)
+    - The validation reports of the tower and airborne datasets (validation.py)
+    are combined into one report next to the merged dataset
 
 """
 #%% Import packages
 
 import pandas as pd
+from cleaning import merge_sources, season_rows
+from validation import load_report, save_report
 
 #%% Set working directory and load final airborne and tower datasets
 
@@ -28,37 +34,12 @@ WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
 tower = pd.read_csv(f"{WD}tower_1129_final.csv", index_col=0)
 airborne = pd.read_csv(f"{WD}air_1129_final.csv", index_col=0)
 
-#%% Specify source of the datasets
-
-tower['source']='tower'
-airborne['source']='airborne'
-
-#%% Merge the two datasets
-
-merged = pd.concat([tower, airborne])
-
-#%% Now, ensure the datetime format is similar
+#%% Merge the two datasets, and ensure the datetime format is similar (cleaning.py)
 # The datetime of the airborne observations are stored in columns Date and Time,
-# which are NAs for the tower observations
-# The datetime of the tower observations are stored in the column datetime,
-# which is NA for the airborne observations
-
-# First change the format of Date (air) to match datetime (twr)
-merged['Date'] = pd.to_datetime(merged['Date'], format='%d-%m-%Y')
-merged['Date'] = merged['Date'].dt.strftime('%Y-%m-%d')
-
-# Make new column for merged datetime
-merged['Datetime'] = None
-
-# Add twr dates to new column
-merged['Datetime'] = pd.to_datetime(merged['datetime'], format = '%Y-%m-%d %H:%M:%S')
-# Add air date + time to new column 
-merged['Datetime'] = merged['Datetime'].fillna( pd.to_datetime(merged['Date']  + merged['Time'], format = '%Y-%m-%d %H:%M:%S') ) 
-
-# Drop old datetime columns
-merged = merged.drop(['Date', 'Time', 'datetime'], axis = 'columns')
-
+# and of the tower observations in the column datetime. Both are combined in the
+# new column Datetime
 
+merged = merge_sources(tower, airborne)
 
 #%% Save the final merged dataset
 # (Here a later date than the input datasets since I later added the tower and
@@ -66,14 +47,18 @@ merged = merged.drop(['Date', 'Time', 'datetime'], axis = 'columns')
 
 merged.to_csv(f"{WD}merged_0228_final.csv")
 
+# Save the rows that were thrown out per rule, of the tower and airborne data
+save_report(f"{WD}merged_0228_final.csv",
+            load_report(f"{WD}tower_1129_final.csv") + load_report(f"{WD}air_1129_final.csv"))
+
 
 #%% Create seasonal subsets of the final merged dataset, SepJan and FebAug
 # As the name indicates, SepJan includes all rows from the period September - 
 # January, and FebAug all rows from the period February - August
 
 # Specify rows for SepJan and FebAug
-SepJan_rows = ((merged['Datetime'].dt.month.isin([9,10,11,12,1])))
-FebAug_rows = ((merged['Datetime'].dt.month.isin([2,3,4,5,6,7,8])))
+SepJan_rows = season_rows(merged, 'SepJan')
+FebAug_rows = season_rows(merged, 'FebAug')
 
 # Make two seasonal subsets
 mer_SepJan = merged[SepJan_rows]
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script provides a mergeable quantile sketch for the 1% and 99% quantiles of
+CO2flx, with which the highest and lowest 1% of CO2flx are thrown out. The
+quantiles of data.CO2flx.quantile() need all values in memory at once. A sketch
+can be made per site, per campaign or per chunk of rows, and the sketches can be
+merged into the sketch of all rows, so the quantiles are the same however the data
+is divided (e.g. in the incremental ingestion or the streaming cleaning).
+
+The sketch is a histogram of the values with fixed bins of bin_width (default
+0.001 umol/m2/s), stored as the occupied bins and their counts. Merging adds the
+counts, so merging is exact and does not depend on the order. A quantile is found
+from the cumulative counts, with the values spread evenly within a bin, and
+interpolated linearly between two ranks (as pandas). This estimate is
+approximate: the error is at most one bin width, so rows with a CO2flx in the
+same bin as a threshold may be thrown out where data.CO2flx.quantile() keeps
+them (or the other way around).
+
+The quantiles are therefore made exact with a second pass over the data: the
+sketch tells in which bins the ranks of the quantiles lie (boundary_bins), and
+only the values in these few bins are collected (boundary_values, which can be
+done per chunk or partition and concatenated). The exact values of the ranks
+are then found within these bins, and the quantiles are the same as pandas'
+quantile.
+
+The thresholds (1% and 99% quantiles) are saved as a json file next to the
+dataset that is trimmed with them.
+
+Functions:
+    new_sketch:         the sketch of an array of values
+    merge_sketches:     one sketch of several sketches
+    sketch_quantile:    a quantile from a sketch
+    count_between:      the number of values between two values (upper bound)
+    boundary_bins:      the bins of the ranks of the quantiles
+    boundary_values:    the values in the boundary bins (the second pass)
+    flux_thresholds:    the 1% and 99% quantiles from a sketch (exact if the
+                        boundary values are given), as thresholds dictionary
+    save_sketches, load_sketches:   labelled sketches as a .npz file
+    save_thresholds, load_thresholds: thresholds as a json file
+"""
+#%% Import packages
+
+import json
+import numpy as np
+
+#%% Sketches
+
+bin_width = 0.001
+
+def value_bins(values, bin_width):
+    return np.floor(values / bin_width).astype(np.int64)
+
+
+def new_sketch(values, bin_width=bin_width):
+    """
+    Returns the sketch of the values (NaNs are skipped): a dictionary with the
+    bin width, the occupied bins (sorted) and their counts.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    bins, counts = np.unique(value_bins(values, bin_width), return_counts=True)
+    return {'bin_width': bin_width, 'bins': bins, 'counts': counts.astype(np.int64)}
+
+
+def merge_sketches(*sketches):
+    """
+    Returns the sketch of all values of the sketches (with the same bin width).
+    """
+    widths = {s['bin_width'] for s in sketches}
+    if len(widths) != 1:
+        raise ValueError(f'Sketches with different bin widths cannot be merged: {widths}')
+
+    bins = np.concatenate([s['bins'] for s in sketches])
+    counts = np.concatenate([s['counts'] for s in sketches])
+    merged_bins, inverse = np.unique(bins, return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=counts, minlength=len(merged_bins)).astype(np.int64)
+    return {'bin_width': widths.pop(), 'bins': merged_bins, 'counts': merged_counts}
+
+
+def sketch_count(sketch):
+    return int(sketch['counts'].sum())
+
+
+def count_between(sketch, a, b):
+    """
+    Returns the number of values in the bins that overlap with [a, b] (an upper
+    bound of the number of values between a and b).
+    """
+    a, b = min(a, b), max(a, b)
+    first = np.floor(a / sketch['bin_width'])
+    last = np.floor(b / sketch['bin_width'])
+    return int(sketch['counts'][(sketch['bins'] >= first) & (sketch['bins'] <= last)].sum())
+
+
+def rank_value(sketch, cum, k):
+    """
+    Returns the estimated value of rank k (0-based), with the values spread evenly
+    within a bin.
+    """
+    i = np.searchsorted(cum, k, side='right')
+    before = cum[i-1] if i > 0 else 0
+    return (sketch['bins'][i] + (k - before + 0.5) / sketch['counts'][i]) * sketch['bin_width']
+
+
+def quantile_ranks(n, q):
+    """
+    Returns the two ranks (0-based) between which quantile q of n values is
+    interpolated, and the fraction of the interpolation (as numpy and pandas).
+    """
+    h = (n - 1) * q
+    k = int(np.floor(h))
+    return k, min(k + 1, n - 1), h - k
+
+
+def interpolate(low, high, t):
+    # linear interpolation in the same way as numpy's quantile
+    diff = high - low
+    return float(high - diff * (1 - t) if t >= 0.5 else low + diff * t)
+
+
+def sketch_quantile(sketch, q):
+    """
+    Returns quantile q (0-1) of the values of the sketch, interpolated linearly
+    between two ranks, like pandas' quantile, with the values spread evenly within
+    a bin (approximate, see above). NaN for an empty sketch.
+    """
+    n = sketch_count(sketch)
+    if n == 0:
+        return np.nan
+    cum = np.cumsum(sketch['counts'])
+    k, k1, t = quantile_ranks(n, q)
+    return interpolate(rank_value(sketch, cum, k), rank_value(sketch, cum, k1), t)
+
+
+def boundary_bins(sketch, qs=(0.01, 0.99)):
+    """
+    Returns the bins (sorted) in which the ranks of the quantiles qs lie.
+    """
+    n = sketch_count(sketch)
+    if n == 0:
+        return np.array([], dtype=np.int64)
+    cum = np.cumsum(sketch['counts'])
+    ranks = [k for q in qs for k in quantile_ranks(n, q)[:2]]
+    return np.unique(sketch['bins'][np.searchsorted(cum, ranks, side='right')])
+
+
+def boundary_values(sketch, values, qs=(0.01, 0.99)):
+    """
+    Returns the values (NaNs are skipped) that lie in the boundary bins of the
+    sketch. The values of all rows of the sketch are needed, but they can be
+    given per chunk and the results concatenated.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    return values[np.isin(value_bins(values, sketch['bin_width']), boundary_bins(sketch, qs))]
+
+
+def exact_quantile(sketch, q, values):
+    """
+    Returns quantile q (0-1) of the values of the sketch, exactly as pandas'
+    quantile, from the values in the boundary bins (boundary_values).
+    """
+    n = sketch_count(sketch)
+    if n == 0:
+        return np.nan
+    cum = np.cumsum(sketch['counts'])
+    bins = value_bins(values, sketch['bin_width'])
+
+    def rank(k):
+        i = np.searchsorted(cum, k, side='right')
+        before = cum[i-1] if i > 0 else 0
+        in_bin = np.sort(values[bins == sketch['bins'][i]])
+        if len(in_bin) != sketch['counts'][i]:
+            raise ValueError(f"{len(in_bin)} boundary values in bin {sketch['bins'][i]}, but the sketch "
+                             f"has {sketch['counts'][i]}: the values are not those of the sketch")
+        return in_bin[k - before]
+
+    k, k1, t = quantile_ranks(n, q)
+    return interpolate(rank(k), rank(k1), t)
+
+
+def flux_thresholds(sketch, values=None):
+    """
+    Returns the thresholds for throwing out the highest and lowest 1% of CO2flx.
+    values: the CO2flx values in the boundary bins (boundary_values). If given,
+    the thresholds are exact, otherwise they are estimated from the sketch.
+    """
+    if values is None:
+        low, high = sketch_quantile(sketch, 0.01), sketch_quantile(sketch, 0.99)
+    else:
+        values = np.asarray(values, dtype=np.float64)
+        low, high = exact_quantile(sketch, 0.01, values), exact_quantile(sketch, 0.99, values)
+    return {'low': low, 'high': high, 'exact': values is not None,
+            'n_rows': sketch_count(sketch), 'bin_width': sketch['bin_width']}
+
+#%% Save and load
+
+def save_sketches(path, sketches):
+    """
+    Saves a dictionary of labelled sketches (e.g. per month) as a .npz file.
+    """
+    arrays = {}
+    for label, sketch in sketches.items():
+        arrays[f'{label}__bins'] = sketch['bins']
+        arrays[f'{label}__counts'] = sketch['counts']
+        arrays[f'{label}__bin_width'] = np.array(sketch['bin_width'])
+    np.savez(path, **arrays)
+
+
+def load_sketches(path):
+    with np.load(path) as f:
+        labels = sorted({key.rsplit('__', 1)[0] for key in f.files})
+        return {label: {'bin_width': float(f[f'{label}__bin_width']),
+                        'bins': f[f'{label}__bins'], 'counts': f[f'{label}__counts']}
+                for label in labels}
+
+
+def save_thresholds(path, thresholds):
+    with open(path, 'w') as f:
+        json.dump(thresholds, f, indent=4)
+
+
+def load_thresholds(path):
+    with open(path) as f:
+        return json.load(f)
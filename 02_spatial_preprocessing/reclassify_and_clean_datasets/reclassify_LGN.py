@@ -13,23 +13,33 @@ The script should be run once for the airborne dataset, and once for the tower
 datset. 
 
 Input: airborne and tower dataset after running fp_air/twr_ruimtdata_hpc
-Output: airborne and tower dataset with reclassified land use classes
+Output: airborne and tower dataset with reclassified land use classes, and a
+validation report of the rows of which the LGN classes do not add up to 1
+
+Edits by arietma:
+    - the datasets are read and saved in the sparse format of sparse_fractions.py
+      (run sparse_fractions.py on the preprocessed dataset first); the LGN2020_
+      columns are summed to the new classes in one sparse matrix product instead
+      of a loop over the rows
 
 """
 
 #%% Import packages
-import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+from validation import validate, save_report
+from sparse_fractions import load_sparse, save_sparse, reclassify_block
 
 #%% Get tower or airborne data (already overlaid with spatial info)
 WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
 
 # tower
-# rawdata = pd.read_csv(f"{WD}tower_0607_preprocessed.csv", index_col=0)
+# source = 'tower'
+# rawdata, fractions = load_sparse(f"{WD}tower_0607_preprocessed_sparse", index_col=0)
 # data = rawdata.reset_index() # reset index for indexing wit loc[]
 
 # airborne
-rawdata = pd.read_csv(f"{WD}air_0915_preprocessed.csv", index_col=0)
+source = 'airborne'
+rawdata, fractions = load_sparse(f"{WD}air_0915_preprocessed_sparse", index_col=0)
 data = rawdata.reset_index() # reset index for indexing wit loc[]
 
 #%% Defining new LGN classes
@@ -58,27 +68,14 @@ LGNcodes = { 'bSl': [31,35],
   
 #%% Reclassify LGN codes in dataframe
 
-# List of columns in data that start with LGN (i.e. old LGN codes)
-col_lgn = [col for col in data.columns if col.lower().startswith('lgn2020')]
-
 # Add columns with new LGN codes, and sum all old LGN codes (values) that 
-# belong to the same new LGN code (key)
-
-summed_cols = [] # to keep track of the columns that are summed
-
-for key in range(len(LGNcodes)): 
-    key_name = list(LGNcodes.keys())[key]
-    values = LGNcodes[key_name]
-    
-    # column list in one key:value pair
-    string_list = [f'LGN2020_{value}' for value in values]
-    cols_to_sum = [col for col in string_list if col in col_lgn] # columns of string_list that are present in col_lgn
+# belong to the same new LGN code (key). The LGN2020_ columns (old LGN codes) are
+# the sparse block of the dataset; the columns that are not summed stay in the block
+col_lgn = fractions['LGN2020_'][1]
+lgn, summed_cols, fractions['LGN2020_'] = reclassify_block(fractions['LGN2020_'], LGNcodes, 'LGN2020_')
 
-    for j in data.index: # sum rows of old LGN codes to new LGN code
-        row = data.loc[j]
-        data.loc[j, key_name]=row[cols_to_sum].sum(skipna=True)
-
-    summed_cols+= cols_to_sum
+for key_name in lgn.columns:
+    data[key_name] = lgn[key_name].to_numpy()
 
 # Test if all columns have been summed
 [col for col in col_lgn if col not in summed_cols]
@@ -87,24 +84,20 @@ for key in range(len(LGNcodes)):
 LGN_classes = ['Grs', 'SuC', 'SpC', 'Ghs', 'dFr', 'cFr', 'Wat',
        'Bld', 'bSl', 'Hth', 'FnB', 'Shr']
 
-sumLGN = []
-
-for i in data.index:
-  row = data.loc[i] # possible since index is reset
-  
-  sumLGN.append(row[LGN_classes].sum(skipna=True)) # sum rows of LGN classes
-
+# The rows of which the LGN classes do not add up to 1 are counted per site in
+# the validation report (validation.py), no rows are thrown out
+LGN_rules = [{'name': 'LGN classes add up to 1',
+              'check': lambda data: np.isclose(data[LGN_classes].sum(axis=1, skipna=True), 1, atol=1e-3)}]
 
-plt.hist(sumLGN) # all 1
-min(sumLGN)
-max(sumLGN)
+LGN_report = []
+LGN_ok = validate(data, LGN_rules, source, 'check', LGN_report) # all 1
 
-#%% Drop columns with old LGN classes and save result
+#%% Save result (the old LGN classes that are summed are no longer in the block)
 
 # tower
-# data = data.drop(summed_cols, axis='columns')
-# data.to_csv(f"{WD}tower_0607_reclassifiedLGN.csv", na_rep='NA')
+# save_sparse(data, f"{WD}tower_0607_reclassifiedLGN", fractions, na_rep='NA')
+# save_report(f"{WD}tower_0607_reclassifiedLGN.csv", LGN_report)
 
 # airborne
-data = data.drop(summed_cols, axis='columns')
-data.to_csv(f"{WD}air_0915_reclassifiedLGN.csv", na_rep='NA')
\ No newline at end of file
+save_sparse(data, f"{WD}air_0915_reclassifiedLGN", fractions, na_rep='NA')
+save_report(f"{WD}air_0915_reclassifiedLGN.csv", LGN_report)
\ No newline at end of file
@@ -15,21 +15,30 @@ datset.
 
 Input: airborne and tower dataset after running reclassify_LGN
 Output: airborne and tower dataset with reclassified soil classes
+
+Edits by arietma:
+    - the dataset after reclassify_LGN is read in the sparse format of
+      sparse_fractions.py; the Bodemkaart_ columns are summed to the new classes
+      in one sparse matrix product instead of a loop over the rows
+    - sumSOIL is calculated for all rows at once, and added to data (it was used
+      for 'Unclassified' but not added)
+    - the reclassified dataset is saved as one csv again (with the old LGN and soil
+      codes that are not reclassified, if any, as columns)
 """
 
 #%% some imports
-import pandas as pd
 import matplotlib.pyplot as plt
+from sparse_fractions import load_sparse, reclassify_block, to_dense
 
 #%% get tower or airborne data (already overlaid with spatial info)
 WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
 
 # tower
-# rawdata = pd.read_csv(f"{WD}tower_0607_reclassifiedLGN.csv", index_col=0)
+# rawdata, fractions = load_sparse(f"{WD}tower_0607_reclassifiedLGN", index_col=0)
 # data = rawdata.reset_index() # reset index for indexing wit loc[]
 
 # airborne
-rawdata = pd.read_csv(f"{WD}air_0915_reclassifiedLGN.csv", index_col=0)
+rawdata, fractions = load_sparse(f"{WD}air_0915_reclassifiedLGN", index_col=0)
 data = rawdata.reset_index() # reset index for indexing wit loc[]
 
 #%% Defining new soil classes
@@ -69,27 +78,14 @@ soilcodes = { 'W': [1,7,29,31,40,41,44,53,63,65,72,82,88,104,123,124,126,131,143
 
 #%% Reclassify soil codes in dataframe
 
-# List of Bodemkaart columns (old soil codes) that appear in data
-col_bodem = [col for col in data.columns if col.lower().startswith('bodemkaart')]
-
 # Add columns with new soil codes, and sum all old soil codes (values) that 
-# belong to the same new soil code (key)
-
-summed_cols = [] # to keep track of the columns that are summed
-
-for key in range(len(soilcodes)):
-    key_name = list(soilcodes.keys())[key]
-    values = soilcodes[key_name]
-    
-    # column list in one key:value pair
-    string_list = [f'Bodemkaart_{value}' for value in values]
-    cols_to_sum = [col for col in string_list if col in col_bodem] # columns of string_list that are present in col_bodem
-
-    for j in data.index: # sum rows of old soil codes to new soil code
-        row = data.loc[j]
-        data.loc[j, key_name]=row[cols_to_sum].sum(skipna=True)
+# belong to the same new soil code (key). The Bodemkaart_ columns (old soil codes)
+# are the sparse block of the dataset; the columns that are not summed stay in the block
+col_bodem = fractions['Bodemkaart_'][1]
+soil, summed_cols, fractions['Bodemkaart_'] = reclassify_block(fractions['Bodemkaart_'], soilcodes, 'Bodemkaart_')
 
-    summed_cols+= cols_to_sum
+for key_name in soil.columns:
+    data[key_name] = soil[key_name].to_numpy()
 
 # Test if all columns have been summed
 [col for col in col_bodem if col not in summed_cols]
@@ -99,12 +95,8 @@ soil_classes = ['hV', 'W', 'pV', 'kV', 'hVz', 'V',
        'Vz', 'aVz', 'kVz', 'overigV', 'zandG', 'zeeK', 'rivK', 'gedA', 'leem',
        'Unclassified']
 
-sumSOIL = []
-
-for i in data.index:
-  row = data.loc[i] # possible since index is reset
-
-  sumSOIL.append(row[soil_classes].sum(skipna=True)) # sum rows of soil classes
+data['sumSOIL'] = data[soil_classes].sum(axis=1, skipna=True) # sum rows of soil classes
+sumSOIL = data['sumSOIL']
 
 plt.hist(sumSOIL) # all 1
 min(sumSOIL)
@@ -123,11 +115,11 @@ data['Unclassified'] = 0.9999 - data['sumSOIL']
 data.loc[data['Unclassified'] < 0, 'Unclassified'] = 0
 
 
-#%% Drop columns with old soil classes and save result
+#%% Save result (the old soil classes that are summed are no longer in the block)
 # tower
-# data = data.drop(summed_cols, axis='columns')
+# data = to_dense(data, fractions)
 # data.to_csv(f"{WD}tower_0607_reclassified.csv", na_rep='NA')
 
 # airborne
-data = data.drop(summed_cols, axis='columns')
+data = to_dense(data, fractions)
 data.to_csv(f"{WD}air_0915_reclassified.csv", na_rep='NA')
\ No newline at end of file
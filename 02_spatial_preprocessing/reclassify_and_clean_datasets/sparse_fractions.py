@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script stores the fractions of the land use (LGN2020_<code>) and soil
+(Bodemkaart_<code>) classes of the preprocessed datasets as sparse matrices. After
+fp_air_ruimtdata_hpc.R and fp_twr_ruimtdata_hpc.R, the datasets have hundreds of
+these columns, of which almost all values are 0 (a footprint only covers a few
+classes), stored as text in the csv and read as dense float64 columns.
+
+A dataset <stem> is stored as:
+    <stem>.csv:             all other columns
+    <stem>_<block>.npz:     the fractions of a block of columns (LGN2020_ or
+                            Bodemkaart_) as a CSR matrix (rows x codes), with
+                            the rows in the same order as the csv
+    <stem>_<block>_nan.npy: the rows of the block that are all NaN (rows of
+                            which the footprint was not calculated)
+    <stem>_fractions.json:  the columns (codes) of every block
+NaNs of the fractions are stored as 0 in the matrix, as they count as 0 in the
+reclassification (sum with skipna). The rows that are all NaN are kept with the
+block, and are NaN again in the columns that are not reclassified (to_dense), as
+in the dense datasets. A single NaN in a row that was calculated stays 0.
+
+The reclassification of reclassify_LGN.py and reclassify_soil.py is one sparse
+matrix product: the fractions (rows x codes) times a matrix of 0s and 1s (codes x
+new classes), which adds up the fractions of the codes of every new class.
+
+Run as:
+    python sparse_fractions.py <dataset csv>
+        converts a preprocessed dataset (e.g. air_0915_preprocessed.csv) to the
+        sparse format (air_0915_preprocessed_sparse), in chunks of rows
+
+Functions:
+    save_sparse, load_sparse:   a dataset with sparse blocks
+    reclassify_block:           the fractions of the new classes from a block
+    to_dense:                   the dataset with the (remaining) blocks as columns
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+#%% Settings
+
+# prefixes of the blocks of fraction columns, and their name in the file names
+blocks = {'LGN2020_': 'LGN', 'Bodemkaart_': 'soil'}
+
+#%% Save and load
+
+def block_cols(columns, prefix):
+    """
+    Returns the columns of a block (case insensitive, as in reclassify_LGN.py).
+    """
+    return [col for col in columns if col.lower().startswith(prefix.lower())]
+
+
+def split_blocks(data, prefixes=tuple(blocks)):
+    """
+    Returns the dataset without the blocks, and a dictionary with per prefix the
+    CSR matrix, the columns and the rows that are all NaN (boolean) of the block.
+    """
+    fractions = {}
+    for prefix in prefixes:
+        cols = block_cols(data.columns, prefix)
+        values = data[cols].to_numpy(dtype=np.float64)
+        nan_rows = np.isnan(values).all(axis=1) & (len(cols) > 0)
+        fractions[prefix] = (sp.csr_matrix(np.nan_to_num(values, nan=0)), cols, nan_rows)
+        data = data.drop(columns=cols)
+    return data, fractions
+
+
+def save_sparse(data, stem, fractions=None, **csv_args):
+    """
+    data: dataset, with or without the blocks as columns
+    stem: path of the dataset, without extension
+    fractions: blocks that are already sparse (load_sparse, reclassify_block)
+    csv_args: arguments of to_csv (e.g. na_rep='NA')
+
+    Saves the dataset as <stem>.csv, and every block as <stem>_<block>.npz.
+    """
+    data, new_fractions = split_blocks(data)
+    data.to_csv(f'{stem}.csv', **csv_args)
+    save_blocks({**new_fractions, **(fractions or {})}, stem)
+
+
+def save_blocks(fractions, stem):
+    """
+    Saves every block as <stem>_<block>.npz and its rows that are all NaN as
+    <stem>_<block>_nan.npy, and the columns of the blocks as <stem>_fractions.json.
+    """
+    meta = {}
+    for prefix, (matrix, cols, nan_rows) in fractions.items():
+        file = f'{os.path.basename(stem)}_{blocks[prefix]}.npz'
+        nan_file = f'{os.path.basename(stem)}_{blocks[prefix]}_nan.npy'
+        sp.save_npz(os.path.join(os.path.dirname(stem), file), matrix.tocsr())
+        np.save(os.path.join(os.path.dirname(stem), nan_file), np.flatnonzero(nan_rows))
+        meta[prefix] = {'file': file, 'nan_file': nan_file, 'columns': list(cols)}
+    with open(f'{stem}_fractions.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+def load_sparse(stem, **read_args):
+    """
+    stem: path of the dataset, without extension
+    read_args: arguments of read_csv (e.g. index_col=0)
+
+    Returns the dataset without the blocks, and a dictionary with per prefix the
+    CSR matrix, the columns and the rows that are all NaN (boolean) of the block.
+    Datasets stored without <stem>_<block>_nan.npy have no rows that are all NaN.
+    """
+    data = pd.read_csv(f'{stem}.csv', **read_args)
+    with open(f'{stem}_fractions.json') as f:
+        meta = json.load(f)
+
+    fractions = {}
+    for prefix, block in meta.items():
+        matrix = sp.load_npz(os.path.join(os.path.dirname(stem), block['file'])).tocsr()
+        nan_rows = np.zeros(matrix.shape[0], dtype=bool)
+        if 'nan_file' in block:
+            nan_rows[np.load(os.path.join(os.path.dirname(stem), block['nan_file']))] = True
+        fractions[prefix] = (matrix, block['columns'], nan_rows)
+    return data, fractions
+
+#%% Reclassify
+
+def reclassify_block(block, codes, prefix):
+    """
+    block: CSR matrix, columns and rows that are all NaN of a block (load_sparse)
+    codes: dictionary with the old codes of every new class, e.g. LGNcodes in
+           reclassify_LGN.py
+    prefix: prefix of the columns of the block, e.g. 'LGN2020_'
+
+    Returns a dataframe with the fractions of the new classes (the sum of the
+    fractions of their codes), the summed columns, and the block of the columns
+    that are not summed. The new classes of the rows that are all NaN are 0, as
+    the sum with skipna of the dense datasets.
+    """
+    matrix, cols, nan_rows = block
+    col_no = {col: j for j, col in enumerate(cols)}
+
+    # matrix of 0s and 1s: which columns (old codes) belong to which new class
+    rows, classes = [], []
+    for k, values in enumerate(codes.values()):
+        for value in values:
+            col = f'{prefix}{value}'
+            if col in col_no:
+                rows.append(col_no[col])
+                classes.append(k)
+    reclass = sp.csr_matrix((np.ones(len(rows)), (rows, classes)), shape=(len(cols), len(codes)))
+
+    new = pd.DataFrame((matrix @ reclass).toarray(), columns=list(codes))
+
+    summed_cols = [cols[j] for j in rows]
+    remaining = [j for j in range(len(cols)) if cols[j] not in summed_cols]
+    return new, summed_cols, (matrix[:, remaining], [cols[j] for j in remaining], nan_rows)
+
+
+def to_dense(data, fractions):
+    """
+    Returns the dataset with the columns of the blocks (e.g. the codes that are not
+    reclassified) added as dense columns, NaN in the rows that are all NaN.
+    """
+    parts = [data]
+    for matrix, cols, nan_rows in fractions.values():
+        if len(cols) > 0:
+            values = matrix.toarray()
+            values[nan_rows] = np.nan
+            parts.append(pd.DataFrame(values, columns=cols, index=data.index))
+    return pd.concat(parts, axis=1)
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    path = args[0]
+    stem = f"{path[:-len('.csv')]}_sparse"
+    chunksize = 50000
+
+    # Read the dataset in chunks, and only keep the blocks in memory as sparse matrices
+    first = True
+    parts = {prefix: [] for prefix in blocks}
+    nan_parts = {prefix: [] for prefix in blocks}
+    for chunk in pd.read_csv(path, index_col=0, chunksize=chunksize):
+        chunk, fractions = split_blocks(chunk)
+        chunk.to_csv(f'{stem}.csv', mode='w' if first else 'a', header=first, na_rep='NA')
+        first = False
+        for prefix, (matrix, cols, nan_rows) in fractions.items():
+            parts[prefix].append(matrix)
+            nan_parts[prefix].append(nan_rows)
+
+    fractions = {prefix: (sp.vstack(parts[prefix]).tocsr(), cols, np.concatenate(nan_parts[prefix]))
+                 for prefix, (_, cols, _) in fractions.items()}
+    save_blocks(fractions, stem)
+    for prefix, (matrix, cols, nan_rows) in fractions.items():
+        print(f'{prefix}: {len(cols)} columns, {matrix.nnz} values that are not 0 ({matrix.nnz / max(np.prod(matrix.shape), 1):.2%}), '
+              f'{nan_rows.sum()} rows that are all NaN')
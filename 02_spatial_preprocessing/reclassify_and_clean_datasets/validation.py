@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script contains the data-quality validation of the cleaning scripts. The
+quality rules (e.g. OWD >= 0, QC_CO2flx <= 6, PAR_abs > 0) used to be filters
+spread over the scripts, without a record of how many rows each of them threw out.
+Here, every rule is a dictionary with a name and a check: a vectorized function
+that returns for every row whether it passes the rule. The rule sets themselves
+are defined in cleaning.py.
+
+validate checks all rules of a stage (e.g. prepare, post, trim) at once, and
+adds to the report per rule and per site:
+    n_rows:     number of rows that are checked
+    n_failed:   number of rows that fail the rule
+    n_dropped:  number of rows that fail the rule, and pass the rules before it
+                (in the order of the rule set), so that the n_dropped of a stage
+                add up to the rows that are thrown out in that stage
+The report is saved as a small csv file next to the output
+(<output>_validation.csv). When the data is validated per chunk or per partition,
+the reports are added up (combine_reports).
+
+Functions:
+    validate:           check the rules of a stage, returns the rows to keep
+    combine_reports:    one report of several reports (sums of the counts)
+    save_report, load_report: the report as a csv file
+"""
+#%% Import packages
+
+import os
+import numpy as np
+import pandas as pd
+
+#%% Validate
+
+report_cols = ['stage', 'rule', 'source', 'site', 'n_rows', 'n_failed', 'n_dropped']
+
+def validate(data, rules, source, stage, report=None):
+    """
+    data: dataframe to check
+    rules: list of rules, dictionaries with a name and a check (function of the
+           dataframe that returns a boolean Series or array: True if a row passes)
+    source: source of the data ('tower' or 'airborne')
+    stage: name of the stage of the cleaning, e.g. 'prepare'
+    report: list to which the report of this stage is added (optional)
+
+    Returns a boolean array of the rows that pass all rules.
+    """
+    passed = np.ones((len(data), len(rules)), dtype=bool)
+    for j, rule in enumerate(rules):
+        passed[:, j] = np.asarray(rule['check'](data), dtype=bool)
+
+    # a row is dropped by the first rule that it fails
+    failed = ~passed
+    dropped = failed & (np.cumsum(failed, axis=1) == 1)
+    keep = passed.all(axis=1)
+
+    if report is not None:
+        site = data['site'].to_numpy() if 'site' in data.columns else np.full(len(data), 'all')
+        names = [rule['name'] for rule in rules]
+        counts = pd.concat({'n_failed': pd.DataFrame(failed, columns=names),
+                            'n_dropped': pd.DataFrame(dropped, columns=names)}, axis=1)
+        counts = counts.groupby(pd.Series(site, name='site'), dropna=False).sum()
+
+        n_rows = pd.Series(site).value_counts(dropna=False)
+        for name in names:
+            report.append(pd.DataFrame({'stage': stage, 'rule': name, 'source': source,
+                                        'site': counts.index, 'n_rows': n_rows[counts.index].to_numpy(),
+                                        'n_failed': counts[('n_failed', name)].to_numpy(),
+                                        'n_dropped': counts[('n_dropped', name)].to_numpy()}))
+    return keep
+
+#%% Reports
+
+def combine_reports(report):
+    """
+    report: list of reports (dataframes), e.g. of all chunks or partitions
+
+    Returns one report with the counts added up per stage, rule, source and site
+    (in the order in which they are first reported).
+    """
+    if len(report) == 0:
+        return pd.DataFrame(columns=report_cols)
+    combined = pd.concat(report, ignore_index=True)
+    return (combined.groupby(['stage', 'rule', 'source', 'site'], sort=False, dropna=False)
+            [['n_rows', 'n_failed', 'n_dropped']].sum().reset_index())
+
+
+def report_path(out_path):
+    """
+    Returns the file of the report of an output file (<output>_validation.csv).
+    """
+    return f'{os.path.splitext(out_path)[0]}_validation.csv'
+
+
+def save_report(out_path, report):
+    """
+    Saves the (combined) report next to the output file out_path, and prints the
+    number of rows dropped per rule.
+    """
+    combined = combine_reports(report)
+    combined.to_csv(report_path(out_path), index=False)
+    for (stage, rule), n in combined.groupby(['stage', 'rule'], sort=False)['n_dropped'].sum().items():
+        print(f'{stage}: {rule}: {n} rows dropped')
+    return combined
+
+
+def load_report(out_path):
+    """
+    Returns the report of an output file as a list (to combine with other
+    reports), or an empty list if there is no report.
+    """
+    path = report_path(out_path)
+    if not os.path.exists(path):
+        return []
+    return [pd.read_csv(path, keep_default_na=False, na_values=[''])]
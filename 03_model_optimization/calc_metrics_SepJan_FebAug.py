@@ -17,12 +17,13 @@ Edits by arietma:
     - Specified the script for the seasonal datasets and models
     - Included different data folds based on week number
     - Changed division of train-test data
+    - No scaling for the tree model (fit_utils.py)
 """
 
 #%% Import packages
 
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
+from fit_utils import prepare_train_test
 from sklearn.metrics import r2_score, explained_variance_score
 from xgboost.sklearn import XGBRegressor
 from mlxtend.evaluate import bias_variance_decomp
@@ -98,15 +99,14 @@ for foldno, test_data in enumerate(dataframes, start=1): #iterates over foldnumb
     X_test = test_data[feats]
     y_test = test_data['CO2flx']
 
-    # Scale X data
-    sc = StandardScaler()
-    X_train_sc = pd.DataFrame(sc.fit_transform(X_train), columns=X_train.columns)
-    X_test_sc = pd.DataFrame(sc.transform(X_test),columns=X_train.columns)
-    
     # Prepare model with standard hyperparameters
     model = XGBRegressor(n_estimators = 1000, learning_rate= 0.05, max_depth=6, subsample=1)
     sfs_scoring = 'r2'
 
+    # Scale X data, only if needed: XGBoost is a tree model, so X_train and
+    # X_test are used as they are, without a copy (fit_utils.py)
+    X_train_sc, X_test_sc, sc = prepare_train_test(model, X_train, X_test)
+
     # Initialize df for storing results
     results = {}
     metrics = ['mse', 'bias', 'var', 'r2', 'expl_var']
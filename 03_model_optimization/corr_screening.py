@@ -0,0 +1,306 @@
+"""
+@author: arietma
+edited from: corr_matrix.py and corr_pearson.py
+
+This script screens the candidate features on their correlation with the CO2 flux
+and with each other, and makes the pre-selection of the features that move on to
+SBFS. In corr_matrix.py and corr_pearson.py, the Pearson correlation is computed
+separately and the cut-offs are drawn by hand in the figures.
+
+Three correlation measures are computed for all features and CO2flx:
+    Pearson:    with the observations that are available for both columns (as
+                DataFrame.corr()). All pairs are computed together from matrix
+                products of blocks of rows, so hundreds of features (e.g. every
+                LGN and soil class) take seconds
+    Spearman:   the Pearson correlation of the ranks, in the same pass over the
+                rows. Every column is ranked on all its available observations
+                (the same as DataFrame.corr(method='spearman') without NaN)
+    distance correlation: also measures non-linear (non-monotonic) relations,
+                computed on a random sample of n_dcor complete rows, since it
+                needs the distances between all pairs of rows. By default only
+                with CO2flx, the pairs of features are optional (dcor_pairs)
+with the p-values: the t-test for Pearson and Spearman, and the asymptotic
+(conservative) chi-squared test of Szekely et al. (2007) for the distance
+correlation.
+
+Features that are correlated with each other are grouped with hierarchical
+clustering (complete linkage on 1 - |Spearman|), so within a group all features
+have a |correlation| of at least group_threshold.
+
+The pre-selection discards the features that are:
+    constant:   no correlation can be computed
+    weak:       the strongest of |Pearson|, |Spearman| and the distance correlation
+                with CO2flx is below min_target_corr, or none is significant
+    redundant:  in a group with a feature that is stronger correlated with CO2flx
+It is saved as a json file, with the selected features, the discarded features
+and the reason, and the groups. sbfs_hpc.py reads the discarded features from it.
+
+Input: final merged dataset (.csv)
+Output: screening table with the correlations and p-values of every feature with
+        CO2flx and its group (.csv), and the pre-selection (.json)
+
+Functions:
+    screen:             Pearson, Spearman and distance correlation with p-values
+    correlated_groups:  groups of correlated features (hierarchical clustering)
+    preselect:          the selected and discarded features
+    screening_table:    the correlations of every feature with CO2flx, as a dataframe
+    save_preselection, load_preselection: the pre-selection as a json file
+"""
+#%% Import packages
+
+import json
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata, t, chi2
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial.distance import squareform
+
+#%% Pearson and Spearman, in one pass over blocks of rows
+
+def block_moments(B):
+    """
+    B: float64 array (rows, q) with a block of rows, with NaN for missing values
+
+    Returns, for every pair of columns (i, j), over the rows where both are
+    available: the number of rows, the sum of column i, the sum of squares of
+    column i, and the sum of the products, stacked in an array (4, q, q).
+    """
+    M = ~np.isnan(B)
+    B = np.where(M, B, 0.0)
+    M = M.astype(np.float64)
+    return np.stack([M.T @ M, B.T @ M, (B * B).T @ M, B.T @ B])
+
+
+def corr_from_moments(n, s, ss, sp):
+    """
+    Returns the correlation and the p-value (t-test) of every pair of columns.
+    NaN if a column is constant.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sp - s * s.T
+        var = n * ss - s * s
+        r = np.clip(cov / np.sqrt(var * var.T), -1, 1)
+        stat = r * np.sqrt((n - 2) / (1 - r**2))
+    p = 2 * t.sf(np.abs(stat), n - 2)
+    return r, p
+
+#%% Distance correlation
+
+def double_centered(x):
+    """
+    x: array (m, k) with k columns
+    Returns the double-centered distance matrices (k, m*m), as float32, and the
+    mean distance of every column.
+    """
+    x = x.astype(np.float32)
+    d = np.abs(x[:, None, :] - x[None, :, :])
+    mean_d = d.mean(axis=(0, 1), dtype=np.float64)
+    d -= d.mean(axis=0, keepdims=True)
+    d -= d.mean(axis=1, keepdims=True)
+    return d.reshape(-1, x.shape[1]).T, mean_d
+
+
+def distance_corr(x, target_col=None, block_cols=16):
+    """
+    x: array (m, q) without missing values
+    target_col: if given, only the distance correlations with this column are
+                computed (the other pairs are NaN), which is much faster
+    block_cols: number of columns of which the distance matrices are made together
+
+    Returns the distance correlation and the p-value of every pair of columns.
+    The squared distance covariances are products of the double-centered distance
+    matrices.
+    """
+    m, q = x.shape
+    dcov = np.full((q, q), np.nan)
+    mean_d = np.zeros(q)
+    starts = range(0, q, block_cols)
+
+    if target_col is not None:
+        T, _ = double_centered(x[:, [target_col]])
+    for a in starts:
+        A, mean_d[a:a+block_cols] = double_centered(x[:, a:a+block_cols])
+        cols = np.arange(a, min(a + block_cols, q))
+        dcov[cols, cols] = np.einsum('ij,ij->i', A, A, dtype=np.float64) / m**2
+        if target_col is not None:
+            dcov[cols, target_col] = dcov[target_col, cols] = (A @ T[0]) / m**2
+            continue
+        for b in starts:
+            if b < a:
+                continue
+            B = A if b == a else double_centered(x[:, b:b+block_cols])[0]
+            dcov[a:a+block_cols, b:b+block_cols] = (A @ B.T) / m**2
+            dcov[b:b+block_cols, a:a+block_cols] = dcov[a:a+block_cols, b:b+block_cols].T
+
+    dvar = np.diag(dcov)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dcor = np.sqrt(np.clip(dcov, 0, None) / np.sqrt(np.outer(dvar, dvar)))
+        stat = m * dcov / np.outer(mean_d, mean_d)
+    p = chi2.sf(stat, 1)
+    return dcor, p
+
+#%% Screening
+
+def screen(data, feats, target='CO2flx', n_dcor=1000, dcor_pairs=False, block_rows=16384, seed=0):
+    """
+    data: dataframe with the features and the target
+    feats: candidate features
+    target: column of the CO2 flux
+    n_dcor: number of rows for the distance correlation
+    dcor_pairs: if True, the distance correlation of all pairs of features is
+                computed, otherwise only with the target (the other pairs are NaN)
+    block_rows: number of rows per matrix product
+    seed: seed of the sample for the distance correlation
+
+    Returns a dictionary with dataframes (features and target on both axes):
+    pearson, spearman and dcor, their p-values p_pearson, p_spearman and p_dcor,
+    and n, the number of rows of every pair. n_dcor is the number of rows used for
+    the distance correlation.
+    """
+    cols = list(feats) + [target]
+    q = len(cols)
+    X = data[cols].to_numpy(dtype=np.float64)
+
+    # center the columns, so the sums of squares do not lose precision
+    X -= np.nanmean(X, axis=0)
+    R = rankdata(X, axis=0, nan_policy='omit')
+    R -= np.nanmean(R, axis=0)
+
+    # Pearson and Spearman in one pass over the rows
+    moments = [np.zeros((4, q, q)), np.zeros((4, q, q))]
+    for start in range(0, len(X), block_rows):
+        for k, Z in enumerate([X, R]):
+            moments[k] += block_moments(Z[start:start+block_rows])
+    r_pearson, p_pearson = corr_from_moments(*moments[0])
+    r_spearman, p_spearman = corr_from_moments(*moments[1])
+
+    # Distance correlation on a sample of the complete rows
+    complete = np.flatnonzero(~np.isnan(X).any(axis=1))
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(complete, size=min(n_dcor, len(complete)), replace=False)
+    dcor, p_dcor = distance_corr(X[np.sort(sample)], None if dcor_pairs else q - 1)
+
+    frame = lambda values: pd.DataFrame(values, index=cols, columns=cols)
+    return {'pearson': frame(r_pearson), 'spearman': frame(r_spearman), 'dcor': frame(dcor),
+            'p_pearson': frame(p_pearson), 'p_spearman': frame(p_spearman), 'p_dcor': frame(p_dcor),
+            'n': frame(moments[0][0]), 'n_dcor': len(sample), 'feats': list(feats), 'target': target}
+
+#%% Groups of correlated features and pre-selection
+
+def correlated_groups(corr, group_threshold=0.7):
+    """
+    corr: correlation dataframe of the features (e.g. screen(...)['spearman'])
+    group_threshold: minimum |correlation| between all features of a group
+
+    Returns the group number of every feature (series). Features that are not
+    correlated with any other feature are a group of one.
+    """
+    dist = 1 - np.abs(corr.to_numpy())
+    dist = np.nan_to_num(dist, nan=1.0)
+    np.fill_diagonal(dist, 0)
+    dist = (dist + dist.T) / 2
+    Z = linkage(squareform(dist, checks=False), method='complete')
+    return pd.Series(fcluster(Z, 1 - group_threshold, criterion='distance'), index=corr.index)
+
+
+def screening_table(result, groups=None):
+    """
+    Returns a dataframe with the correlations and p-values of every feature with
+    the target, the strongest of the three (strength), and the group.
+    """
+    target = result['target']
+    feats = result['feats']
+    table = pd.DataFrame({name: result[name].loc[feats, target]
+                          for name in ['pearson', 'spearman', 'dcor', 'p_pearson', 'p_spearman', 'p_dcor']})
+    table['strength'] = pd.concat([table['pearson'].abs(), table['spearman'].abs(), table['dcor']], axis=1).max(axis=1)
+    if groups is not None:
+        table['group'] = groups.reindex(feats)
+    return table
+
+
+def preselect(result, min_target_corr=0.05, alpha=0.05, group_threshold=0.7, exclude=(), keep=()):
+    """
+    result: result of screen
+    min_target_corr: minimum strength of the correlation with CO2flx
+    alpha: significance level of the p-values
+    group_threshold: see correlated_groups
+    exclude: features that are discarded anyway and do not take part in the
+             groups, e.g. the groundwater-related variables that are added per
+             model iteration in sbfs_hpc.py
+    keep: features that are always selected
+
+    Returns the pre-selection: a dictionary with the selected features, the
+    discarded features with the reason, the groups of correlated features, the
+    settings, and the screening table.
+    """
+    feats = [feat for feat in result['feats'] if feat not in exclude]
+    groups = correlated_groups(result['spearman'].loc[feats, feats], group_threshold)
+    table = screening_table(result, groups)
+
+    discarded = {feat: 'excluded' for feat in result['feats'] if feat in exclude}
+    for feat in feats:
+        if feat in keep:
+            continue
+        row = table.loc[feat]
+        if np.isnan(row['strength']):
+            discarded[feat] = 'constant'
+        elif row['strength'] < min_target_corr or not (row[['p_pearson', 'p_spearman', 'p_dcor']] < alpha).any():
+            discarded[feat] = 'weak'
+
+    # in every group, only the strongest feature is kept
+    for group, members in table.loc[feats].groupby('group'):
+        candidates = members[~members.index.isin(discarded)]
+        if len(candidates) < 2:
+            continue
+        best = candidates['strength'].idxmax()
+        for feat in candidates.index:
+            if feat != best and feat not in keep:
+                discarded[feat] = f'redundant with {best}'
+
+    selected = [feat for feat in result['feats'] if feat not in discarded]
+    group_list = [list(members.index) for _, members in table.loc[feats].groupby('group') if len(members) > 1]
+
+    return {'target': result['target'], 'selected': selected, 'discarded': discarded, 'groups': group_list,
+            'settings': {'min_target_corr': min_target_corr, 'alpha': alpha,
+                         'group_threshold': group_threshold, 'n_dcor': result['n_dcor']},
+            'table': table}
+
+
+def save_preselection(preselection, path):
+    """
+    Saves the pre-selection (without the screening table) as a json file.
+    """
+    with open(path, 'w') as f:
+        json.dump({key: value for key, value in preselection.items() if key != 'table'}, f, indent=4)
+
+
+def load_preselection(path):
+    with open(path) as f:
+        return json.load(f)
+
+#%% Run the screening
+
+if __name__ == '__main__':
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    mer = pd.read_csv(f"{WD}merged_0228_final.csv", index_col=0, na_values='nan')
+
+    # All candidate features, as in corr_pearson.py
+    LGN_classes = ['Grs', 'SuC', 'SpC', 'Ghs', 'dFr', 'cFr', 'Wat',
+           'Bld', 'bSl', 'Hth', 'FnB', 'Shr']
+    soil_classes = ['hV', 'W', 'pV', 'kV', 'hVz', 'V',
+           'Vz', 'aVz', 'kVz', 'overigV', 'zandG', 'zeeK', 'rivK', 'gedA', 'leem']
+
+    all_feats = ['PAR_abs', 'Tsfc', 'VPD', 'RH', 'NDVI', 'EVI', 'BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD'] + LGN_classes + soil_classes
+
+    # The groundwater-related variables are added per model iteration in SBFS
+    groundwater_vars = ['BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD']
+
+    result = screen(mer, all_feats)
+    preselection = preselect(result, exclude=groundwater_vars)
+
+    preselection['table'].to_csv(f"{WD}modelling/0228_mer_corr_screening.csv")
+    save_preselection(preselection, f"{WD}modelling/0228_mer_preselection.json")
+
+    print('selected:', preselection['selected'])
+    print('discarded:', preselection['discarded'])
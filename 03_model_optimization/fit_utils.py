@@ -0,0 +1,108 @@
+"""
+@author: arietma
+
+This script provides the scaling step for model fitting. Tree models (XGBoost
+with the gbtree or dart booster, and decision tree ensembles) split on thresholds,
+and a split on the scaled feature (x - mean)/std is the same split as on x. The
+StandardScaler therefore does not change a tree model, but every
+pd.DataFrame(sc.fit_transform(X), columns=X.columns) costs two full copies of the
+data, which adds up in SBFS and bootstrap loops that fit thousands of times.
+
+For tree models, scaling is skipped and the data is passed on without a copy. For
+other models, the data is scaled in place on a float32 array.
+
+Functions:
+    is_tree_model:      True if scaling does not change the model
+    scale_inplace:      fits and/or applies a StandardScaler in place on a float32 array
+    prepare_train_test: X_train and X_test for a model, scaled only if needed
+    apply_scaler:       X for predicting with a model, scaled only if a scaler is given
+"""
+#%% Import packages
+
+import numpy as np
+import pandas as pd
+from xgboost import XGBModel
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import BaseDecisionTree
+from sklearn.ensemble import (RandomForestRegressor, ExtraTreesRegressor,
+                              GradientBoostingRegressor, HistGradientBoostingRegressor)
+
+#%% Functions
+
+tree_models = (BaseDecisionTree, RandomForestRegressor, ExtraTreesRegressor,
+               GradientBoostingRegressor, HistGradientBoostingRegressor)
+
+def is_tree_model(model):
+    """
+    Returns True for XGBoost models with the gbtree (default) or dart booster and
+    for sklearn tree models, for which scaling the features does not change the model.
+    """
+    if isinstance(model, XGBModel):
+        return model.get_params().get('booster') in (None, 'gbtree', 'dart')
+    return isinstance(model, tree_models)
+
+
+def scale_inplace(X, sc=None):
+    """
+    X: writeable float32 array (e.g. from to_float32), which is overwritten
+       with the scaled values
+    sc: fitted StandardScaler. If not given, a new scaler is fitted on X
+
+    Returns the scaler.
+    """
+    if sc is None:
+        sc = StandardScaler().fit(X)
+    X -= sc.mean_
+    X /= sc.scale_
+    return sc
+
+
+def to_float32(X):
+    """
+    Returns X as a float32 array (a copy, in which can be scaled in place).
+    """
+    if isinstance(X, pd.DataFrame):
+        return X.to_numpy(dtype=np.float32, copy=True)
+    return np.array(X, dtype=np.float32)
+
+
+def prepare_train_test(model, X_train, X_test=None, scale=None):
+    """
+    model: the model that will be fitted
+    X_train, X_test: train and test features (dataframes or arrays)
+    scale: True or False to force scaling on or off. If not given, only models
+           that are not tree models are scaled
+
+    Returns X_train, X_test and the scaler. Without scaling, X_train and X_test
+    are returned as they are (no copy) and the scaler is None. With scaling, they
+    are scaled in place on float32 copies; dataframes stay dataframes with the
+    same columns and index.
+    """
+    if scale is None:
+        scale = not is_tree_model(model)
+    if not scale:
+        return X_train, X_test, None
+
+    X_train_sc = to_float32(X_train)
+    sc = scale_inplace(X_train_sc)
+    if isinstance(X_train, pd.DataFrame):
+        X_train_sc = pd.DataFrame(X_train_sc, columns=X_train.columns, index=X_train.index, copy=False)
+
+    X_test_sc = None
+    if X_test is not None:
+        X_test_sc = to_float32(X_test)
+        scale_inplace(X_test_sc, sc)
+        if isinstance(X_test, pd.DataFrame):
+            X_test_sc = pd.DataFrame(X_test_sc, columns=X_test.columns, index=X_test.index, copy=False)
+
+    return X_train_sc, X_test_sc, sc
+
+
+def apply_scaler(sc, X):
+    """
+    Returns X for predicting: X itself if sc is None (tree models), and
+    otherwise the scaled X.
+    """
+    if sc is None:
+        return X
+    return sc.transform(X)
@@ -19,6 +19,7 @@ Edits by arietma:
     used in the current thesis
     - Changed the data division into train and test set (used to be random division)
     - Changed the code so that it can be run in HPC
+    - Removed the unused scaling of X data (fit_utils.py)
 
 """
 #%% Import packages
@@ -26,7 +27,6 @@ Edits by arietma:
 import pandas as pd
 from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.model_selection import GridSearchCV
-from sklearn.preprocessing import StandardScaler
 from xgboost.sklearn import XGBRegressor
 from datetime import datetime
 
@@ -98,11 +98,8 @@ X_test = test_data[feats]
 y_test = test_data['CO2flx']
 
 
-#%% Scale X data
-sc = StandardScaler()
-
-X_train_sc = pd.DataFrame(sc.fit_transform(X_train), columns=X_train.columns)
-X_test_sc = pd.DataFrame(sc.transform(X_test),columns=X_train.columns)
+#%% No scaling of X data: XGBoost is a tree model, and the grid search is fitted
+# on the unscaled X_train (see fit_utils.py)
 
 
 #%% Initialize XGBoost
@@ -0,0 +1,232 @@
+"""
+@author: arietma
+edited from: xgboost_feature_importance.py
+
+This script calculates the feature importances over the five week-based data
+folds, instead of from one model fitted on all data (xgboost_feature_importance.py),
+which gives a single noisy ranking. For every fold as test fold, an XGBoost model
+is fitted on the other folds and three importances are calculated:
+    gain:       the average gain of the splits on the feature (as feature_importances_),
+                normalized to a sum of 1
+    cover:      the average cover of the splits on the feature, normalized to a sum of 1
+    perm_mse:   permutation importance: the increase of the MSE on the test fold
+                when the values of the feature are shuffled, averaged over n_repeats
+                shuffles (perm_r2 is the decrease of the R2)
+The importances are summarized over the folds with the mean and the standard
+deviation (spread) per feature.
+
+The folds are run in parallel, on n_workers worker processes with n_threads
+XGBoost threads each. The features are one float32 matrix (model_dataset.py) in
+shared memory, which the workers read without a copy. For the permutation
+importance, the test fold is copied once into a buffer with n_repeats copies; for
+every feature, its column is shuffled in every copy, all copies are predicted in
+one batch, and the column is restored.
+
+Input: final merged dataset (.csv), and the pre-selection of corr_screening.py
+Output: the importances per fold and their summary (.csv), and the importance
+        selection (.json): the pre-selection with the features that are not
+        important added to the discarded features. The pre-selection of
+        corr_screening.py is not changed, so a rerun gives the same selection
+
+Functions:
+    fold_importance:    gain, cover and permutation importance of one test fold
+    run_importance:     the importances of all folds, in parallel
+    summarize:          mean and spread of the importances per feature
+    not_important:      the features of which the permutation importance is not
+                        larger than its spread
+"""
+#%% Import packages
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from xgboost import XGBRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+
+from model_dataset import load_dataset, train_test, n_folds
+from corr_screening import load_preselection, save_preselection
+
+#%% Importance of one fold
+
+# standard hyperparameters, as in xgboost_feature_importance.py
+hyperparams = {'n_estimators': 1000, 'learning_rate': 0.1, 'max_depth': 6, 'subsample': 1}
+
+def permutation_importance(booster, X_test, y_test, n_repeats=5, seed=0, batch_rows=500000):
+    """
+    booster: booster of the fitted model
+    X_test, y_test: float32 features and target of the test fold
+    n_repeats: number of shuffles per feature
+    seed: seed of the shuffles
+
+    Returns the increase of the MSE and the decrease of the R2 of every feature
+    (averaged over the shuffles).
+    """
+    rng = np.random.default_rng(seed)
+    n, p = X_test.shape
+    mse_base = mean_squared_error(y_test, booster.inplace_predict(X_test))
+    r2_base = r2_score(y_test, booster.inplace_predict(X_test))
+
+    # n_repeats copies of the test fold, predicted together
+    buffer = np.empty((n_repeats, n, p), dtype=np.float32)
+    buffer[:] = X_test
+    flat = buffer.reshape(-1, p)
+    y_rep = np.tile(y_test, n_repeats)
+
+    perm_mse = np.zeros(p)
+    perm_r2 = np.zeros(p)
+    for j in range(p):
+        for r in range(n_repeats):
+            buffer[r, :, j] = X_test[rng.permutation(n), j]
+
+        pred = np.concatenate([booster.inplace_predict(flat[start:start+batch_rows])
+                               for start in range(0, len(flat), batch_rows)])
+        err = (pred - y_rep).reshape(n_repeats, n)
+        mse = (err**2).mean(axis=1)
+        r2 = 1 - mse * n / ((y_test - y_test.mean())**2).sum()
+
+        perm_mse[j] = mse.mean() - mse_base
+        perm_r2[j] = r2_base - r2.mean()
+
+        # restore the column
+        buffer[:, :, j] = X_test[:, j]
+
+    return perm_mse, perm_r2
+
+
+def fold_importance(ds, test_fold, feats, n_repeats=5, n_threads=None, seed=0):
+    """
+    ds: dataset of model_dataset.py (at least X, y, col and fold_start)
+    test_fold: fold (1-5) that is the test set
+    feats: features of the model
+    n_repeats: number of shuffles per feature for the permutation importance
+    n_threads: number of threads XGBoost may use
+
+    Returns a dataframe with the gain, cover, perm_mse and perm_r2 of every feature.
+    """
+    X_train, y_train, X_test, y_test = train_test(ds, test_fold, feats)
+
+    model = XGBRegressor(**hyperparams, n_jobs = n_threads)
+    model.fit(X_train, y_train)
+    booster = model.get_booster()
+
+    # the booster names the features f0, f1, ... (trained on an array)
+    importances = pd.DataFrame(index=list(feats))
+    for kind in ['gain', 'cover']:
+        score = booster.get_score(importance_type=kind)
+        values = np.array([score.get(f'f{j}', 0.0) for j in range(len(feats))])
+        importances[kind] = values / values.sum()
+
+    X_test = np.ascontiguousarray(X_test)
+    importances['perm_mse'], importances['perm_r2'] = permutation_importance(
+        booster, X_test, y_test, n_repeats, seed + test_fold)
+    return importances
+
+#%% All folds, in parallel
+
+_worker_args = None
+
+def _init_worker(shm_name, shape, y, col, fold_start, feats, n_repeats, n_threads, seed):
+    global _worker_args
+    shm = shared_memory.SharedMemory(name=shm_name)
+    X = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    ds = {'X': X, 'y': y, 'col': col, 'fold_start': fold_start}
+    # keep a reference to the shared memory, so the buffer stays valid
+    _worker_args = (shm, ds, feats, n_repeats, n_threads, seed)
+
+
+def _run_fold_in_worker(test_fold):
+    shm, ds, feats, n_repeats, n_threads, seed = _worker_args
+    return fold_importance(ds, test_fold, feats, n_repeats, n_threads, seed)
+
+
+def run_importance(ds, feats=None, folds=range(1, n_folds+1), n_repeats=5, n_workers=1, n_threads=None, seed=0):
+    """
+    ds: dataset of model_dataset.py
+    feats: features of the model (default: all features of the dataset)
+    folds: test folds
+    n_repeats: number of shuffles per feature for the permutation importance
+    n_workers: number of worker processes (at most one per fold)
+    n_threads: number of threads of XGBoost in every worker
+    seed: seed of the shuffles
+
+    Returns a dataframe with the importances of every feature (rows) for every
+    test fold (column fold).
+    """
+    if feats is None:
+        feats = ds['feats']
+    folds = list(folds)
+
+    if n_workers == 1:
+        results = [fold_importance(ds, fold, feats, n_repeats, n_threads, seed) for fold in folds]
+    else:
+        # the features in shared memory, the workers do not get a copy
+        shm = shared_memory.SharedMemory(create=True, size=ds['X'].nbytes)
+        try:
+            X = np.ndarray(ds['X'].shape, dtype=np.float32, buffer=shm.buf)
+            X[:] = ds['X']
+            with ProcessPoolExecutor(max_workers=min(n_workers, len(folds)), initializer=_init_worker,
+                                     initargs=(shm.name, X.shape, ds['y'], ds['col'], ds['fold_start'],
+                                               feats, n_repeats, n_threads, seed)) as pool:
+                results = list(pool.map(_run_fold_in_worker, folds))
+            del X
+        finally:
+            shm.close()
+            shm.unlink()
+
+    for fold, result in zip(folds, results):
+        result['fold'] = fold
+    return pd.concat(results).rename_axis('feat')
+
+
+def summarize(importances):
+    """
+    Returns the mean and the standard deviation over the folds of every importance,
+    per feature, sorted by the mean permutation importance.
+    """
+    summary = importances.groupby('feat').agg(['mean', 'std']).drop(columns='fold')
+    summary.columns = [f'{kind}_{stat}' for kind, stat in summary.columns]
+    return summary.sort_values('perm_mse_mean', ascending=False)
+
+
+def not_important(summary):
+    """
+    Returns the features of which the mean permutation importance (increase of
+    the MSE) is not larger than its spread over the folds.
+    """
+    return list(summary.index[summary['perm_mse_mean'] <= summary['perm_mse_std']])
+
+#%% Run
+
+if __name__ == '__main__':
+    # python importance_engine.py <n_workers> <n_threads>
+    args = sys.argv[1:]
+    n_workers = int(args[0]) if len(args) > 0 else 1
+    n_threads = int(args[1]) if len(args) > 1 else None
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+
+    # The features that remain after the correlation screening (corr_screening.py)
+    preselection = load_preselection(f"{WD}modelling/0228_mer_preselection.json")
+    feats = list(preselection['selected'])
+
+    ds = load_dataset(f"{WD}merged_0228_final.csv", feats)
+
+    start_time = time.time()
+    importances = run_importance(ds, feats, n_workers=n_workers, n_threads=n_threads)
+    summary = summarize(importances)
+    print(f"Elapsed time: {time.time() - start_time:.2f} seconds")
+
+    importances.to_csv(f"{WD}modelling/0228_mer_importances_folds.csv")
+    summary.to_csv(f"{WD}modelling/0228_mer_importances_summary.csv")
+
+    # The features that are not important do not move on to SBFS. They are saved
+    # in a separate file, the pre-selection stays the input of the next run
+    selection = {**preselection, 'selected': list(feats), 'discarded': dict(preselection['discarded'])}
+    for feat in not_important(summary):
+        selection['selected'].remove(feat)
+        selection['discarded'][feat] = 'not important'
+    save_preselection(selection, f"{WD}modelling/0228_mer_importance_selection.json")
+    print('discarded:', selection['discarded'])
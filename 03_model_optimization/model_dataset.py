@@ -0,0 +1,269 @@
+"""
+@author: arietma
+
+This script provides a compact in-memory dataset for the modelling scripts. The
+merged dataset is otherwise loaded with all its columns as float64 and the
+source and site as text (object dtype), and then sliced (train_data[feats]),
+concatenated (pd.concat(train_data_list)) and copied for every fold.
+
+The dataset is a dictionary with:
+    X:          the features as one C-contiguous float32 matrix (rows, feats),
+                which is the dtype XGBoost uses anyway
+    y:          CO2flx (float64, so the metrics are not changed)
+    feats, col: the features and their column in X
+    codes:      the categorical columns (source and site) as int8 codes, with
+                the names in categories
+    fold:       bitmask of the data fold of every row: bit k is set if the row is
+                in fold k+1 (week-based folds, as in sbfs_hpc.py)
+    season:     bitmask of the season of every row: 1 for SepJan, 2 for FebAug,
+                by the month of the row as the seasonal subsets (season_months
+                in cleaning.py)
+    fold_start: position of the first row of every fold
+    index, weekno: the index in the csv file and the week number of every row
+
+The rows are ordered by fold (and within a fold in the original order), so every
+fold is a contiguous block of rows. The rows of a fold, and a set of features that
+are next to each other in X, are therefore views on X, which XGBoost reads
+without a copy. The train set of a test fold is at most one float32 copy of the
+selected features, in the same order as pd.concat of the other folds.
+
+Functions:
+    fold_weeks:     the week numbers of every fold
+    build_dataset:  the dataset of a dataframe
+    load_dataset:   the dataset of a csv file, reading only the columns that are needed
+    select_rows:    boolean mask of the rows in some folds and/or seasons
+    view:           X and y of some rows and features, without a copy if possible
+    train_test:     X and y of the train folds and the test fold
+    as_frame:       X as a dataframe with the feature names, without a copy
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_spatial_preprocessing', 'reclassify_and_clean_datasets'))
+from cleaning import season_months
+
+#%% Folds and seasons
+
+# Merged dataset: 50 weeks in 5 folds, and the remaining weeks 51 and 52 in fold3
+# and fold4, since these contain the least observations
+merged_weeks = list(range(1, 51))
+merged_extra_weeks = {2: [51], 3: [52]}
+
+# Seasonal datasets: the weeks that are divided over the folds (weeks of
+# build_dataset). These are only used for the folds; which rows are in a season
+# is decided by the month (season_months in cleaning.py)
+season_fold_weeks = {'SepJan': list(range(1, 6)) + list(range(35, 53)),
+                     'FebAug': list(range(5, 36))}
+season_bits = {'SepJan': 1, 'FebAug': 2}
+
+n_folds = 5
+
+def fold_weeks(weeks, extra_weeks=None):
+    """
+    weeks: week numbers that are divided over the folds
+    extra_weeks: dictionary with weeks that are added to a fold (index 0-4)
+
+    Returns the week numbers of every fold, assigned in the same way as in
+    sbfs_hpc.py, so that the folds do not have consecutive weeks.
+    """
+    folds = [[] for _ in range(n_folds)]
+    for i, week in enumerate(weeks, 1):
+        folds[i % n_folds].append(week)
+    if extra_weeks is not None:
+        for k, extra in extra_weeks.items():
+            folds[k] = folds[k] + list(extra)
+    return folds
+
+#%% Build the dataset
+
+def build_dataset(data, feats, target='CO2flx', cats=('source', 'site'), weeks=None, extra_weeks=None):
+    """
+    data: dataframe with the features, the target, Datetime and the categorical columns
+    feats: features in X, in this order. Put the features of the model first, so
+           that they are a view on X
+    target: column of y
+    cats: categorical columns
+    weeks, extra_weeks: week numbers of the folds (see fold_weeks). Default: the
+           folds of the merged dataset. For the seasonal datasets, use e.g.
+           weeks=season_fold_weeks['SepJan']
+
+    Returns the dataset dictionary (see above).
+    """
+    feats = list(feats)
+    if weeks is None:
+        weeks, extra_weeks = merged_weeks, merged_extra_weeks
+    folds = fold_weeks(weeks, extra_weeks)
+
+    weekno = pd.to_datetime(data['Datetime']).dt.isocalendar().week.to_numpy(dtype=np.int16)
+
+    # fold of every row (0-4), and n_folds for rows in none of the folds (e.g. week 53)
+    week_fold = np.full(54, n_folds, dtype=np.uint8)
+    for k, fold in enumerate(folds):
+        week_fold[fold] = k
+    fold_index = week_fold[weekno]
+
+    # rows ordered by fold, a stable sort keeps the original order within a fold
+    order = np.argsort(fold_index, kind='stable')
+    fold_index = fold_index[order]
+    fold_start = np.searchsorted(fold_index, np.arange(n_folds + 1))
+
+    # fill X column by column, so there is never a float64 copy of all features
+    X = np.empty((len(data), len(feats)), dtype=np.float32)
+    for j, feat in enumerate(feats):
+        X[:, j] = data[feat].to_numpy()[order]
+
+    fold = np.where(fold_index < n_folds, 1 << fold_index, 0).astype(np.uint8)
+
+    weekno = weekno[order]
+
+    # season of every row by its month, as the seasonal subsets (season_rows in cleaning.py)
+    month = pd.to_datetime(data['Datetime']).dt.month.to_numpy()[order]
+    season = np.zeros(len(data), dtype=np.uint8)
+    for name, bit in season_bits.items():
+        season[np.isin(month, season_months[name])] |= bit
+
+    codes, categories = {}, {}
+    for c in cats:
+        cat = pd.Categorical(data[c])
+        codes[c] = cat.codes[order].astype(np.int8)
+        categories[c] = list(cat.categories)
+
+    return {'X': X, 'y': data[target].to_numpy(dtype=np.float64)[order],
+            'feats': feats, 'col': {feat: j for j, feat in enumerate(feats)},
+            'codes': codes, 'categories': categories,
+            'fold': fold, 'season': season, 'fold_start': fold_start,
+            'index': data.index.to_numpy()[order], 'weekno': weekno}
+
+
+def load_dataset(path, feats, target='CO2flx', cats=('source', 'site'), Bld_filter=False,
+                 weeks=None, extra_weeks=None):
+    """
+    path: csv file of the dataset, e.g. f"{WD}merged_0228_final.csv"
+    feats, target, cats, weeks, extra_weeks: see build_dataset
+    Bld_filter: True to exclude airborne observations with >15% built environment
+
+    Returns the dataset dictionary. Only the needed columns are read, the features
+    directly as float32 and the categorical columns as categories. Bld is read as
+    float64 if Bld_filter, so the threshold of 0.15 is applied to the same values
+    as in the other scripts; it is converted to float32 in build_dataset.
+    """
+    cats = list(cats)
+    if Bld_filter and 'source' not in cats:
+        cats.append('source')
+    cols = list(dict.fromkeys(list(feats) + [target, 'Datetime'] + cats + (['Bld'] if Bld_filter else [])))
+
+    # the first column is the index. float32(0.15) > 0.15, so the column of the
+    # filter is not read as float32
+    index_col = pd.read_csv(path, nrows=0).columns[0]
+    dtype = {feat: np.float32 for feat in feats if not (Bld_filter and feat == 'Bld')}
+    dtype.update({c: 'category' for c in cats})
+    data = pd.read_csv(path, index_col=0, usecols=[index_col] + cols, dtype=dtype, na_values='nan')
+
+    # Exclude airborne observations with >15% built environment
+    if Bld_filter:
+        data = data[-((data['Bld'] > 0.15) & (data['source'] == 'airborne'))]
+
+    return build_dataset(data, feats, target, cats, weeks, extra_weeks)
+
+#%% Rows and columns
+
+def fold_rows(ds, fold):
+    """
+    Returns the rows of fold 1-5 as a slice.
+    """
+    return slice(ds['fold_start'][fold-1], ds['fold_start'][fold])
+
+
+def select_rows(ds, folds=None, seasons=None):
+    """
+    folds: folds (1-5) of the rows, e.g. [1, 2, 3, 4]
+    seasons: seasons of the rows, e.g. ['SepJan']
+
+    Returns a boolean mask of the rows in any of the folds and any of the seasons.
+    """
+    mask = np.ones(len(ds['y']), dtype=bool)
+    if folds is not None:
+        bits = sum(1 << (fold-1) for fold in folds)
+        mask &= (ds['fold'] & bits) != 0
+    if seasons is not None:
+        bits = sum(season_bits[s] for s in seasons)
+        mask &= (ds['season'] & bits) != 0
+    return mask
+
+
+def columns(ds, feats=None):
+    """
+    Returns the columns of feats in X: a slice if they are next to each other in
+    X (in the same order), otherwise an index array.
+    """
+    if feats is None:
+        return slice(None)
+    idx = np.array([ds['col'][feat] for feat in feats])
+    if np.all(np.diff(idx) == 1):
+        return slice(idx[0], idx[-1] + 1)
+    return idx
+
+
+def view(ds, rows=slice(None), feats=None):
+    """
+    rows: slice (e.g. fold_rows) or boolean mask (e.g. select_rows)
+    feats: features, default all
+
+    Returns X and y of the rows and features. X is a view on the dataset if rows
+    is a slice and the features are next to each other, otherwise a copy.
+    """
+    cols = columns(ds, feats)
+    if isinstance(cols, slice):
+        return ds['X'][rows, cols], ds['y'][rows]
+    return ds['X'][rows][:, cols], ds['y'][rows]
+
+
+def train_test(ds, test_fold, feats=None, out=None):
+    """
+    test_fold: fold (1-5) that is the test set, the other folds are the train set
+    feats: features, default all
+    out: optional float32 array (train rows, feats) to write X_train in, e.g. to
+         reuse the memory when looping over the test folds
+
+    Returns X_train, y_train, X_test and y_test. X_test is a view on the dataset
+    if the features are next to each other in X. X_train is a view as well if the
+    test fold is the first or last fold, otherwise it is written in one copy.
+    """
+    cols = columns(ds, feats)
+    test = fold_rows(ds, test_fold)
+    X_test, y_test = view(ds, test, feats)
+
+    # the other folds: before and after the test fold
+    parts = [slice(0, test.start), slice(test.stop, ds['fold_start'][n_folds])]
+    parts = [p for p in parts if p.stop > p.start]
+    y_train = np.concatenate([ds['y'][p] for p in parts])
+
+    if len(parts) == 1 and out is None:
+        X_train, _ = view(ds, parts[0], feats)
+        return X_train, y_train, X_test, y_test
+
+    n_cols = ds['X'][:0, cols].shape[1]
+    if out is None:
+        out = np.empty((len(y_train), n_cols), dtype=np.float32)
+    pos = 0
+    for p in parts:
+        n = p.stop - p.start
+        if isinstance(cols, slice):
+            out[pos:pos+n] = ds['X'][p, cols]
+        else:
+            np.take(ds['X'][p], cols, axis=1, out=out[pos:pos+n])
+        pos += n
+
+    return out, y_train, X_test, y_test
+
+
+def as_frame(X, feats):
+    """
+    Returns X as a dataframe with the feature names as columns, without a copy,
+    e.g. for scripts that select features by name.
+    """
+    return pd.DataFrame(X, columns=list(feats), copy=False)
@@ -15,9 +15,10 @@ The script can be run on HPC, in parallel, with different folds of the merged
 dataset as a test set. Later, 'in analyse_metrics_sbfs.py', the fold that is
 the final test set is selected.
 
-Input: final merged dataset (.csv). Also: the pre-selected features
-based on correlation and XGBoost feature importance, these are present in the code
-and here denoted by first_sel_X.
+Input: final merged dataset (.csv). Also: the pre-selection of the features
+based on correlation and feature importance (.json, from importance_engine.py,
+or from corr_screening.py if the importances are not calculated), the remaining
+features are here denoted by first_sel_X.
 
 Output: Dataframe metrics for every subset of features during the SBFS (.csv).  
 Also, a dictionary of all the best features is saved in a textfile (.txt). For 
@@ -31,6 +32,11 @@ Edits by arietma:
     the current thesis
     - Changed the data division into train and test set (used to be random division)
     - Changed the code so that it can be run (in parellel) in HPC
+    - No scaling for the tree model (fit_utils.py)
+    - Load only the needed columns as one float32 matrix with the folds as
+    bitmasks, instead of a copy of the data for every fold (model_dataset.py)
+    - Read the pre-selection from the json file of corr_screening.py instead
+    of a hard-coded list of discarded features
 """
 
 #%% Import packages
@@ -39,57 +45,18 @@ from mlxtend.feature_selection import SequentialFeatureSelector as SFS
 import pandas as pd
 from xgboost import XGBRegressor
 from sklearn.metrics import r2_score, explained_variance_score
-from sklearn.preprocessing import StandardScaler
+from fit_utils import prepare_train_test
+from model_dataset import load_dataset, train_test, as_frame
+from corr_screening import load_preselection
 from mlxtend.evaluate import bias_variance_decomp
 from datetime import datetime
 import sys
+import os
 
-#%% Set up working directory and load data
+#%% Set up working directory
 
 WD = '/home/WUR/rietm018/thesis/'
 
-# Load data
-mer = pd.read_csv(f"{WD}merged_0228_final.csv", index_col=0, na_values='nan')
-mer = mer.reset_index()
-
-# Calculate week number for train-test data division
-mer['Datetime'] = pd.to_datetime(mer['Datetime']) 
-mer['weekno'] = mer['Datetime'].dt.isocalendar().week
-
-#%% Add filter: exclude airborne observations with >15% built environment
-
-# Only untag when using filter, i.e. when running the script for M4, M5 and M6
-
-Bld_filter = (mer['Bld'] > 0.15) & (mer['source']== 'airborne')
-mer = mer[-Bld_filter]
-
-
-#%% Divide data in 5 folds based on week number
-
-weeks = list(range(1, 51))  # list of 50 weeks (so even 10 weeks per fold)
-folds = [[] for _ in range(5)]  #  5 empty lists for storing the week numbers
-
-# assign week numbers to each fold, avoid consecutive weeks in each fold
-for i, week in enumerate(weeks, 1):
-    fold_index = i % 5  # % gives remainder of division and is used to cycle through the week numbers
-    folds[fold_index].append(week) # so fold 1 has week numbers 5, 10, 15, 20 etc.
-    
-# Check how many obs per fold 
-fold1 = mer[mer['weekno'].isin(folds[0])]
-fold2 = mer[mer['weekno'].isin(folds[1])]
-fold3 = mer[mer['weekno'].isin(folds[2])]
-fold4 = mer[mer['weekno'].isin(folds[3])]
-fold5 = mer[mer['weekno'].isin(folds[4])]
-    
-# give fold3 and fold4 the remaining weeks since these contain the least observations
-folds[2] = folds[2]+[51]
-folds[3] = folds[3]+[52]
-
-# update fold 3 and 4
-fold3 = mer[mer['weekno'].isin(folds[2])]
-fold4 = mer[mer['weekno'].isin(folds[3])]
-
-
 #%% Organize features
 # Updated soil classes to exclude peat classes
 LGN_classes = ['Grs', 'SuC', 'SpC', 'Ghs', 'dFr', 'cFr', 'Wat',
@@ -99,72 +66,81 @@ soil_classes = ['W', 'zandG', 'zeeK', 'rivK', 'gedA', 'leem']
 
 all_feats = ['PAR_abs', 'Tsfc', 'VPD', 'RH', 'NDVI', 'EVI', 'BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD'] + LGN_classes + soil_classes
 
+# Pre-selected features: the features discarded by the correlation screening
+# (corr_screening.py) and the feature importance (importance_engine.py) are read
+# from the selection file of importance_engine.py, or from the pre-selection file
+# if there is none.
+# The pre-selection used in the current thesis (based on correlation and XGBoost
+# feature importance) was:
+# discarded = ['NDVI', 'VPD', 'leem', 'Grs', 'GWS', 'rivK', 'bSl', 'Ghs', 'Hth', 'dFr', 'SpC', 'Shr', 'W', 'cFr', 'BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD']
+selection_file = f"{WD}modelling/0228_mer_importance_selection.json"
+if not os.path.exists(selection_file):
+    selection_file = f"{WD}modelling/0228_mer_preselection.json"
+preselection = load_preselection(selection_file)
+
 # For now, discard all groundwater-related variables. Under 'Define model iterations',
 # specify which groundwater-related variable to include in the iteration
-discarded = ['NDVI', 'VPD', 'leem', 'Grs', 'GWS', 'rivK', 'bSl', 'Ghs', 'Hth', 'dFr', 'SpC', 'Shr', 'W', 'cFr', 'BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD']
+groundwater_vars = ['BBB', 'GWS', 'OWD', 'PeatD', 'Exp_PeatD']
+discarded = list(preselection['discarded']) + groundwater_vars
 
 first_sel_m = [feat for feat in all_feats if feat not in discarded]
 
-#%% Set up connection to SLURM_ARRAY_TASK_ID to run the script as a job array (=parallel, and faster)
-
-args = sys.argv[1:]
-slurm_task_id = int(args[0]) # in the sbatch file: #SBATCH --array=1-5
-
-#%% Split in train and test data
-
-# The script is now run in parallel, with each data fold being the test fold once
-
-dataframes = [fold1, fold2, fold3, fold4, fold5]
-
-foldno = slurm_task_id # connects to array id
-test_data = dataframes[foldno-1] # foldno -1 is added because indexing starts at 0
-
-# Make a list for the train data without the test fold:
-train_data_list = [data for j, data in enumerate(dataframes) if j != foldno-1] 
-train_data = pd.concat(train_data_list)
-
 #%% Define model iterations
 
 # Untag only one of the iterations, each with a different groundwater-related
 # variable. 
 # Remember to adjust the file names written at the bottom of the script accordingly
 
+# Model iterations 1 and 4 (for 4, also set Bld_filter to True): with OWD and PeatD
+# feats = first_sel_m + ['PeatD', 'OWD']
 
-# Model iterations 1 and 4 (for 4, also untag Bld filter): with OWD and PeatD
-# X_train = train_data[first_sel_m + ['PeatD', 'OWD']]
-# y_train = train_data['CO2flx']
+# Model iterations 2 and 5 (for 5, also set Bld_filter to True): with Exp_PeatD
+feats = first_sel_m + ['Exp_PeatD']
 
-# X_test = test_data[first_sel_m + ['PeatD', 'OWD']]
-# y_test = test_data['CO2flx']
+# Model iterations 3 and 6 (for 6, also set Bld_filter to True): with BBB and PeatD
+# feats = first_sel_m + ['PeatD', 'BBB']
 
+#%% Load data
 
-# Model iterations 2 and 5 (for 5, also untag Bld filter): with Exp_PeatD
-X_train = train_data[first_sel_m + ['Exp_PeatD']]
-y_train = train_data['CO2flx']
+# Filter: exclude airborne observations with >15% built environment
+# Only True when running the script for M4, M5 and M6
+Bld_filter = True
 
-X_test = test_data[first_sel_m + ['Exp_PeatD']]
-y_test = test_data['CO2flx']
+# Only the features of the iteration are loaded, as one float32 matrix. The data is
+# divided in 5 folds based on week number (fold 1 has week numbers 5, 10, 15, 20 etc.,
+# fold3 and fold4 also get weeks 51 and 52), see model_dataset.py
+ds = load_dataset(f"{WD}merged_0228_final.csv", feats, Bld_filter=Bld_filter)
 
+#%% Set up connection to SLURM_ARRAY_TASK_ID to run the script as a job array (=parallel, and faster)
 
-# # Model iterations 3 and 6 (for 6, also untag Bld filter): with BBB and PeatD
-# X_train = train_data[first_sel_m + ['PeatD', 'BBB']]
-# y_train = train_data['CO2flx']
+args = sys.argv[1:]
+slurm_task_id = int(args[0]) # in the sbatch file: #SBATCH --array=1-5
 
-# X_test = test_data[first_sel_m + ['PeatD', 'BBB']]
-# y_test = test_data['CO2flx']
+#%% Split in train and test data
 
-# %% Scale
+# The script is now run in parallel, with each data fold being the test fold once
+foldno = slurm_task_id # connects to array id
 
-sc = StandardScaler()
+# The train data are the other folds, in the same order as pd.concat of the folds.
+# X_test (and X_train for fold 1 and 5) are views on the dataset, without a copy
+X_train, y_train, X_test, y_test = train_test(ds, foldno, feats)
 
-X_train_sc = pd.DataFrame(sc.fit_transform(X_train), columns=X_train.columns)
-X_test_sc = pd.DataFrame(sc.transform(X_test), columns=X_train.columns)
+# Dataframes with the feature names (no copy), SBFS selects the features by name
+X_train = as_frame(X_train, feats)
+X_test = as_frame(X_test, feats)
+y_train = pd.Series(y_train)
+y_test = pd.Series(y_test)
 
 #%% Prepare model with standard hyperparameters
 
 model = XGBRegressor(n_estimators = 1000, learning_rate= 0.05, max_depth=6, subsample=1)
 sfs_scoring = 'r2'
 
+# %% Scale, only if needed: XGBoost is a tree model, so X_train and X_test are
+# used as they are, without a copy for every fit (fit_utils.py)
+
+X_train_sc, X_test_sc, sc = prepare_train_test(model, X_train, X_test)
+
 #%% function to run sequential backward floating selection
 
 def feature_selection(model, n_features, X_train, y_train):
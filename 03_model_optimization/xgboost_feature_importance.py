@@ -17,6 +17,7 @@ Edits by arietma:
     only the merged dataset/model is used
     - Added red line in figure to clarify which features are dropped before
     moving on to SBFS (the least important features)
+    - No scaling for the tree model (fit_utils.py)
 
 """
 
@@ -24,7 +25,7 @@ Edits by arietma:
 
 import pandas as pd
 from xgboost import XGBRegressor
-from sklearn.preprocessing import StandardScaler
+from fit_utils import prepare_train_test
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
@@ -61,12 +62,11 @@ mer_y = mer['CO2flx']
 
 def xgboost_fi(X,y):
   
-  # scale X data
-  sc = StandardScaler()
-  X_sc = pd.DataFrame(sc.fit_transform(X), columns=X.columns)
-
   # fit model on all data with standard hyperparameters
   model = XGBRegressor(n_estimators = 1000, learning_rate= 0.1, max_depth=6, subsample=1)
+
+  # scale X data, only if needed: XGBoost is a tree model, so X is used as it is
+  X_sc, _, sc = prepare_train_test(model, X)
   model.fit(X_sc, y)
 
   # feature importances embedded in model:
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script compiles a trained XGBoost model (e.g. M5, 4000 trees of depth 6) to
+flat arrays and a small native library, for predicting many small batches (the
+simulations, scenario sweeps and SHAP backgrounds) and very large batches (map
+tiles) faster than XGBRegressor.predict. For a batch of 125 rows, most of the
+time of XGBRegressor.predict is spent on the Python side and on making the
+DMatrix, not on the trees.
+
+The trees are read from the JSON model of the booster. Every tree is stored as a
+full binary tree of the depth of the deepest tree (6 for M5): a leaf above the
+last level is repeated in both children, so the tree gives the same leaf values.
+The flat arrays are:
+    feature:        column of the split feature of every node (trees x nodes)
+    threshold:      split value (float32); a row goes left if value < threshold
+    default_left:   1 if missing values (NaN) go left
+    leaf:           leaf values (float32, trees x 2^depth)
+    base_score:     the start value of every prediction
+so every row takes exactly depth steps through a tree, without branches.
+The predictor (a C function, compiled once with the C compiler of the system and
+loaded with ctypes) walks the trees of a block of rows, tree after tree, and adds
+the leaf values in float32 in the order of the trees, starting from base_score.
+This is the same computation as the CPU predictor of XGBoost, so the predictions
+are identical (bit for bit) to XGBRegressor.predict. check_identical checks this
+for a dataset. Without a C compiler, the same computation is done with NumPy
+(slower, also identical).
+
+Only tree models (booster gbtree, not dart or gblinear) of one target without
+categorical splits, and with an objective of which the prediction is the sum of
+the trees itself (identity link, e.g. reg:squarederror, as all models of this
+thesis) are supported. For e.g. reg:gamma or count:poisson, XGBoost transforms
+the sum of the trees (exp), so these models are refused by flatten_booster. Of a
+model trained with early stopping, only the trees up to best_iteration are used,
+as in XGBRegressor.predict.
+
+The native library is compiled in a cache directory of the user (default
+~/.cache/compiled_predictor), which is made with permissions 0700. Before the
+library is loaded, the directory and the library are checked to be owned by the
+user and not writable by others, so no other user can replace the library (e.g.
+in a shared temporary directory on an HPC node); otherwise NumPy is used.
+
+Run as:
+    python compiled_predictor.py <model .ubj> [<n_threads>]
+        compiles the model, checks the predictions on the merged dataset and
+        compares the time with XGBRegressor.predict for 125 and 10^6 rows
+
+Functions:
+    flatten_booster:    the flat arrays of a trained model
+    save_flat, load_flat: the flat arrays on disk (.npz)
+    build_library:      compiles and loads the native predictor
+    compile_model:      the flat arrays and the native predictor of a model
+    compiled_predict:   predictions for a batch of rows (NumPy API)
+    check_identical:    True if the predictions are identical to XGBRegressor.predict
+    benchmark:          time of XGBRegressor.predict and compiled_predict
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import time
+import stat
+import ctypes
+import hashlib
+import warnings
+import subprocess
+import numpy as np
+
+#%% Settings
+
+# deepest trees that are stored as full binary trees (2^depth leaves per tree)
+max_depth = 12
+
+# maximum number of features of the native predictor (MAX_FEATS in c_source)
+max_feats = 64
+
+# objectives of which the prediction is the sum of the trees (identity link)
+identity_objectives = ['reg:squarederror', 'reg:squaredlogerror', 'reg:pseudohubererror',
+                       'reg:absoluteerror', 'reg:quantileerror']
+
+#%% Flat arrays
+
+def _tree_nodes(trees):
+    """
+    Returns the nodes of all trees as arrays over all nodes: left and right child
+    (positions in these arrays, -1 for leaves), feature, threshold, default_left
+    and value (of leaves), and the position of the root of every tree.
+    """
+    sizes = np.array([len(tree['left_children']) for tree in trees], dtype=np.int64)
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+    left, right, feature, conditions, default_left = [], [], [], [], []
+    for tree, start in zip(trees, roots):
+        if any(tree['split_type']):
+            raise ValueError('Categorical splits are not supported')
+        l = np.array(tree['left_children'], dtype=np.int64)
+        r = np.array(tree['right_children'], dtype=np.int64)
+        left.append(np.where(l == -1, -1, l + start))
+        right.append(np.where(l == -1, -1, r + start))
+        feature.append(tree['split_indices'])
+        conditions.append(tree['split_conditions'])
+        default_left.append(tree['default_left'])
+
+    # the split condition of a leaf is its value. The JSON model has the shortest
+    # decimals that give the same float32 again
+    conditions = np.concatenate(conditions).astype(np.float64).astype(np.float32)
+    return {'left': np.concatenate(left), 'right': np.concatenate(right),
+            'feature': np.concatenate(feature).astype(np.int32), 'conditions': conditions,
+            'default_left': np.concatenate(default_left).astype(np.uint8), 'roots': roots}
+
+
+def flatten_booster(xgbr):
+    """
+    xgbr: trained XGBRegressor (or Booster)
+
+    Returns a dictionary with the flat arrays of all trees (see above). For a
+    model with best_iteration (early stopping), only the trees up to and
+    including best_iteration are used, as XGBRegressor.predict does.
+    """
+    booster = xgbr.get_booster() if hasattr(xgbr, 'get_booster') else xgbr
+    model = json.loads(booster.save_raw(raw_format='json'))
+    learner = model['learner']
+    param = learner['learner_model_param']
+    if int(param.get('num_target', 1)) != 1 or int(param.get('num_class', 0)) > 1:
+        raise ValueError('Only models with one target are supported')
+    objective = learner['objective']['name']
+    if objective not in identity_objectives:
+        raise ValueError(f'Only models with an identity link are supported ({identity_objectives}), '
+                         f'the prediction of {objective} is a transformation of the sum of the trees')
+
+    # dart scales the trees with weights, gblinear has no trees
+    gbm = learner['gradient_booster']
+    if gbm['name'] != 'gbtree':
+        raise ValueError(f"Only models with booster gbtree are supported, not {gbm['name']}")
+    trees = gbm['model']['trees']
+
+    best_iteration = learner.get('attributes', {}).get('best_iteration')
+    if best_iteration is not None:
+        n_parallel = int(gbm['model']['gbtree_model_param']['num_parallel_tree'])
+        trees = trees[:(int(best_iteration) + 1) * n_parallel]
+
+    nodes = _tree_nodes(trees)
+    n_trees = len(nodes['roots'])
+
+    # every tree as a full binary tree of the depth of the deepest tree, level by
+    # level for all trees at once. A leaf above the last level is repeated in both
+    # children, so every path ends in the same leaf value as in the original tree
+    feature, threshold, default_left = [], [], []
+    src = nodes['roots'][:, None]
+    while True:
+        leaf = nodes['left'][src] == -1
+        if leaf.all():
+            break
+        feature.append(np.where(leaf, 0, nodes['feature'][src]))
+        threshold.append(np.where(leaf, np.float32(0), nodes['conditions'][src]))
+        default_left.append(np.where(leaf, 1, nodes['default_left'][src]))
+        children = np.stack([np.where(leaf, src, nodes['left'][src]),
+                             np.where(leaf, src, nodes['right'][src])], axis=2)
+        src = children.reshape(n_trees, -1)
+
+    depth = len(feature)
+    if depth > max_depth:
+        raise ValueError(f'Trees deeper than {max_depth} levels are not supported (depth {depth})')
+    if depth == 0:
+        empty = np.zeros((n_trees, 0))
+        feature, threshold, default_left = [empty], [empty], [empty]
+
+    # base_score is stored as e.g. '[-4.8257074E0]' (or '-4.8257074E0' in older versions)
+    base_score = np.float32(float(param['base_score'].strip('[]')))
+
+    return {'feature': np.ascontiguousarray(np.concatenate(feature, axis=1), dtype=np.int32),
+            'threshold': np.ascontiguousarray(np.concatenate(threshold, axis=1), dtype=np.float32),
+            'default_left': np.ascontiguousarray(np.concatenate(default_left, axis=1), dtype=np.uint8),
+            'leaf': np.ascontiguousarray(nodes['conditions'][src], dtype=np.float32),
+            'depth': depth,
+            'base_score': base_score,
+            'n_feats': int(param['num_feature'])}
+
+
+def save_flat(flat, path):
+    np.savez(path, **flat)
+
+
+def load_flat(path):
+    with np.load(path) as f:
+        flat = {key: f[key] for key in f.files}
+    flat['base_score'] = np.float32(flat['base_score'])
+    flat['depth'] = int(flat['depth'])
+    flat['n_feats'] = int(flat['n_feats'])
+    return flat
+
+#%% Native predictor
+
+# The rows are predicted in blocks, so the nodes of a tree are used for all rows
+# of a block before the next tree. Every row adds the leaf values in the order of
+# the trees, as XGBoost. The path through a full tree has no branches: at every
+# level the row goes to child 2*i+1 (left) or 2*i+2 (right) of node i. A missing
+# value (NaN) is never < threshold, so it goes left only if default_left. No
+# -ffast-math, so the float32 additions are not reordered
+c_source = r"""
+#include <math.h>
+
+#define BLOCK 64
+#define MAX_FEATS 64
+
+void predict(const float *X, long long n_rows, int n_feats,
+             const int *feature, const float *threshold,
+             const unsigned char *default_left, const float *leaf,
+             int n_trees, int depth, float base_score, float *out)
+{
+    long long n_blocks = (n_rows + BLOCK - 1) / BLOCK;
+    int n_nodes = (1 << depth) - 1;
+    int n_leaves = 1 << depth;
+
+    #pragma omp parallel for schedule(static)
+    for (long long b = 0; b < n_blocks; b++) {
+        long long r0 = b * BLOCK;
+        int n = (int) (r0 + BLOCK < n_rows ? BLOCK : n_rows - r0);
+        float xb[BLOCK * MAX_FEATS];
+        float acc[BLOCK];
+        int node[BLOCK];
+
+        /* the block of rows per feature, so a level of all rows reads one column */
+        for (int i = 0; i < n; i++) {
+            acc[i] = base_score;
+            for (int j = 0; j < n_feats; j++) xb[j * BLOCK + i] = X[(r0 + i) * n_feats + j];
+        }
+
+        for (int t = 0; t < n_trees; t++) {
+            const int *f = feature + (long long) t * n_nodes;
+            const float *thr = threshold + (long long) t * n_nodes;
+            const unsigned char *dl = default_left + (long long) t * n_nodes;
+            const float *lv = leaf + (long long) t * n_leaves;
+
+            /* all rows of the block level by level, the rows are independent */
+            for (int i = 0; i < n; i++) node[i] = 0;
+            for (int d = 0; d < depth; d++) {
+                for (int i = 0; i < n; i++) {
+                    int k = node[i];
+                    float v = xb[f[k] * BLOCK + i];
+                    int go_left = (v < thr[k]) | (isnan(v) & dl[k]);
+                    node[i] = 2 * k + 2 - go_left;
+                }
+            }
+            for (int i = 0; i < n; i++) acc[i] += lv[node[i] - n_nodes];
+        }
+        for (int i = 0; i < n; i++) out[r0 + i] = acc[i];
+    }
+}
+"""
+
+def _private(path):
+    """
+    Returns True if path is owned by the user and cannot be written by others
+    (always True where there are no user ids, e.g. Windows).
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def build_library(cache_dir=None, compiler='cc'):
+    """
+    cache_dir: directory of the compiled library (default: ~/.cache/compiled_predictor)
+    compiler: C compiler
+
+    Returns the native predictor (ctypes function), compiled once per source
+    (with OpenMP if the compiler supports it), or None if there is no compiler or
+    the directory or library may be changed by other users (see above).
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'compiled_predictor')
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    if not _private(cache_dir):
+        warnings.warn(f'{cache_dir} is not owned by the user or can be written by others, '
+                      f'the native predictor is not used')
+        return None
+
+    tag = hashlib.sha256(c_source.encode()).hexdigest()[:16]
+    lib_path = os.path.join(cache_dir, f'predict_{tag}.so')
+    if not os.path.exists(lib_path):
+        src_path = os.path.join(cache_dir, f'predict_{tag}.c')
+        with open(src_path, 'w') as f:
+            f.write(c_source)
+        tmp_path = lib_path.replace('.so', f'_{os.getpid()}.so')
+        for flags in (['-fopenmp'], []):
+            try:
+                result = subprocess.run([compiler, '-O3', '-shared', '-fPIC', *flags, src_path, '-o', tmp_path, '-lm'],
+                                        capture_output=True)
+            except OSError:
+                return None
+            if result.returncode == 0:
+                os.replace(tmp_path, lib_path)
+                break
+        else:
+            return None
+
+    if not _private(lib_path):
+        warnings.warn(f'{lib_path} is not owned by the user or can be written by others, '
+                      f'the native predictor is not used')
+        return None
+    lib = ctypes.CDLL(lib_path)
+    f = lib.predict
+    f.restype = None
+    f.argtypes = [ctypes.c_void_p, ctypes.c_longlong, ctypes.c_int,
+                  ctypes.c_void_p, ctypes.c_void_p,
+                  ctypes.c_void_p, ctypes.c_void_p,
+                  ctypes.c_int, ctypes.c_int, ctypes.c_float, ctypes.c_void_p]
+    return f
+
+
+def compile_model(xgbr, cache_dir=None):
+    """
+    xgbr: trained XGBRegressor, or flat arrays (flatten_booster, load_flat)
+
+    Returns the compiled model: a dictionary with the flat arrays and the native
+    predictor (None if there is no C compiler or the model has more than
+    max_feats features, then NumPy is used).
+    """
+    flat = xgbr if isinstance(xgbr, dict) else flatten_booster(xgbr)
+    lib = build_library(cache_dir) if flat['n_feats'] <= max_feats else None
+    return {'flat': flat, 'lib': lib}
+
+#%% Predict
+
+def _predict_numpy(flat, X, chunk=2048):
+    """
+    The same computation as the native predictor, with NumPy: all trees of a
+    chunk of rows together, level by level.
+    """
+    n_trees, n_nodes = flat['leaf'].shape[0], flat['leaf'].shape[1] - 1
+    trees = np.arange(n_trees)
+    out = np.empty(len(X), dtype=np.float32)
+    for r0 in range(0, len(X), chunk):
+        Xc = X[r0:r0+chunk]
+        rows = np.arange(len(Xc))[:, None]
+        node = np.zeros((len(Xc), n_trees), dtype=np.int64)
+        for d in range(flat['depth']):
+            v = Xc[rows, flat['feature'][trees, node]]
+            go_left = (v < flat['threshold'][trees, node]) | (np.isnan(v) & (flat['default_left'][trees, node] == 1))
+            node = 2*node + 2 - go_left
+        leaves = flat['leaf'][trees, node - n_nodes]
+        acc = np.full(len(Xc), flat['base_score'], dtype=np.float32)
+        for t in range(n_trees):
+            acc += leaves[:, t]
+        out[r0:r0+chunk] = acc
+    return out
+
+
+def compiled_predict(model, X):
+    """
+    model: compiled model (compile_model)
+    X: rows (array or dataframe) with the features in the order of the model
+
+    Returns the predictions (float32), identical to XGBRegressor.predict. The
+    number of threads of the native predictor is set with OMP_NUM_THREADS.
+    """
+    flat = model['flat']
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if X.ndim != 2 or X.shape[1] != flat['n_feats']:
+        raise ValueError(f"X should have {flat['n_feats']} columns, not {X.shape[-1]}")
+
+    if model['lib'] is None:
+        return _predict_numpy(flat, X)
+
+    out = np.empty(len(X), dtype=np.float32)
+    ptr = lambda a: a.ctypes.data
+    model['lib'](ptr(X), len(X), X.shape[1],
+                 ptr(flat['feature']), ptr(flat['threshold']),
+                 ptr(flat['default_left']), ptr(flat['leaf']),
+                 flat['leaf'].shape[0], flat['depth'], float(flat['base_score']), ptr(out))
+    return out
+
+#%% Check and benchmark
+
+def check_identical(model, xgbr, X):
+    """
+    Returns True if compiled_predict gives exactly the same predictions as
+    XGBRegressor.predict for the rows X.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return np.array_equal(compiled_predict(model, X), xgbr.predict(X))
+
+
+def _best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def benchmark(model, xgbr, X, sizes=(125, 10**6), repeats=(200, 3)):
+    """
+    model: compiled model
+    xgbr: the same model as XGBRegressor
+    X: rows from which the batches are taken (repeated if needed)
+    sizes: number of rows of the batches
+    repeats: number of times every batch is predicted (the best time is used)
+
+    Returns a dictionary with per batch size the time (s) of XGBRegressor.predict
+    and compiled_predict, and whether the predictions are identical.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    result = {}
+    for n, repeat in zip(sizes, repeats):
+        batch = X[np.arange(n) % len(X)]
+        result[n] = {'xgboost': _best_time(lambda: xgbr.predict(batch), repeat),
+                     'compiled': _best_time(lambda: compiled_predict(model, batch), repeat),
+                     'identical': check_identical(model, xgbr, batch)}
+    return result
+
+#%% Run
+
+if __name__ == '__main__':
+    from xgboost import XGBRegressor
+    from model_specs import model_specs, load_model_data
+
+    args = sys.argv[1:]
+    model_path = args[0]
+    if len(args) > 1:
+        os.environ['OMP_NUM_THREADS'] = args[1]
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+
+    xgbr = XGBRegressor()
+    xgbr.load_model(model_path)
+    if len(args) > 1:
+        xgbr.set_params(n_jobs = int(args[1]))
+
+    model = compile_model(xgbr)
+    save_flat(model['flat'], model_path[:-len('.ubj')] + '_flat.npz')
+
+    data = load_model_data('M5', WD)
+    X = data[model_specs['M5']['feats']].to_numpy(dtype=np.float32)
+
+    print(f"native predictor: {model['lib'] is not None}, identical on the merged dataset: {check_identical(model, xgbr, X)}")
+    for n, times in benchmark(model, xgbr, X).items():
+        print(f"{n} rows: XGBRegressor.predict {times['xgboost']*1000:.2f} ms, "
+              f"compiled {times['compiled']*1000:.2f} ms, identical: {times['identical']}")
@@ -0,0 +1,192 @@
+"""
+@author: arietma
+
+This script provides a registry of trained models, so that a model is trained
+once and every script (model evaluation, SHAP analysis, simulations) uses the
+exact same model instead of training it again.
+
+A trained model is stored as one artifact in the models directory:
+    <name>_<hash>.ubj:   the booster, in binary XGBoost format (UBJSON)
+    <name>_<hash>.json:  the features, hyperparameters, fitted scaler parameters
+                         (mean, scale, var, or null for tree models, see
+                         fit_utils.py), the hash of the training data, the
+                         number of training rows, the XGBoost version and the date
+where <hash> is the first 16 characters of the hash of the training data. The
+data hash is computed from the features and CO2flx of the training rows, so a
+different dataset, filter or train/test division gives a new artifact.
+
+load_or_train loads the artifact if the data hash, features and hyperparameters
+match, and otherwise trains the model and stores it.
+
+Functions:
+    fit_model:          trains a model spec on data, without scaling for tree models
+    data_hash:          hash of the training data of a model
+    save_artifact:      stores a trained model
+    load_artifact:      loads a trained model, or returns None if there is no matching artifact
+    load_or_train:      loads a trained model, or trains and stores it
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+import xgboost
+from xgboost import XGBRegressor
+from sklearn.preprocessing import StandardScaler
+
+from model_specs import model_specs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_model_optimization'))
+from fit_utils import is_tree_model, scale_inplace, to_float32
+
+#%% Train
+
+def get_spec(spec):
+    if isinstance(spec, str):
+        return model_specs[spec]
+    return spec
+
+
+def new_model(hyperparams, n_threads=None):
+    return XGBRegressor(learning_rate = hyperparams['learning_rate'],
+                 max_depth = hyperparams['max_depth'],
+                 n_estimators = hyperparams['n_estimators'],
+                 subsample = hyperparams['subsample'],
+                 n_jobs = n_threads)
+
+
+def fit_model(spec, data, n_threads=None, scale=None):
+    """
+    spec: name of the model spec (e.g. 'M5') or model spec dictionary with feats
+          and hyperparams
+    data: dataframe with the features of the model and CO2flx
+    n_threads: number of threads XGBoost may use (default: all)
+    scale: True or False to force scaling on or off. If not given, tree models
+           (XGBoost gbtree) are trained on the unscaled features
+
+    Returns the fitted scaler (None if not scaled) and model.
+    """
+    spec = get_spec(spec)
+    xgbr = new_model(spec['hyperparams'], n_threads)
+
+    if scale is None:
+        scale = not is_tree_model(xgbr)
+
+    # one float32 copy of the features, XGBoost uses float32 anyway. If needed,
+    # it is scaled in place
+    X = to_float32(data[spec['feats']])
+    sc = scale_inplace(X) if scale else None
+
+    xgbr.fit(X, data['CO2flx'])
+
+    return sc, xgbr
+
+
+def scaler_from_params(mean, scale, var, n_samples):
+    """
+    Returns a fitted StandardScaler with the given parameters, without fitting.
+    """
+    sc = StandardScaler()
+    sc.mean_, sc.scale_, sc.var_ = np.asarray(mean), np.asarray(scale), np.asarray(var)
+    sc.n_features_in_ = len(sc.mean_)
+    sc.n_samples_seen_ = n_samples
+    return sc
+
+#%% Artifacts
+
+def data_hash(data, feats):
+    """
+    Returns the sha256 hash of the features and CO2flx of the training rows.
+    """
+    h = hashlib.sha256(json.dumps(list(feats)).encode())
+    h.update(pd.util.hash_pandas_object(data[list(feats) + ['CO2flx']], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def artifact_paths(name, hash_value, models_dir):
+    path = os.path.join(models_dir, f'{name}_{hash_value[:16]}')
+    return f'{path}.ubj', f'{path}.json'
+
+
+def save_artifact(name, spec, sc, xgbr, hash_value, n_rows, models_dir):
+    """
+    Stores the booster and its metadata (see above) in models_dir.
+    """
+    spec = get_spec(spec)
+    os.makedirs(models_dir, exist_ok=True)
+    model_path, meta_path = artifact_paths(name, hash_value, models_dir)
+
+    # the extension .ubj sets the format, also for the temporary file
+    tmp_path = model_path.replace('.ubj', '_tmp.ubj')
+    xgbr.save_model(tmp_path)
+    os.replace(tmp_path, model_path)
+
+    meta = {'name': name,
+            'feats': list(spec['feats']),
+            'hyperparams': spec['hyperparams'],
+            'scaler': None if sc is None else {'mean': sc.mean_.tolist(), 'scale': sc.scale_.tolist(), 'var': sc.var_.tolist()},
+            'data_hash': hash_value,
+            'n_rows': n_rows,
+            'xgboost_version': xgboost.__version__,
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+def load_artifact(name, spec, hash_value, models_dir, scale=None):
+    """
+    Returns the scaler and model of the artifact, or None if there is no
+    artifact with this data hash, features, hyperparameters and scaling.
+    """
+    spec = get_spec(spec)
+    if scale is None:
+        scale = not is_tree_model(new_model(spec['hyperparams']))
+
+    model_path, meta_path = artifact_paths(name, hash_value, models_dir)
+    if not (os.path.exists(model_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if (meta['data_hash'] != hash_value or meta['feats'] != list(spec['feats'])
+            or meta['hyperparams'] != spec['hyperparams'] or (meta['scaler'] is not None) != scale):
+        return None
+
+    xgbr = XGBRegressor()
+    xgbr.load_model(model_path)
+
+    sc = None
+    if meta['scaler'] is not None:
+        sc = scaler_from_params(meta['scaler']['mean'], meta['scaler']['scale'],
+                                meta['scaler']['var'], meta['n_rows'])
+    return sc, xgbr
+
+
+def load_or_train(name, spec, data, models_dir, n_threads=None, scale=None):
+    """
+    name: name of the artifact, e.g. 'M5' (trained on all data) or 'M5_test_fold4'
+    spec: name of the model spec (e.g. 'M5') or model spec dictionary
+    data: training data, with the features of the model and CO2flx
+    models_dir: directory of the artifacts, e.g. f'{WD}models/'
+    n_threads: number of threads XGBoost may use for training
+    scale: True or False to force scaling on or off. If not given, tree models
+           are trained on the unscaled features and the returned scaler is None
+
+    Returns the scaler and model. The model is only trained if there is no
+    artifact for these training data, features, hyperparameters and scaling.
+    """
+    spec = get_spec(spec)
+    hash_value = data_hash(data, spec['feats'])
+
+    artifact = load_artifact(name, spec, hash_value, models_dir, scale)
+    if artifact is not None:
+        print(f'{name}: loaded from {models_dir}')
+        return artifact
+
+    print(f'{name}: training')
+    sc, xgbr = fit_model(spec, data, n_threads, scale)
+    save_artifact(name, spec, sc, xgbr, hash_value, len(data), models_dir)
+    return sc, xgbr
@@ -0,0 +1,79 @@
+"""
+@author: arietma
+
+This script gathers the features and optimized hyperparameters of all models in
+the current thesis, so that other scripts can select a model by its name. The
+specs are the same as in xboost_eval_models.py and xboost_eval_models_SepJan_FebAug.py.
+
+Every model spec has:
+    feats:          features of the model
+    hyperparams:    optimized hyperparameters
+    data:           file name of the dataset the model is trained on
+    Bld_filter:     True if airborne observations with >15% built environment are excluded
+
+The function load_model_data loads the dataset of a model spec, with the Bld
+filter applied if specified.
+"""
+#%% Import packages
+
+import pandas as pd
+
+#%% Model specs
+# Merged models 1-3 are without a filter for built environment, models 4-6 have
+# a filter for Bld>0.15. M5 is the final merged model.
+
+model_specs = {
+    'M1': {'feats': ["PAR_abs", "Tsfc", "RH", "EVI", "SuC", "Bld"],
+           'hyperparams': {'learning_rate': 0.001, 'max_depth': 6, 'n_estimators': 4000, 'subsample': 0.7},
+           'data': 'merged_0228_final.csv', 'Bld_filter': False},
+
+    'M2': {'feats': ["PAR_abs", "Tsfc", "RH", "EVI", "SuC", "Bld"],
+           'hyperparams': {'learning_rate': 0.001, 'max_depth': 6, 'n_estimators': 4000, 'subsample': 0.7},
+           'data': 'merged_0228_final.csv', 'Bld_filter': False},
+
+    'M3': {'feats': ["PAR_abs", "Tsfc", "RH", "EVI", "SuC", "Bld"],
+           'hyperparams': {'learning_rate': 0.001, 'max_depth': 6, 'n_estimators': 4000, 'subsample': 0.7},
+           'data': 'merged_0228_final.csv', 'Bld_filter': False},
+
+    'M4': {'feats': ["PAR_abs", "Tsfc", "RH", "EVI", "SuC", "Wat", "Bld", "OWD"],
+           'hyperparams': {'learning_rate': 0.005, 'max_depth': 6, 'n_estimators': 750, 'subsample': 0.65},
+           'data': 'merged_0228_final.csv', 'Bld_filter': True},
+
+    'M5': {'feats': ['PAR_abs', 'Tsfc', 'RH', 'EVI', 'SuC', 'Wat', 'Bld', 'Exp_PeatD'],
+           'hyperparams': {'learning_rate': 0.001, 'max_depth': 6, 'n_estimators': 4000, 'subsample': 0.55},
+           'data': 'merged_0228_final.csv', 'Bld_filter': True},
+
+    'M6': {'feats': ["PAR_abs", "Tsfc", "RH", "EVI", "SuC", "Wat", "Bld"],
+           'hyperparams': {'learning_rate': 0.005, 'max_depth': 6, 'n_estimators': 1000, 'subsample': 0.6},
+           'data': 'merged_0228_final.csv', 'Bld_filter': True},
+
+    # Seasonal models have the same features
+    'SepJan': {'feats': ['PAR_abs', 'Tsfc', 'RH', 'EVI', 'Bld', 'Wat', 'Exp_PeatD'],
+               'hyperparams': {'learning_rate': 0.001, 'max_depth': 9, 'n_estimators': 4000, 'subsample': 0.55},
+               'data': 'merged_SepJan_0228.csv', 'Bld_filter': True},
+
+    'FebAug': {'feats': ['PAR_abs', 'Tsfc', 'RH', 'EVI', 'Bld', 'Wat', 'Exp_PeatD'],
+               'hyperparams': {'learning_rate': 0.001, 'max_depth': 3, 'n_estimators': 7000, 'subsample': 0.65},
+               'data': 'merged_FebAug_0228.csv', 'Bld_filter': True},
+    }
+
+#%% Load the dataset of a model
+
+def load_model_data(spec, WD):
+    """
+    spec: name of the model spec (e.g. 'M5') or a model spec dictionary
+    WD: directory with the datasets
+
+    Returns the dataset the model is trained on.
+    """
+    if isinstance(spec, str):
+        spec = model_specs[spec]
+
+    data = pd.read_csv(f"{WD}{spec['data']}", index_col=0, na_values='nan')
+
+    # Exclude airborne observations with >15% built environment
+    if spec['Bld_filter']:
+        Bld_filter = (data['Bld'] > 0.15) & (data['source']== 'airborne')
+        data = data[-Bld_filter]
+
+    return data
@@ -11,14 +11,16 @@ Output: model performances and figure showing the performance of the models
 Edits by arietma:
     - Adjusted the code to the dataset, model iterations and the data folds 
     used as test folds in the current thesis
+    - Trained models are stored and loaded with model_registry.py
+    - No scaling for the tree models (fit_utils.py)
 """
 
 #%% Import packages
 
 import pandas as pd
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.preprocessing import StandardScaler
-from xgboost.sklearn import XGBRegressor
+from model_registry import load_or_train
+from fit_utils import apply_scaler
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.colors import ListedColormap
@@ -64,7 +66,7 @@ mer_Bldfilt = mer[-Bld_filter]
 
 #%% function to evaluate all models
 
-def evalmodel(data, feats, hyperparams):
+def evalmodel(data, feats, hyperparams, name):
 
     # Division of train/test data
     weeks = list(range(1, 51))  # list of 50 weeks (so even 10 weeks per fold)
@@ -100,24 +102,17 @@ def evalmodel(data, feats, hyperparams):
     X_test = test_data[feats]
     y_test = test_data['CO2flx']
 
-    # scale
-    sc = StandardScaler()
+    # fit model with the correct hyperparameters, or load the stored model if it
+    # was trained on the same train data before (model_registry.py). XGBoost is a
+    # tree model, so the features are not scaled (fit_utils.py)
+    sc, xgbr = load_or_train(name, {'feats': feats, 'hyperparams': hyperparams},
+                             train_data, f'{WD}models/')
 
-    X_train_sc = pd.DataFrame(sc.fit_transform(X_train), columns=X_train.columns)
-    X_test_sc = pd.DataFrame(sc.transform(X_test),columns=X_train.columns)
-    
-    # model with the correct hyperparameters
-    xgbr = XGBRegressor(learning_rate = hyperparams['learning_rate'], 
-                  max_depth = hyperparams['max_depth'], 
-                  n_estimators = hyperparams['n_estimators'],
-                  subsample = hyperparams['subsample'])
+    X_test_sc = apply_scaler(sc, X_test.to_numpy())
     
     # to show that you need to do testing and training, you can also train AND test on the same dataset
     # X_sc = pd.DataFrame(sc.fit_transform(X), columns=X.columns)
     # X_train_sc = X_sc; y_train = y; X_test_sc = X_sc; y_test = y 
-
-    # fit model    
-    xgbr.fit(X_train_sc, y_train)
     
     # predict values for test set
     y_pred = xgbr.predict(X_test_sc)
@@ -129,12 +124,12 @@ def evalmodel(data, feats, hyperparams):
 
 #%% evaluate all models and store results in variables
 
-mer_M1MSE, mer_M1R2, mer_M1ypred, mer_M1ytest = evalmodel(mer, mer_M1feats, mer_M1hypp)
-mer_M2MSE, mer_M2R2, mer_M2ypred, mer_M2ytest = evalmodel(mer, mer_M2feats, mer_M2hypp)
-mer_M3MSE, mer_M3R2, mer_M3ypred, mer_M3ytest = evalmodel(mer, mer_M3feats, mer_M3hypp)
-mer_M4MSE, mer_M4R2, mer_M4ypred, mer_M4ytest = evalmodel(mer_Bldfilt, mer_M4feats, mer_M4hypp)
-mer_M5MSE, mer_M5R2, mer_M5ypred, mer_M5ytest = evalmodel(mer_Bldfilt, mer_M5feats, mer_M5hypp)
-mer_M6MSE, mer_M6R2, mer_M6ypred, mer_M6ytest = evalmodel(mer_Bldfilt, mer_M6feats, mer_M6hypp)
+mer_M1MSE, mer_M1R2, mer_M1ypred, mer_M1ytest = evalmodel(mer, mer_M1feats, mer_M1hypp, 'M1_test_fold4')
+mer_M2MSE, mer_M2R2, mer_M2ypred, mer_M2ytest = evalmodel(mer, mer_M2feats, mer_M2hypp, 'M2_test_fold4')
+mer_M3MSE, mer_M3R2, mer_M3ypred, mer_M3ytest = evalmodel(mer, mer_M3feats, mer_M3hypp, 'M3_test_fold4')
+mer_M4MSE, mer_M4R2, mer_M4ypred, mer_M4ytest = evalmodel(mer_Bldfilt, mer_M4feats, mer_M4hypp, 'M4_test_fold4')
+mer_M5MSE, mer_M5R2, mer_M5ypred, mer_M5ytest = evalmodel(mer_Bldfilt, mer_M5feats, mer_M5hypp, 'M5_test_fold4')
+mer_M6MSE, mer_M6R2, mer_M6ypred, mer_M6ytest = evalmodel(mer_Bldfilt, mer_M6feats, mer_M6hypp, 'M6_test_fold4')
 
 #%% prepare for hexbin colors
 
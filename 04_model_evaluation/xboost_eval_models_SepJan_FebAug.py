@@ -11,14 +11,16 @@ Output: figure showing the performance of the models
 Edits by arietma:
     - Adjusted the code to the seasonal datasets, model specs and the data folds 
     used as test folds in the current thesis
+    - Trained models are stored and loaded with model_registry.py
+    - No scaling for the tree models (fit_utils.py)
 """
 
 #%% Import packages
 
 import pandas as pd
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.preprocessing import StandardScaler
-from xgboost.sklearn import XGBRegressor
+from model_registry import load_or_train
+from fit_utils import apply_scaler
 
 #%% Set up working directory and load data
 
@@ -84,24 +86,17 @@ def evalmodel(data, feats, hyperparams, months):
     X_test = test_data[feats]
     y_test = test_data['CO2flx']
 
-    # scale
-    sc = StandardScaler()
+    # fit model with the correct hyperparameters, or load the stored model if it
+    # was trained on the same train data before (model_registry.py). XGBoost is a
+    # tree model, so the features are not scaled (fit_utils.py)
+    sc, xgbr = load_or_train(f'{months}_test_fold5', {'feats': feats, 'hyperparams': hyperparams},
+                             train_data, f'{WD}models/')
 
-    X_train_sc = pd.DataFrame(sc.fit_transform(X_train), columns=X_train.columns)
-    X_test_sc = pd.DataFrame(sc.transform(X_test),columns=X_train.columns)
-    
-    # model with the correct hyperparameters
-    xgbr = XGBRegressor(learning_rate = hyperparams['learning_rate'], 
-                  max_depth = hyperparams['max_depth'], 
-                  n_estimators = hyperparams['n_estimators'],
-                  subsample = hyperparams['subsample'])
+    X_test_sc = apply_scaler(sc, X_test.to_numpy())
     
     # to show that you need to do testing and training, you can also train AND test on the same dataset
     # X_sc = pd.DataFrame(sc.fit_transform(X), columns=X.columns)
     # X_train_sc = X_sc; y_train = y; X_test_sc = X_sc; y_test = y 
-
-    # fit model    
-    xgbr.fit(X_train_sc, y_train)
     
     # predict values for test set
     
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script computes partial dependence (PD) and individual conditional
+expectation (ICE) curves of a trained XGBoost model, for any feature over a grid
+of values, e.g. the response of the predicted CO2 flux to Air Exposed Peat Depth
+from 0 to 125 cm. It answers the same question as the simulations (scenario_engine.py)
+and the linear regression on the Shapley values of Exp_PeatD (shap_analysis.py),
+directly from the model.
+
+Partial dependence: computed from the trees with the weighted tree traversal
+(Friedman, 2001): at a split on a grid feature, the grid value decides the branch;
+at a split on any other feature, both branches are followed, weighted by the
+fraction of the training rows (cover) that went into each branch. No predictions
+are made, so the PD of all 4000 trees is found in seconds. The traversal is
+vectorized: all grid points and all trees of a chunk are processed together,
+level by level. The number of trees of a chunk follows from the number of grid
+points and a memory budget (max_bytes), so a large 2-D grid (e.g. 125 x 125
+points) is processed in smaller chunks of trees instead of needing gigabytes.
+One feature gives a PD curve, two features (e.g. Exp_PeatD and Tsfc) a 2-D PD
+surface.
+
+ICE: for every row, the predictions with the feature set to every grid value. The
+rows are replicated in a float32 buffer, which is predicted in batches with
+inplace_predict. The average of the ICE curves is the PD of the data (brute force).
+
+Models trained on scaled features (StandardScaler, as in the simulations) are
+handled by passing the scaler: the grid values are scaled in the same way.
+
+Functions:
+    tree_arrays:        the nodes of all trees as arrays
+    partial_dependence: PD (1-D or 2-D) with the weighted tree traversal
+    ice:                ICE curves with batched predictions
+"""
+#%% Import packages
+
+import numpy as np
+import pandas as pd
+from xgboost import DMatrix
+
+#%% Trees as arrays
+
+def tree_arrays(xgbr, feats):
+    """
+    xgbr: trained XGBRegressor
+    feats: features of the model, in the order in which the model is trained
+
+    Returns a dictionary with an array per node property, for the nodes of all
+    trees (sorted by tree and node):
+        tree, feature (index in feats, -1 for leaves), split, yes, no (positions
+        of the children, -1 for leaves), cover, value (of leaves), depth
+    and tree_start, the position of the first node of every tree.
+    """
+    df = xgbr.get_booster().trees_to_dataframe()
+    pos = pd.Series(np.arange(len(df)), index=df['ID'])
+    leaf = (df['Feature'] == 'Leaf').to_numpy()
+
+    # feature names are 'f0', 'f1', ... for a model trained on an array
+    names = df.loc[~leaf, 'Feature']
+    feature = np.full(len(df), -1)
+    feature[~leaf] = [feats.index(f) if f in feats else int(f[1:]) for f in names]
+
+    yes = np.full(len(df), -1)
+    no = np.full(len(df), -1)
+    yes[~leaf] = pos[df.loc[~leaf, 'Yes']].to_numpy()
+    no[~leaf] = pos[df.loc[~leaf, 'No']].to_numpy()
+
+    # xgboost compares float32 feature values to float32 splits
+    split = np.full(len(df), np.nan, dtype=np.float32)
+    split[~leaf] = df.loc[~leaf, 'Split'].to_numpy(dtype=np.float32)
+
+    value = np.where(leaf, df['Gain'].to_numpy(), 0.0)
+
+    # depth of every node: children are one deeper than their parent
+    internal = np.flatnonzero(~leaf)
+    depth = np.zeros(len(df), dtype=int)
+    while True:
+        new_depth = depth.copy()
+        new_depth[yes[internal]] = depth[internal] + 1
+        new_depth[no[internal]] = depth[internal] + 1
+        if np.array_equal(new_depth, depth):
+            break
+        depth = new_depth
+
+    tree = df['Tree'].to_numpy()
+    tree_start = np.searchsorted(tree, np.arange(tree.max() + 2))
+
+    return {'tree': tree, 'feature': feature, 'split': split, 'yes': yes, 'no': no,
+            'cover': df['Cover'].to_numpy(), 'value': value, 'depth': depth,
+            'tree_start': tree_start, 'n_feats': len(feats), 'pos': pos}
+
+
+def base_margin(xgbr, trees):
+    """
+    Returns the base score of the model, i.e. the prediction minus the sum of
+    the leaf values, from the prediction for one row.
+    """
+    booster = xgbr.get_booster()
+    dm = DMatrix(np.zeros((1, trees['n_feats']), dtype=np.float32))
+    margin = booster.predict(dm, output_margin=True)[0]
+    leaf_nodes = booster.predict(dm, pred_leaf=True).reshape(-1).astype(int)
+
+    ids = [f'{t}-{node}' for t, node in enumerate(leaf_nodes)]
+    return float(margin) - trees['value'][trees['pos'][ids].to_numpy()].sum()
+
+#%% Partial dependence with the weighted tree traversal
+
+def scale_values(values, j, sc=None):
+    values = np.asarray(values, dtype=np.float64)
+    if sc is not None:
+        values = (values - sc.mean_[j]) / sc.scale_[j]
+    return values.astype(np.float32)
+
+
+def partial_dependence(xgbr, feats, grid, sc=None, trees=None, chunk=None, max_bytes=256*2**20):
+    """
+    xgbr: trained XGBRegressor
+    feats: features of the model, in the order in which the model is trained
+    grid: dictionary with one or two features and their values,
+          e.g. {'Exp_PeatD': range(125)} or {'Exp_PeatD': range(125), 'Tsfc': [0, 10, 20]}
+    sc: the fitted StandardScaler, if the model is trained on scaled features
+    trees: optional, tree_arrays of the model (to avoid building them again)
+    chunk: number of trees that are processed together. If not given, it follows
+           from max_bytes and the number of grid points
+    max_bytes: memory budget of the node weights of a chunk (in bytes)
+
+    Returns an array with one axis per grid feature, with the partial dependence
+    (in units of the prediction, e.g. CO2 flux) for every grid point.
+    """
+    if trees is None:
+        trees = tree_arrays(xgbr, feats)
+
+    grid_feats = list(grid.keys())
+    grid_idx = [feats.index(feat) for feat in grid_feats]
+    grid_values = [scale_values(grid[feat], j, sc) for feat, j in zip(grid_feats, grid_idx)]
+    shape = tuple(len(v) for v in grid_values)
+
+    # all grid points, one column per grid feature
+    points = np.stack([g.reshape(-1) for g in np.meshgrid(*grid_values, indexing='ij')], axis=1)
+    n_points = len(points)
+
+    # column of every model feature in points, -1 if not a grid feature
+    grid_col = np.full(len(feats), -1)
+    grid_col[grid_idx] = np.arange(len(grid_feats))
+
+    pd_values = np.zeros(n_points)
+    n_trees = len(trees['tree_start']) - 1
+
+    # the node weights of a chunk (float64, grid points x nodes) and the
+    # temporary arrays of one level take about twice the size of the weights.
+    # If not even one tree fits for all grid points, the grid points are split
+    # in blocks as well
+    max_nodes = int(np.diff(trees['tree_start']).max())
+    block = int(max(1, min(n_points, max_bytes // (2 * 8 * max_nodes))))
+    if chunk is None:
+        chunk = int(max(1, max_bytes // (2 * 8 * block * max_nodes)))
+
+    for p0 in range(0, n_points, block):
+        p1 = min(p0 + block, n_points)
+        block_points = points[p0:p1]
+
+        for t0 in range(0, n_trees, chunk):
+            a = trees['tree_start'][t0]
+            b = trees['tree_start'][min(t0 + chunk, n_trees)]
+
+            feature = trees['feature'][a:b]
+            yes = trees['yes'][a:b] - a
+            no = trees['no'][a:b] - a
+            cover = trees['cover'][a:b]
+            depth = trees['depth'][a:b]
+            internal = feature >= 0
+
+            # weight of every node for every grid point, the roots have weight 1
+            w = np.zeros((p1 - p0, b - a))
+            w[:, depth == 0] = 1
+
+            for d in range(depth.max()):
+                nodes = np.flatnonzero(internal & (depth == d))
+                col = grid_col[feature[nodes]]
+                on_grid = col >= 0
+
+                # other features: both branches, weighted by the cover
+                cover_yes = cover[yes[nodes]]
+                frac_yes = np.broadcast_to(cover_yes / (cover_yes + cover[no[nodes]]), (p1 - p0, len(nodes))).copy()
+
+                # grid features: the grid value decides the branch
+                frac_yes[:, on_grid] = block_points[:, col[on_grid]] < trees['split'][a:b][nodes[on_grid]]
+
+                w[:, yes[nodes]] = w[:, nodes] * frac_yes
+                w[:, no[nodes]] = w[:, nodes] * (1 - frac_yes)
+
+            leaves = np.flatnonzero(~internal)
+            pd_values[p0:p1] += w[:, leaves] @ trees['value'][a:b][leaves]
+
+    pd_values += base_margin(xgbr, trees)
+    return pd_values.reshape(shape)
+
+#%% ICE with batched predictions
+
+def ice(xgbr, X, feat, values, feats, sc=None, batch_rows=2000):
+    """
+    xgbr: trained XGBRegressor
+    X: dataframe or array with the rows for which ICE curves are computed
+    feat: feature of the ICE curves, e.g. 'Exp_PeatD'
+    values: values of feat, e.g. range(125)
+    feats: features of the model, in the order in which the model is trained
+    sc: the fitted StandardScaler, if the model is trained on scaled features
+    batch_rows: number of rows predicted together (in one buffer)
+
+    Returns an array (rows, values) with the ICE curves. The PD of X is the
+    average over the rows.
+    """
+    if isinstance(X, pd.DataFrame):
+        X = X[feats].to_numpy()
+    if sc is not None:
+        X = sc.transform(X)
+    X = np.asarray(X, dtype=np.float32)
+
+    j = feats.index(feat)
+    values = scale_values(values, j, sc)
+    booster = xgbr.get_booster()
+
+    curves = np.empty((len(X), len(values)), dtype=np.float32)
+    buffer = np.empty((len(values), min(batch_rows, len(X)), X.shape[1]), dtype=np.float32)
+
+    for start in range(0, len(X), batch_rows):
+        X_batch = X[start:start + batch_rows]
+        buf = buffer[:, :len(X_batch)]
+
+        # the rows replicated for every value, with feat set to the value
+        buf[:] = X_batch
+        buf[:, :, j] = values[:, None]
+
+        pred = booster.inplace_predict(buf.reshape(-1, X.shape[1]))
+        curves[start:start + len(X_batch)] = pred.reshape(len(values), len(X_batch)).T
+
+    return curves
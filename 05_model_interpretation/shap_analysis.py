@@ -23,17 +23,21 @@ Specify here that this should be first run before running shap_figures_modelcomp
 Edits by arietma:
     - Adjusted the code (also for plots) to the dataset, model, model specs and 
     linear regression used in the current thesis
+    - The trained model is loaded with model_registry.py, if it was trained before
 """
 
 
 #%% Import packages
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import shap
-from xgboost import XGBRegressor
 import statsmodels.formula.api as smf
 
+sys.path.append("C:/Users/ariet/Documents/Climate Studies/WSG Thesis/Script/Edited_script_Laura/04_model_evaluation/")
+from model_registry import load_or_train
+
 #%% Set up working directory and load data
 WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
 
@@ -59,12 +63,12 @@ X = mer_X; y = mer_y; hyperparams = mer_hypp
 
 X100 = shap.utils.sample(X, 100)
 
-#%% fit optimized model
+#%% fit optimized model, or load the stored model (model_registry.py)
+# this is the same model as in the simulations. XGBoost is a tree model, so it
+# is trained on the unscaled features (fit_utils.py)
 
-model_xgb = XGBRegressor(learning_rate = hyperparams['learning_rate'], 
-             max_depth = hyperparams['max_depth'], 
-             n_estimators = hyperparams['n_estimators'],
-             subsample = hyperparams['subsample']).fit(X, y)
+sc, model_xgb = load_or_train('M5', {'feats': mer_M5feats, 'hyperparams': hyperparams},
+                              mer, f'{WD}models/')
 
 #%% Initialize explainer
 explainer_xgb = shap.TreeExplainer(model_xgb, X100)
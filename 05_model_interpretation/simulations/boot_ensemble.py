@@ -0,0 +1,115 @@
+"""
+@author: arietma
+
+This script runs analyses on the stored bootstrap models of scenario_engine.py,
+so that one training pass of the bootstrap serves every uncertainty analysis.
+The models are stored by run_bootstrap with keep_models=True (see
+sim_bootstrap_parallel.py): for every seed, the booster (UBJSON), the rows of the
+bootstrapped sample and the scaler. The out-of-bag (OOB) rows of every model are
+the rows of the dataset that are not in its sample.
+
+An analysis is a consumer: a function (sc, xgbr, data, rows, series) that returns
+an array for one model. The consumers are registered in the consumers dictionary:
+    scenarios:      the predictions of the simulation series, the same as the
+                    partial results of run_bootstrap
+    oob_scores:     R2, MSE and the number of OOB rows, for the OOB rows of the model
+    pd_Exp_PeatD:   partial dependence of the predicted CO2 flux on Exp_PeatD (0-125 cm),
+                    averaged over the bootstrapped sample (mean of the ICE curves)
+    pd_tree_Exp_PeatD: partial dependence on Exp_PeatD from the weighted tree
+                    traversal, without predictions (see partial_dependence.py)
+
+New consumers can be added with register_consumer.
+
+Functions:
+    run_ensemble:   loads the model of every seed once, and runs all requested consumers
+    summarize:      average, 5th and 95th percentile of a consumer over all seeds
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+from sklearn.metrics import mean_squared_error, r2_score
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from partial_dependence import partial_dependence, ice
+from scenario_engine import get_spec, build_grid, predict_grid, load_model, oob_rows, apply_scaler
+
+#%% Consumers
+
+# values of Exp_PeatD for the partial dependence, as in the simulations
+pd_values = np.arange(125)
+
+def consume_scenarios(sc, xgbr, data, rows, series):
+    boot = data.iloc[rows]
+    X, valid, n_rows = build_grid(boot, series, get_spec(series['spec'])['feats'])
+    return predict_grid(sc, xgbr, X, valid, len(series['sweep'][1]))
+
+
+def consume_oob_scores(sc, xgbr, data, rows, series):
+    feats = get_spec(series['spec'])['feats']
+    oob = data.iloc[oob_rows(rows, len(data))]
+
+    y_pred = xgbr.predict(apply_scaler(sc, oob[feats].to_numpy()))
+    MSE = mean_squared_error(oob['CO2flx'], y_pred)
+    R2 = r2_score(oob['CO2flx'], y_pred)
+    return np.array([R2, MSE, len(oob)])
+
+
+def consume_pd_Exp_PeatD(sc, xgbr, data, rows, series):
+    feats = get_spec(series['spec'])['feats']
+    curves = ice(xgbr, data.iloc[rows], 'Exp_PeatD', pd_values, feats, sc)
+    return curves.mean(axis=0)
+
+
+def consume_pd_tree_Exp_PeatD(sc, xgbr, data, rows, series):
+    feats = get_spec(series['spec'])['feats']
+    return partial_dependence(xgbr, feats, {'Exp_PeatD': pd_values}, sc)
+
+
+consumers = {'scenarios': consume_scenarios,
+             'oob_scores': consume_oob_scores,
+             'pd_Exp_PeatD': consume_pd_Exp_PeatD,
+             'pd_tree_Exp_PeatD': consume_pd_tree_Exp_PeatD}
+
+def register_consumer(name, consumer):
+    consumers[name] = consumer
+
+#%% Run consumers on the stored ensemble
+
+def run_ensemble(data, series, seeds, partials_dir, names=None, n_threads=None):
+    """
+    data: the dataframe from which the bootstrapped samples were drawn
+    series: simulation series of the bootstrap
+    seeds: seeds of the stored models
+    partials_dir: directory of run_bootstrap, with the models in partials_dir/models/
+    names: names of the consumers to run (default: all registered consumers)
+    n_threads: number of threads XGBoost may use for predicting
+
+    Returns a dictionary with for every consumer an array with the results of all
+    seeds, in the order of the seeds (seeds on the first axis).
+    """
+    if names is None:
+        names = list(consumers.keys())
+
+    results = {name: [] for name in names}
+    for i in seeds:
+        sc, xgbr, rows = load_model(partials_dir, i)
+        xgbr.set_params(n_jobs = n_threads)
+
+        for name in names:
+            results[name].append(consumers[name](sc, xgbr, data, rows, series))
+        print(f'seed {i} done')
+
+    return {name: np.stack(values) for name, values in results.items()}
+
+
+def summarize(values):
+    """
+    Returns the average, 5th and 95th percentile over all seeds (the first axis),
+    i.e. the 90% bootstrap intervals.
+    """
+    return {'mean': np.nanmean(values, axis=0),
+            'q05': np.nanquantile(values, 0.05, axis=0),
+            'q95': np.nanquantile(values, 0.95, axis=0)}
@@ -0,0 +1,223 @@
+"""
+@author: arietma
+
+This script provides an index to quickly select rows and conditional means for
+the windows of the simulations (PAR +/- 200, Tsfc +/- 2 and EVI +/- 0.1, as
+get_cond of the former prepare_data_for_simulations.py), without comparing the
+full columns of the dataset for every combination.
+
+build_cond_index builds the index for any number of features, e.g. PAR_abs and
+Tsfc, or PAR_abs and EVI. Two structures are stored:
+    - the rows sorted by the first feature. The rows within a window of the first
+    feature are found with searchsorted, and only these rows are compared to the
+    windows of the other features. This selects the rows in O(log n + k).
+    - a grid of buckets, with the bucket edges at the window edges of the
+    values that are simulated (e.g. PAR 0, 400, ... and Tsfc 0, 5, ...). The
+    count and sum of the features to average are stored as cumulative sums
+    (prefix sums) over this grid, so the conditional mean within the windows is
+    found with a few lookups (four for two features).
+
+cond_rows returns the rows within the windows, and cond_means the mean values
+of the features within the windows. Windows that do not fall on the bucket
+edges are answered from the selected rows.
+
+The index is used by scenario_engine.py and the simulation figures
+(sim_boot_make_bigplot.py and sim_boot_make_bigplot_EVI.py).
+"""
+#%% import
+
+import itertools
+import numpy as np
+
+#%% window around a value, the same as in get_cond
+# PAR +/- 200, Tsfc +/- 2 and EVI +/- 0.1
+
+widths = {'PAR_abs': 200, 'Tsfc': 2, 'EVI': 0.1}
+
+def get_window(feat, value, width=None):
+    """
+    feat: feature, e.g. 'PAR_abs', 'Tsfc' or 'EVI'
+    value: value of feature around which range should be computed
+    width: half width of the window. If not given, the width in widths is used
+
+    Returns the lower and upper bound of the window. Both bounds are excluded,
+    i.e. lower < feat < upper, as in get_cond. As in get_cond, the window of
+    PAR_abs, Tsfc or EVI = 0 is feat < 2.
+    """
+    value = float(value)
+
+    if width is None:
+        width = widths[feat]
+
+    if value == 0 and feat in widths:
+        return -np.inf, 2.0
+
+    return value - width, value + width
+
+#%% bucket codes
+# every value gets a code: 2k if it lies between edge k-1 and edge k,
+# and 2k+1 if it is exactly equal to edge k. In this way, values on an edge
+# can be excluded, as the bounds of the windows are excluded.
+
+def _codes(x, edges):
+    k = np.searchsorted(edges, x, side='left')
+    on_edge = np.zeros(len(x), dtype=bool)
+    inside = k < len(edges)
+    on_edge[inside] = edges[k[inside]] == x[inside]
+    return 2*k + on_edge
+
+
+def _code_range(lower, upper, edges):
+    """
+    Returns the first and last code (both included) of the rows within
+    lower < x < upper, or None if lower or upper is not an edge.
+    """
+    if lower == -np.inf:
+        first = 0
+    else:
+        i = np.searchsorted(edges, lower)
+        if i == len(edges) or edges[i] != lower:
+            return None
+        first = 2*i + 2
+
+    if upper == np.inf:
+        last = 2*len(edges)
+    else:
+        j = np.searchsorted(edges, upper)
+        if j == len(edges) or edges[j] != upper:
+            return None
+        last = 2*j
+
+    return first, last
+
+
+def _cumsum_all_axes(counts, first_axis):
+    for axis in range(first_axis, counts.ndim):
+        counts = counts.cumsum(axis=axis)
+    return counts
+
+#%% build the index
+
+def build_cond_index(data, feats, values, mean_feats, window_widths=None):
+    """
+    data: dataframe from which rows should be selected, e.g. merged dataset
+    feats: features of the condition, e.g. ['PAR_abs', 'Tsfc'] or ['PAR_abs', 'EVI']
+    values: for every feature, the values that will be simulated,
+            e.g. [[0, 400, 800], [0, 5, 10]]
+    mean_feats: features of which the conditional mean is needed, e.g. ['RH', 'EVI']
+    window_widths: optional, dictionary with the half width of the window of every
+            feature. If not given, the widths of get_cond are used
+
+    Returns a dictionary with the index.
+    """
+    if window_widths is None:
+        window_widths = {feat: widths[feat] for feat in feats}
+
+    x = [data[feat].to_numpy(dtype=np.float64) for feat in feats]
+
+    # rows with NaN never fulfill a condition
+    valid = np.flatnonzero(np.all([~np.isnan(xi) for xi in x], axis=0))
+
+    # rows sorted by the first feature
+    order = valid[np.argsort(x[0][valid], kind='stable')]
+
+    # bucket edges at the window bounds of the simulated values
+    edges = []
+    for feat, feat_values in zip(feats, values):
+        bounds = [b for v in feat_values for b in get_window(feat, v, window_widths[feat])]
+        edges.append(np.unique([b for b in bounds if np.isfinite(b)]))
+    shape = tuple(2*len(e) + 1 for e in edges)
+    cell = np.ravel_multi_index([_codes(xi[valid], e) for xi, e in zip(x, edges)], shape)
+
+    # number of rows per bucket, and count and sum per bucket for every feature
+    # to average (NaNs are skipped, as in DataFrame.mean). Stored as cumulative
+    # sums over all axes, with a leading zero on every axis
+    padded = tuple(slice(1, None) for _ in shape)
+    n_cells = int(np.prod(shape))
+
+    n_rows = np.zeros(tuple(s+1 for s in shape))
+    n_rows[padded] = np.bincount(cell, minlength=n_cells).reshape(shape)
+    n_rows = _cumsum_all_axes(n_rows, 0)
+
+    counts = np.zeros((len(mean_feats),) + tuple(s+1 for s in shape))
+    sums = np.zeros((len(mean_feats),) + tuple(s+1 for s in shape))
+    for f, feat in enumerate(mean_feats):
+        feat_values = data[feat].to_numpy(dtype=np.float64)[valid]
+        notna = ~np.isnan(feat_values)
+        counts[(f,) + padded] = np.bincount(cell[notna], minlength=n_cells).reshape(shape)
+        sums[(f,) + padded] = np.bincount(cell[notna], weights=feat_values[notna], minlength=n_cells).reshape(shape)
+    counts = _cumsum_all_axes(counts, 1)
+    sums = _cumsum_all_axes(sums, 1)
+
+    return {'feats': list(feats),
+            'widths': window_widths,
+            'mean_feats': list(mean_feats),
+            'order': order,
+            'x_sorted': [xi[order] for xi in x],
+            'edges': edges,
+            'n_rows': n_rows,
+            'counts': counts,
+            'sums': sums,
+            'data': data}
+
+#%% query the index
+
+def cond_rows(index, values):
+    """
+    index: index from build_cond_index
+    values: for every feature of the index, the value around which the window
+            is computed, e.g. (400, 15)
+
+    Returns the positions (as for data.iloc) of the rows within all windows,
+    in the original order of the rows.
+    """
+    windows = [get_window(feat, v, index['widths'][feat]) for feat, v in zip(index['feats'], values)]
+
+    # rows within the window of the first feature
+    lower, upper = windows[0]
+    a = np.searchsorted(index['x_sorted'][0], lower, side='right')
+    b = np.searchsorted(index['x_sorted'][0], upper, side='left')
+
+    # compare only these rows to the windows of the other features
+    keep = np.ones(b-a, dtype=bool)
+    for xi, (lower, upper) in zip(index['x_sorted'][1:], windows[1:]):
+        keep &= (xi[a:b] > lower) & (xi[a:b] < upper)
+
+    return np.sort(index['order'][a:b][keep])
+
+
+def cond_means(index, values):
+    """
+    index: index from build_cond_index
+    values: for every feature of the index, the value around which the window
+            is computed, e.g. (400, 15)
+
+    Returns the number of rows within all windows, and a dictionary with the
+    mean of every feature in mean_feats for these rows.
+    """
+    ranges = [_code_range(*get_window(feat, v, index['widths'][feat]), e)
+              for feat, v, e in zip(index['feats'], values, index['edges'])]
+
+    # windows that do not fall on the bucket edges: use the rows
+    if any(r is None for r in ranges):
+        rows = cond_rows(index, values)
+        mask = index['data'].iloc[rows]
+        return len(rows), {feat: mask[feat].mean() for feat in index['mean_feats']}
+
+    # windows on the bucket edges: inclusion-exclusion over the corners of the
+    # windows in the cumulative sums
+    def window_sum(cum):
+        total = 0
+        for corner in itertools.product([0, 1], repeat=len(ranges)):
+            pos = tuple(r[1]+1 if c else r[0] for r, c in zip(ranges, corner))
+            sign = (-1) ** (len(ranges) - sum(corner))
+            total = total + sign * cum[(Ellipsis,) + pos]
+        return total
+
+    n_rows = int(round(window_sum(index['n_rows'])))
+    counts = window_sum(index['counts'])
+    sums = window_sum(index['sums'])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return n_rows, dict(zip(index['mean_feats'], np.atleast_1d(means)))
@@ -0,0 +1,439 @@
+"""
+@author: arietma
+edited from: prepare_data_for_simulations.py, prepare_data_for_simulations_EVI.py
+and sim_bootstrap_parallel.py
+
+This script provides one simulation engine for all simulation series. The
+simulations with PAR and Tsfc (create_df) and with PAR and EVI (create_df_EVI)
+are two cases of the same simulation: some features are held within a window
+around a chosen value (the conditioning features), one feature is varied over a
+range of values (the swept feature), and all other features of the model are
+set to their mean value within the windows.
+
+A simulation series is a dictionary with:
+    cond:   for every conditioning feature, a dictionary with labels and values,
+            and the half width of the window, e.g.
+            {'PAR_abs': ({'PAR0': 0, 'PAR400': 400}, 200), 'Tsfc': ({'T0': 0, 'T5': 5}, 2)}
+    sweep:  the swept feature and its values, e.g. ('Exp_PeatD', range(125))
+    spec:   the model, a name of model_specs.py (M1-M6, SepJan or FebAug) or a
+            model spec dictionary with feats and hyperparams
+
+The series of the thesis are series_Tsfc and series_EVI. New series only need
+a new dictionary, and use the same (parallel) code. The bootstrapped simulations
+are run with sim_bootstrap_parallel.py (also sequentially, with one worker), and
+the figures with sim_boot_make_bigplot.py and sim_boot_make_bigplot_EVI.py.
+
+The results are labelled N-D arrays: dictionaries with
+    dims:   the names of the dimensions, the conditioning features and the swept feature
+    labels: for every dimension, the labels along the axis
+    mean/q05/q95 (bootstrap) or pred (one model): arrays with one axis per dimension.
+            Combinations without data are NaN.
+
+Functions:
+    build_grid:     the model input for all combinations, stacked in one float32 array
+    fit_model:      trains a model spec on data (from model_registry.py)
+    predict_grid:   predicts for all combinations with one call of the model
+    simulate:       predictions of one model trained on all data
+    simulate_seed:  one bootstrap iteration (sample, train, predict)
+    missing_combinations: names of the combinations without data
+    run_bootstrap:  all bootstrap iterations, on a process pool, with a file per seed,
+                    and optionally the model of every seed (save_model, load_model)
+    reduce_bootstrap: average, 5th and 95th percentile of all seeds, in the order of the seeds
+    to_frame:       converts a result to the dataframe format of the simulation files
+"""
+#%% Import packages
+
+import os
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from xgboost import XGBRegressor
+from sklearn.utils import resample
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '04_model_evaluation'))
+from cond_index import build_cond_index, cond_means
+from model_registry import get_spec, fit_model, scaler_from_params
+from fit_utils import apply_scaler
+
+#%% Simulation series of the thesis
+
+PAR_values = {'PAR0': 0,'PAR400' : 400, 'PAR800': 800, 'PAR1200' : 1200, 'PAR1600' : 1600}
+Tsfc_values = {'T0': 0, 'T5':5 , 'T10':10, 'T15': 15, 'T20':20, 'T25': 25, 'T30':30}
+EVI_values = {'EVI02': 0.2, 'EVI04': 0.4, 'EVI06': 0.6, 'EVI08': 0.8}
+
+# PAR +/- 200 and Tsfc +/- 2, as in create_df
+series_Tsfc = {'cond': {'PAR_abs': (PAR_values, 200), 'Tsfc': (Tsfc_values, 2)},
+               'sweep': ('Exp_PeatD', range(125)),
+               'spec': 'M5'}
+
+# PAR +/- 200 and EVI +/- 0.1, as in create_df_EVI
+series_EVI = {'cond': {'PAR_abs': (PAR_values, 200), 'EVI': (EVI_values, 0.1)},
+              'sweep': ('Exp_PeatD', range(125)),
+              'spec': 'M5'}
+
+#%% Helper functions
+
+def get_dims(series):
+    """
+    Returns the dimensions and the labels along every dimension of a series.
+    """
+    dims = list(series['cond'].keys()) + [series['sweep'][0]]
+    labels = {feat: list(series['cond'][feat][0].keys()) for feat in series['cond']}
+    labels[series['sweep'][0]] = list(series['sweep'][1])
+    return dims, labels
+
+
+def missing_combinations(series, n_rows):
+    """
+    Returns the names of the combinations without rows within the windows (e.g.
+    'PAR0_T25'), joined as the columns of to_frame. For example PAR=0 and
+    Tsfc=25 does not occur in every (bootstrapped) sample.
+    """
+    dims, labels = get_dims(series)
+    return ['_'.join(str(labels[dim][p]) for dim, p in zip(dims[:-1], pos))
+            for pos in zip(*np.nonzero(n_rows == 0))]
+
+#%% Model input for all combinations
+
+def build_grid(data, series, feats):
+    """
+    data: dataframe from which rows should be selected, e.g. merged dataset
+    series: simulation series (see above)
+    feats: features of the model, in the order in which the model is trained
+
+    Returns:
+        X: float32 array (n_valid*n_sweep, len(feats)) with the model input of
+           all combinations that have data, in the order of np.ndindex
+        valid: boolean array (one axis per conditioning feature), True if the
+           combination has data
+        n_rows: array (one axis per conditioning feature), the number of rows
+           within the windows of every combination
+    """
+    cond_feats = list(series['cond'].keys())
+    value_lists = [list(series['cond'][feat][0].values()) for feat in cond_feats]
+    window_widths = {feat: series['cond'][feat][1] for feat in cond_feats}
+    sweep_feat = series['sweep'][0]
+    sweep_values = np.asarray(list(series['sweep'][1]), dtype=np.float32)
+
+    # the other features are set to their mean value within the windows
+    mean_feats = [feat for feat in feats if feat not in cond_feats and feat != sweep_feat]
+    index = build_cond_index(data, cond_feats, value_lists, mean_feats, window_widths)
+
+    shape = tuple(len(values) for values in value_lists)
+    valid = np.zeros(shape, dtype=bool)
+    n_rows = np.zeros(shape, dtype=int)
+    blocks = []
+
+    for pos in np.ndindex(shape):
+        values = [value_lists[d][p] for d, p in enumerate(pos)]
+        n_rows[pos], means = cond_means(index, values)
+
+        if n_rows[pos] == 0:
+            continue
+
+        block = np.empty((len(sweep_values), len(feats)), dtype=np.float32)
+        for j, feat in enumerate(feats):
+            if feat in cond_feats:
+                block[:, j] = values[cond_feats.index(feat)]
+            elif feat == sweep_feat:
+                block[:, j] = sweep_values
+            else:
+                block[:, j] = means[feat]
+
+        blocks.append(block)
+        valid[pos] = True
+
+    if len(blocks) != 0:
+        X = np.concatenate(blocks)
+    else:
+        X = np.empty((0, len(feats)), dtype=np.float32)
+
+    return X, valid, n_rows
+
+#%% Train and predict
+
+def predict_grid(sc, xgbr, X, valid, n_sweep):
+    """
+    Predicts for all combinations with one call of the model, and returns an
+    array with one axis per conditioning feature and one for the swept feature.
+    """
+    preds = np.full(valid.shape + (n_sweep,), np.nan, dtype=np.float32)
+    if len(X) != 0:
+        preds[valid] = xgbr.predict(apply_scaler(sc, X)).reshape(-1, n_sweep)
+    return preds
+
+
+def simulate(data, series, sc=None, xgbr=None):
+    """
+    data: dataframe from which rows should be selected, e.g. merged dataset
+    series: simulation series
+    sc, xgbr: optional, fitted scaler and model. If not given, the model of the
+              series is trained on all data
+
+    Returns the predictions of one model as a labelled N-D array, and the number
+    of rows within the windows of every combination.
+    """
+    spec = get_spec(series['spec'])
+    if xgbr is None:
+        sc, xgbr = fit_model(spec, data)
+
+    X, valid, n_rows = build_grid(data, series, spec['feats'])
+    dims, labels = get_dims(series)
+    pred = predict_grid(sc, xgbr, X, valid, len(labels[dims[-1]]))
+
+    return {'dims': dims, 'labels': labels, 'pred': pred}, n_rows
+
+#%% Bootstrap
+
+def bootstrap_rows(i, n_data, n=10000):
+    """
+    Returns the positions (as for data.iloc) of the bootstrapped sample of seed i.
+    These are the same rows as resample(data, replace = True, n_samples = n, random_state = i).
+    """
+    return resample(np.arange(n_data), replace = True, n_samples = n, random_state = i)
+
+
+def oob_rows(rows, n_data):
+    """
+    Returns the positions of the rows that are not in the bootstrapped sample
+    (out-of-bag rows).
+    """
+    return np.setdiff1d(np.arange(n_data), rows)
+
+
+def simulate_seed(i, data, series, n=10000, n_threads=None, return_model=False):
+    """
+    i: seed of the bootstrap iteration (random_state of the resample)
+    data: dataframe from which the bootstrapped sample is drawn, e.g. merged dataset
+    series: simulation series
+    n: sample size
+    n_threads: number of threads XGBoost may use in this iteration
+    return_model: if True, also return the scaler, model and rows of the sample
+
+    Returns the predictions for the bootstrapped sample, as an array with one
+    axis per dimension of the series, and the number of rows within the windows
+    of every combination. Combinations without data are NaN.
+    """
+    # Create bootstrapped sample and train model on all sampled data
+    rows = bootstrap_rows(i, len(data), n)
+    boot = data.iloc[rows]
+    sc, xgbr = fit_model(series['spec'], boot, n_threads)
+
+    # dataframes are created from the bootstrapped sample
+    X, valid, n_rows = build_grid(boot, series, get_spec(series['spec'])['feats'])
+    preds = predict_grid(sc, xgbr, X, valid, len(series['sweep'][1]))
+
+    if return_model:
+        return preds, n_rows, sc, xgbr, rows
+    return preds, n_rows
+
+
+def partial_path(partials_dir, i):
+    return os.path.join(partials_dir, f'seed_{i}.npz')
+
+
+def model_paths(partials_dir, i):
+    """
+    Returns the paths of the booster (UBJSON) and of the sample rows and scaler
+    of seed i.
+    """
+    models_dir = os.path.join(partials_dir, 'models')
+    return os.path.join(models_dir, f'seed_{i}.ubj'), os.path.join(models_dir, f'seed_{i}_rows.npz')
+
+
+def save_model(partials_dir, i, sc, xgbr, rows):
+    """
+    Stores the booster of seed i in binary form (UBJSON), and the rows of the
+    bootstrapped sample and the scaler parameters (if the model is scaled). The
+    out-of-bag rows follow from the sample rows.
+    """
+    model_path, rows_path = model_paths(partials_dir, i)
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+
+    # the extension .ubj sets the format, also for the temporary file
+    tmp_path = model_path.replace('.ubj', '_tmp.ubj')
+    xgbr.save_model(tmp_path)
+    os.replace(tmp_path, model_path)
+
+    tmp_path = rows_path.replace('.npz', '_tmp.npz')
+    if sc is None:
+        np.savez(tmp_path, rows=rows.astype(np.int32))
+    else:
+        np.savez(tmp_path, rows=rows.astype(np.int32), sc_mean=sc.mean_, sc_scale=sc.scale_, sc_var=sc.var_)
+    os.replace(tmp_path, rows_path)
+
+
+def load_model(partials_dir, i):
+    """
+    Returns the scaler, model and rows of the bootstrapped sample of seed i,
+    without training.
+    """
+    model_path, rows_path = model_paths(partials_dir, i)
+
+    xgbr = XGBRegressor()
+    xgbr.load_model(model_path)
+
+    with np.load(rows_path) as f:
+        rows = f['rows']
+        sc = None
+        if 'sc_mean' in f:
+            sc = scaler_from_params(f['sc_mean'], f['sc_scale'], f['sc_var'], len(rows))
+
+    return sc, xgbr, rows
+
+
+def seed_done(partials_dir, i, keep_models=False):
+    if not os.path.exists(partial_path(partials_dir, i)):
+        return False
+    if keep_models:
+        return all(os.path.exists(path) for path in model_paths(partials_dir, i))
+    return True
+
+
+def run_seed(i, data, series, partials_dir, n=10000, n_threads=None, keep_models=False):
+    """
+    Runs one bootstrap iteration and writes the predictions to partials_dir,
+    unless the file of this seed already exists. If keep_models, the model and
+    the rows of the sample are stored as well (see save_model).
+
+    Returns the seed and the combinations without data in its sample.
+    """
+    if seed_done(partials_dir, i, keep_models):
+        return i, load_missing(partials_dir, i, series)
+
+    preds, n_rows, sc, xgbr, rows = simulate_seed(i, data, series, n, n_threads, return_model=True)
+
+    if keep_models:
+        save_model(partials_dir, i, sc, xgbr, rows)
+
+    # write to a temporary file first, so that an interrupted worker never
+    # leaves a half written file behind
+    path = partial_path(partials_dir, i)
+    tmp_path = path.replace('.npz', '_tmp.npz')
+    np.savez(tmp_path, preds=preds, n_rows=n_rows)
+    os.replace(tmp_path, path)
+    return i, missing_combinations(series, n_rows)
+
+
+def load_n_rows(f):
+    """
+    Returns the number of rows of every combination from an opened seed file.
+    Files written without n_rows only tell whether a combination has data
+    (predictions that are not NaN).
+    """
+    if 'n_rows' in f:
+        return f['n_rows']
+    return (~np.isnan(f['preds'])).any(axis=-1).astype(int)
+
+
+def load_missing(partials_dir, i, series):
+    with np.load(partial_path(partials_dir, i)) as f:
+        return missing_combinations(series, load_n_rows(f))
+
+
+# Process pool: every worker receives the data and series once
+_worker_args = None
+
+def _init_worker(data, series, partials_dir, n, n_threads, keep_models):
+    global _worker_args
+    _worker_args = (data, series, partials_dir, n, n_threads, keep_models)
+
+
+def _run_seed_in_worker(i):
+    return run_seed(i, *_worker_args)
+
+
+def run_bootstrap(data, series, seeds, partials_dir, n=10000, n_workers=1, n_threads=1, keep_models=False):
+    """
+    data: dataframe from which the bootstrapped samples are drawn
+    series: simulation series
+    seeds: seeds of the bootstrap iterations, e.g. range(1,1001)
+    partials_dir: directory in which the predictions of every seed are stored
+    n: sample size
+    n_workers: number of worker processes
+    n_threads: number of threads of XGBoost in every worker
+    keep_models: if True, the model of every seed is stored in partials_dir/models/,
+            so that other analyses (boot_ensemble.py) can use the same models
+
+    Seeds for which a file already exists are skipped. The combinations
+    without data in the sample of a seed are printed.
+    """
+    os.makedirs(partials_dir, exist_ok=True)
+    todo = [i for i in seeds if not seed_done(partials_dir, i, keep_models)]
+    print(f'{len(seeds)-len(todo)} of {len(seeds)} seeds already done')
+
+    if n_workers == 1:
+        for i in todo:
+            i, missing = run_seed(i, data, series, partials_dir, n, n_threads, keep_models)
+            print(f'seed {i} done')
+            if len(missing) != 0:
+                print(f'Seed {i}: no data for', missing)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(data, series, partials_dir, n, n_threads, keep_models)) as pool:
+        for k, (i, missing) in enumerate(pool.map(_run_seed_in_worker, todo), 1):
+            print(f'seed {i} done ({k}/{len(todo)})')
+            if len(missing) != 0:
+                print(f'Seed {i}: no data for', missing)
+
+
+def reduce_bootstrap(series, seeds, partials_dir):
+    """
+    Reads the predictions of all seeds, in the order of the seeds, and calculates
+    the average, 5th and 95th percentile for every predicted value across all
+    bootstrapped samples. These represent the 90% bootstrap intervals. Because
+    the order is fixed, the result does not depend on the number of workers.
+
+    Returns the result as a labelled N-D array, with n_missing: the number of
+    seeds without data for every combination (printed for every combination
+    without data in at least one seed).
+    """
+    missing = [i for i in seeds if not os.path.exists(partial_path(partials_dir, i))]
+    if len(missing) != 0:
+        raise FileNotFoundError(f'No partial results for {len(missing)} seeds, e.g. seed {missing[0]}')
+
+    dims, labels = get_dims(series)
+    all_preds = np.empty((len(seeds),) + tuple(len(labels[dim]) for dim in dims), dtype=np.float64)
+    n_missing = np.zeros(all_preds.shape[1:-1], dtype=int)
+    for k, i in enumerate(seeds):
+        with np.load(partial_path(partials_dir, i)) as f:
+            all_preds[k] = f['preds']
+            n_missing += load_n_rows(f) == 0
+
+    # names of the combinations with n_missing > 0, in the order of np.nonzero
+    names = missing_combinations(series, (n_missing == 0).astype(int))
+    for name, k in zip(names, n_missing[n_missing > 0]):
+        print(f'No data for {name} in {k} of {len(seeds)} seeds')
+
+    with warnings.catch_warnings():
+        # combinations without data in any sample give an all-NaN slice
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return {'dims': dims, 'labels': labels, 'n_boot': len(seeds), 'n_missing': n_missing,
+                'mean': np.nanmean(all_preds, axis=0),
+                'q05': np.nanquantile(all_preds, 0.05, axis=0),
+                'q95': np.nanquantile(all_preds, 0.95, axis=0)}
+
+#%% Convert to the dataframe format of the simulation files
+
+def to_frame(result, stat):
+    """
+    result: labelled N-D array from simulate or reduce_bootstrap
+    stat: 'pred', 'mean', 'q05' or 'q95'
+
+    Returns a dataframe with a row for every value of the swept feature and a
+    column for every combination, named by the joined labels (e.g. 'PAR0_T0').
+    Combinations without data are left out.
+    """
+    dims, labels = result['dims'], result['labels']
+    values = result[stat]
+
+    cond_shape = values.shape[:-1]
+    columns = ['_'.join(str(labels[dim][p]) for dim, p in zip(dims[:-1], pos))
+               for pos in np.ndindex(cond_shape)]
+
+    df = pd.DataFrame(values.reshape(-1, values.shape[-1]).T, columns=columns)
+    return df.dropna(axis='columns', how='all')
@@ -7,40 +7,46 @@ This script simulates CO2 fluxes using the final merged model and creates
 a big figure showing the simulation results + bootstrap intervals and corresponding 
 histograms.
 
-This script defines combinations of PAR and Tsfc values. The function create_df
-is used to create dataframes with corresponding PAR and Tsfc ranges, average RH, 
-EVI, SuC, Wat and Bld values, and Exp_PeatD from 0 to 125. For every subplot of 
-the final big plot, the dataframe with combination X is used as data for the 
-model to predict for. The same combination X is used to create a histogram for 
+This script defines combinations of PAR and Tsfc values. The predictions for
+all combinations are made with series_Tsfc of scenario_engine.py: PAR and Tsfc
+ranges, average RH, EVI, SuC, Wat and Bld values, and Exp_PeatD from 0 to 125.
+For every subplot of the final big plot, the predictions of combination X are
+shown. The rows of the same combination X are used to create a histogram for 
 in the subplot below.
 
 
-Input: final merged dataset, create_df function from prepare_data_for_simulations.py
+Input: final merged dataset, scenario_engine.py
         and bootstrapped simulations (avg, 5th and 95th percentile)
 Output: big plot with simulations and histograms, with 90% bootstrap intervals.
         The figure corresponds to Figure 9 in the thesis.
 
 Edits by: arietma
-- Added the 90% bootstrap intervals calculated in sim_bootstrap.py
+- Added the 90% bootstrap intervals calculated in sim_bootstrap_parallel.py
 - Adjusted the code to the features and model specs used in the current thesis
 - Some figure specs
+- Select the rows for every combination with the index from cond_index.py
+- The trained model is loaded with model_registry.py, if it was trained before
+- The predictions are made with scenario_engine.py, for all combinations with
+one call of the model, instead of with create_df (prepare_data_for_simulations.py)
  
 """
 
 #%% Import packages
 
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from xgboost import XGBRegressor
 import matplotlib.pyplot as plt
 import os
+import sys
 from matplotlib.lines import Line2D
 import seaborn as sns
 
 #%% Import own function
 
 os.chdir("C:/Users/ariet/Documents/Climate Studies/WSG Thesis/Script/Edited_script_Laura/05_model_interpretation/simulations/")
-from prepare_data_for_simulations import create_df
+from scenario_engine import PAR_values, Tsfc_values, series_Tsfc, simulate, missing_combinations
+from cond_index import build_cond_index, cond_rows
+sys.path.append("../../04_model_evaluation/")
+from model_registry import load_or_train
 
 #%% Load data
 
@@ -66,25 +72,18 @@ y = mer['CO2flx']
 
 #%% train model (on ALL data, no need to split in test and train)
 
-# scale and fit model
-sc = StandardScaler()
-
-X_sc = pd.DataFrame(sc.fit_transform(X), columns=X.columns)
-
-xgbr = XGBRegressor(learning_rate = hyperparams['learning_rate'], 
-             max_depth = hyperparams['max_depth'], 
-             n_estimators = hyperparams['n_estimators'],
-             subsample = hyperparams['subsample'])
-
-xgbr.fit(X_sc, y) 
+# fit model, or load the stored model (model_registry.py). This is the same
+# model as in shap_analysis.py. XGBoost is a tree model, so the features are
+# not scaled (fit_utils.py)
+sc, xgbr = load_or_train('M5', {'feats': mer_M5feats, 'hyperparams': hyperparams},
+                         mer, f'{WD}models/')
 
 #%% prepare combinations of PAR/Tsfc-string with PAR/Tsfc-value in dictionary
 
-PAR_values = {'PAR0': 0,'PAR400' : 400, 'PAR800': 800, 'PAR1200' : 1200, 'PAR1600' : 1600}
-Tsfc_values = {'T0': 0, 'T5':5 , 'T10':10, 'T15': 15, 'T20':20, 'T25': 25, 'T30':30}
+# PAR_values and Tsfc_values of series_Tsfc in scenario_engine.py
 
 #%% create sets of combinations with selected values for PAR and Tsfc
-# for these combinations, dataframes with features will be created using function create_df
+# for these combinations, the predictions of series_Tsfc (scenario_engine.py) are shown
 # then, simulations and histograms will be made for every combination
 
 #%%
@@ -157,6 +156,26 @@ fig, ((ax1, ax2,ax3), # simulation top row
 
 data = mer
 
+# predictions of the model for all combinations of PAR and Tsfc with one call
+# of the model (scenario_engine.py), and the index of the data to select the rows
+# of every combination for the histograms
+sim, n_rows = simulate(data, series_Tsfc, sc, xgbr)
+missing = missing_combinations(series_Tsfc, n_rows)
+if len(missing) != 0:
+    print('No data for', missing)
+index = build_cond_index(data, ['PAR_abs', 'Tsfc'], [PAR_values.values(), Tsfc_values.values()], [])
+
+def combination(PAR_value, Tsfc_value):
+    """
+    Returns the rows of data within the windows of PAR and Tsfc, and a dataframe
+    with the predicted CO2 flux for Exp_PeatD from 0 to 124 and the mean EVI of
+    these rows
+    """
+    mask = data.iloc[cond_rows(index, (PAR_value, Tsfc_value))]
+    pos = (list(PAR_values.values()).index(PAR_value), list(Tsfc_values.values()).index(Tsfc_value))
+    df = pd.DataFrame({'CO2_pred': sim['pred'][pos], 'EVI': mask['EVI'].mean()})
+    return mask, df
+
 # select which combinations of PAR and Tsfc
 combinations = combi_PAR0
 store_EVI_0 = [] # To show that EVI has different values for each simulation 
@@ -167,14 +186,10 @@ for i in range(len(combinations)): # looping over combinations
     # select PAR and Tsfc value
     PAR_value = combinations[i][0]; Tsfc_value = combinations[i][1]  
     
-    # create dataframe using function        
-    mask, df = create_df(PAR_value, Tsfc_value, data)
+    # rows and predictions of the combination
+    mask, df = combination(PAR_value, Tsfc_value)
     store_EVI_0.append(df['EVI'][0])
     
-    # scale data and predict
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
-    
     # ax 1: simulation plot for current combination
     ax1.scatter(df.index, df['CO2_pred'],s=3, 
                 # coloris based on index of Tsfc value
@@ -206,10 +221,8 @@ combinations = combi_PAR400
 store_EVI_400 = []
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; Tsfc_value = combinations[i][1]        
-    mask, df  = create_df(PAR_value, Tsfc_value, data)
+    mask, df = combination(PAR_value, Tsfc_value)
     store_EVI_400.append(df['EVI'][0])
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
     ax2.scatter(df.index,df['CO2_pred'], s=3,
                  color=colors[list(Tsfc_values.values()).index(Tsfc_value)])
     ax2.set_ylabel('Predicted CO$_2$ flux [µmol m$^{-2}$ s$^{-1}$]')
@@ -237,10 +250,8 @@ combinations = combi_PAR800
 store_EVI_800 = []
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; Tsfc_value = combinations[i][1]        
-    mask, df = create_df(PAR_value, Tsfc_value, data)
+    mask, df = combination(PAR_value, Tsfc_value)
     store_EVI_800.append(df['EVI'][0])
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
     ax3.scatter(df.index, df['CO2_pred'],s=3,
                  color=colors[list(Tsfc_values.values()).index(Tsfc_value)])
     ax3.set_ylabel('Predicted CO$_2$ flux [µmol m$^{-2}$ s$^{-1}$]')
@@ -266,10 +277,8 @@ combinations = combi_PAR1200
 store_EVI_1200 = []
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; Tsfc_value = combinations[i][1]        
-    mask, df = create_df(PAR_value, Tsfc_value, data)
+    mask, df = combination(PAR_value, Tsfc_value)
     store_EVI_1200.append(df['EVI'][0])
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
     ax4.scatter(df.index, df['CO2_pred'],s=3,
               color=colors[list(Tsfc_values.values()).index(Tsfc_value)])
     ax4a.set_xlabel('Exp_PeatD [cm]')
@@ -293,10 +302,8 @@ combinations = combi_PAR1600
 store_EVI_1600 = []
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; Tsfc_value = combinations[i][1]        
-    mask, df = create_df(PAR_value, Tsfc_value, data)
+    mask, df = combination(PAR_value, Tsfc_value)
     store_EVI_1600.append(df['EVI'][0])
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
     ax5.scatter(df.index, df['CO2_pred'],s=3,
                  color=colors[list(Tsfc_values.values()).index(Tsfc_value)])
     ax5.set_title('PAR = 1600')
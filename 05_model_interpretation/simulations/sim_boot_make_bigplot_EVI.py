@@ -7,40 +7,46 @@ This script simulates CO2 fluxes using the final merged model and creates
 a big figure showing the simulation results + bootstrap intervals and corresponding 
 histograms.
 
-This script defines combinations of PAR and EVI values. The function create_df_EVI
-is used to create ataframes with corresponding PAR and EVI ranges, average RH, 
-Tsfc, SuC, Wat and Bld values, and Exp_PeatD from 0 to 125. For every subplot of 
-the final big plot, the dataframe with combination X is used as data for the model 
-to predict for. The same combination X is used to create a histogram for in the 
-subplot below.
+This script defines combinations of PAR and EVI values. The predictions for
+all combinations are made with series_EVI of scenario_engine.py: PAR and EVI
+ranges, average RH, Tsfc, SuC, Wat and Bld values, and Exp_PeatD from 0 to 125.
+For every subplot of the final big plot, the predictions of combination X are
+shown. The rows of the same combination X are used to create a histogram for in
+the subplot below.
 
 
-Input: final merged dataset, and create_df_EVI function from prepare_data_for_simulations_EVI.py
+Input: final merged dataset, scenario_engine.py
          and bootstrapped simulations (avg, 5th and 95th percentile)
 Output: big plot with simulations and histograms, with 90% bootstrap intervals.
         The figure corresponds to Figure E1 in the thesis.
 
 Edits by: arietma
-- Added the 90% bootstrap intervals calculated in sim_bootstrap_EVI.py
+- Added the 90% bootstrap intervals calculated in sim_bootstrap_parallel.py (series EVI)
 - Adjusted the code to the features and model specs used in the current thesis
 - Some figure specs
+- Select the rows for every combination with the index from cond_index.py
+- The trained model is loaded with model_registry.py, if it was trained before
+- The predictions are made with scenario_engine.py, for all combinations with
+one call of the model, instead of with create_df_EVI (prepare_data_for_simulations_EVI.py)
 
 """
 
 #%% Import packages
 
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from xgboost import XGBRegressor
 import matplotlib.pyplot as plt
 import os
+import sys
 from matplotlib.lines import Line2D
 import seaborn as sns
 
 #%% Import own function
 
 os.chdir("C:/Users/ariet/Documents/Climate Studies/WSG Thesis/Script/Edited_script_Laura/05_model_interpretation/simulations/")
-from prepare_data_for_simulations_EVI import create_df_EVI
+from scenario_engine import PAR_values, EVI_values, series_EVI, simulate, missing_combinations
+from cond_index import build_cond_index, cond_rows
+sys.path.append("../../04_model_evaluation/")
+from model_registry import load_or_train
 
 #%% Load data
 
@@ -66,25 +72,18 @@ y = mer['CO2flx']
 
 #%% train model (on ALL data, no need to split in test and train)
 
-# scale and fit model
-sc = StandardScaler()
-
-X_sc = pd.DataFrame(sc.fit_transform(X), columns=X.columns)
-
-xgbr = XGBRegressor(learning_rate = hyperparams['learning_rate'], 
-             max_depth = hyperparams['max_depth'], 
-             n_estimators = hyperparams['n_estimators'],
-             subsample = hyperparams['subsample'])
-
-xgbr.fit(X_sc, y) 
+# fit model, or load the stored model (model_registry.py). This is the same
+# model as in shap_analysis.py. XGBoost is a tree model, so the features are
+# not scaled (fit_utils.py)
+sc, xgbr = load_or_train('M5', {'feats': mer_M5feats, 'hyperparams': hyperparams},
+                         mer, f'{WD}models/')
 
 #%% prepare combinations of PAR/EVI-string with PAR/EVI-value in dictionary
 
-PAR_values = {'PAR0': 0,'PAR400' : 400, 'PAR800': 800, 'PAR1200' : 1200, 'PAR1600' : 1600}
-EVI_values = {'EVI02': 0.2, 'EVI04': 0.4, 'EVI06': 0.6, 'EVI08': 0.8}
+# PAR_values and EVI_values of series_EVI in scenario_engine.py
 
 #%% create sets of combinations with selected values for PAR and EVI
-# for these combinations, dataframes with features will be created using function create_df_EVI
+# for these combinations, the predictions of series_EVI (scenario_engine.py) are shown
 # then, simulations and histograms will be made for every combination
 
 #%%
@@ -155,6 +154,25 @@ fig, ((ax1, ax2,ax3), # simulation top row
 
 data = mer
 
+# predictions of the model for all combinations of PAR and EVI with one call
+# of the model (scenario_engine.py), and the index of the data to select the rows
+# of every combination for the histograms
+sim, n_rows = simulate(data, series_EVI, sc, xgbr)
+missing = missing_combinations(series_EVI, n_rows)
+if len(missing) != 0:
+    print('No data for', missing)
+index = build_cond_index(data, ['PAR_abs', 'EVI'], [PAR_values.values(), EVI_values.values()], [])
+
+def combination(PAR_value, EVI_value):
+    """
+    Returns the rows of data within the windows of PAR and EVI, and a dataframe
+    with the predicted CO2 flux for Exp_PeatD from 0 to 124
+    """
+    mask = data.iloc[cond_rows(index, (PAR_value, EVI_value))]
+    pos = (list(PAR_values.values()).index(PAR_value), list(EVI_values.values()).index(EVI_value))
+    df = pd.DataFrame({'CO2_pred': sim['pred'][pos]})
+    return mask, df
+
 # select which combinations of PAR and Tsfc
 combinations = combi_PAR0
 
@@ -163,12 +181,8 @@ for i in range(len(combinations)): # looping over combinations
     # select PAR and Tsfc value
     PAR_value = combinations[i][0]; EVI_value = combinations[i][1]  
     
-    # create dataframe using function        
-    mask, df = create_df_EVI(PAR_value, EVI_value, data)
-    
-    # scale data and predict
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
+    # rows and predictions of the combination
+    mask, df = combination(PAR_value, EVI_value)
     
     # ax 1: simulation plot for current combination
     ax1.scatter(df.index, df['CO2_pred'],s=3, 
@@ -198,9 +212,7 @@ for i in range(len(combinations)): # looping over combinations
 combinations = combi_PAR400
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; EVI_value = combinations[i][1]        
-    mask, df  = create_df_EVI(PAR_value, EVI_value, data)
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
+    mask, df = combination(PAR_value, EVI_value)
     ax2.scatter(df.index,df['CO2_pred'], s=3,
                  color=colors[list(EVI_values.values()).index(EVI_value)])
     ax2.set_ylabel('Predicted CO$_2$ flux [µmol m$^{-2}$ s$^{-1}$]')
@@ -234,9 +246,7 @@ nv3.set_visible(False)
 combinations = combi_PAR800
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; EVI_value = combinations[i][1]        
-    mask, df = create_df_EVI(PAR_value, EVI_value, data)
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
+    mask, df = combination(PAR_value, EVI_value)
     ax3.scatter(df.index, df['CO2_pred'],s=3,
                  color=colors[list(EVI_values.values()).index(EVI_value)])
     ax3.set_ylabel('Predicted CO$_2$ flux [µmol m$^{-2}$ s$^{-1}$]')
@@ -258,9 +268,7 @@ for i in range(len(combinations)):
 combinations = combi_PAR1200
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; EVI_value = combinations[i][1]        
-    mask, df = create_df_EVI(PAR_value, EVI_value, data)
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
+    mask, df = combination(PAR_value, EVI_value)
     ax4.scatter(df.index, df['CO2_pred'],s=3,
               color=colors[list(EVI_values.values()).index(EVI_value)])
     ax4a.set_xlabel('Exp_PeatD [cm]')
@@ -282,9 +290,7 @@ for i in range(len(combinations)):
 combinations = combi_PAR1600
 for i in range(len(combinations)):
     PAR_value = combinations[i][0]; EVI_value = combinations[i][1]        
-    mask, df = create_df_EVI(PAR_value, EVI_value, data)
-    X_sc = pd.DataFrame(sc.transform(df[mer_M5feats]),columns=mer_M5feats)
-    df['CO2_pred'] = xgbr.predict(X_sc)
+    mask, df = combination(PAR_value, EVI_value)
     ax5.scatter(df.index, df['CO2_pred'],s=3,
                  color=colors[list(EVI_values.values()).index(EVI_value)])
     ax5.set_title('PAR_abs = 1600')
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: sim_bootstrap.py and sim_bootstrap_EVI.py
+
+This script performs the bootstrapped simulations for many combinations of PAR
+and Tsfc, and of PAR and EVI, to show the bootstrap intervals in
+sim_boot_make_bigplot.py and sim_boot_make_bigplot_EVI.py. In every iteration
+(seed), a bootstrapped sample of n=10,000 rows is drawn from the merged dataset,
+the model is trained on the sample and predicts for all combinations. The
+iterations are distributed over several worker processes, or over the tasks of
+a SLURM job array; with one worker they are run one after the other, as in the
+former sim_bootstrap.py and sim_bootstrap_EVI.py. Every iteration is independent
+and seeded by random_state = i, so the iterations can be run in any order and
+on any number of workers.
+
+The simulations are run with scenario_engine.py. The series are defined there
+(series_Tsfc and series_EVI); a new series only needs to be added to the series
+dictionary below.
+
+Every worker trains the XGBoost model with a fixed number of threads (n_threads),
+so that the workers do not compete for the same cores. The predictions of every
+seed are written to a separate file in boot_partials/<series>/. Seeds for which a
+file already exists are skipped, so an interrupted run can simply be restarted.
+
+After all seeds are done, the partial results are reduced to the average, 5th
+and 95th percentile. The partial results are always reduced in the order of the
+seeds, so the output is identical regardless of the number of workers or tasks.
+
+If keep_models is True, the model of every seed is stored as well (in
+boot_partials/<series>/models/). The ensemble mode then runs the analyses of
+boot_ensemble.py on the stored models, without training again: the OOB scores of
+every model and the partial dependence on Exp_PeatD with bootstrap intervals.
+
+Run in one of three modes, for series Tsfc or EVI:
+    python sim_bootstrap_parallel.py <series> pool <n_workers> <n_threads>
+        run all seeds on a process pool, and reduce afterwards
+    python sim_bootstrap_parallel.py <series> slurm <SLURM_ARRAY_TASK_ID> <n_tasks> <n_threads>
+        run every n_tasks-th seed, starting from seed SLURM_ARRAY_TASK_ID
+        (in the sbatch file: #SBATCH --array=1-<n_tasks>)
+    python sim_bootstrap_parallel.py <series> reduce
+        reduce the partial results of all seeds, e.g. after the job array is done
+    python sim_bootstrap_parallel.py <series> ensemble <n_threads>
+        run the analyses of boot_ensemble.py on the stored models
+
+Input: final merged dataset (via model_specs.py), and scenario_engine.py.
+Output: the predictions of every seed (boot_partials/<series>/seed_<i>.npz) and
+        3 dataframes with CO2 predictions for every present combination:
+        - boot_simulation_average:  average for every prediction across all bootstrapped samples
+        - boot_simulation_5:        5th percentile for every prediction across all bootstrapped samples
+        - boot_simulation_95:       95th percentile for every prediction across all bootstrapped samples
+        and in ensemble mode:
+        - boot_simulation_oob_scores:   R2, MSE and no. OOB rows of every bootstrap model
+        - boot_simulation_pd_Exp_PeatD: average, 5th and 95th percentile of the partial
+                                        dependence on Exp_PeatD
+"""
+#%% Import packages
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '04_model_evaluation'))
+from scenario_engine import series_Tsfc, series_EVI, run_bootstrap, reduce_bootstrap, to_frame
+from boot_ensemble import run_ensemble, summarize, pd_values
+from model_specs import load_model_data
+
+#%% Define data, series and bootstrap specs
+
+WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+
+# Series and the names of their output files
+series = {'Tsfc': (series_Tsfc, 'df_0228_boot_simulation'),
+          'EVI': (series_EVI, 'df_0228_boot_simulation_EVI')}
+
+set_seeds = range(1,1001)       # iterate over these set seeds
+B = len(set_seeds)              # no. bootstrap samples
+n = 10000                       # sample size
+keep_models = True              # store the model of every seed for boot_ensemble.py
+
+#%% Save the reduced results
+
+def save_reduced(name, seeds):
+    sim_series, out_name = series[name]
+    result = reduce_bootstrap(sim_series, seeds, f'{WD}simulations/boot_partials/{name}/')
+
+    # Save bootstrapped average, 5th and 95th percentile
+    to_frame(result, 'mean').to_csv(f"{WD}/simulations/{out_name}_average_B{B}.csv")
+    to_frame(result, 'q05').to_csv(f"{WD}/simulations/{out_name}_5_B{B}.csv")
+    to_frame(result, 'q95').to_csv(f"{WD}/simulations/{out_name}_95_B{B}.csv")
+
+def save_ensemble(name, seeds, data, n_threads):
+    sim_series, out_name = series[name]
+    results = run_ensemble(data, sim_series, seeds, f'{WD}simulations/boot_partials/{name}/',
+                           ['oob_scores', 'pd_Exp_PeatD'], n_threads)
+
+    # OOB scores of every bootstrap model
+    oob_scores = pd.DataFrame(results['oob_scores'], columns=['R2', 'MSE', 'n_oob'], index=seeds)
+    oob_scores.to_csv(f"{WD}/simulations/{out_name}_oob_scores_B{B}.csv")
+
+    # bootstrapped partial dependence on Exp_PeatD
+    bands = summarize(results['pd_Exp_PeatD'])
+    pd_Exp_PeatD = pd.DataFrame({'Exp_PeatD': pd_values, 'average': bands['mean'],
+                                 '5': bands['q05'], '95': bands['q95']})
+    pd_Exp_PeatD.to_csv(f"{WD}/simulations/{out_name}_pd_Exp_PeatD_B{B}.csv")
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    name, mode = args[0], args[1]
+    if name not in series:
+        raise ValueError(f"Unknown series '{name}', use one of {list(series.keys())}")
+
+    sim_series = series[name][0]
+    partials_dir = f'{WD}simulations/boot_partials/{name}/'
+    start_time = time.time()
+
+    if mode == 'pool':
+        n_workers = int(args[2])
+        n_threads = int(args[3])
+        data = load_model_data(sim_series['spec'], WD)
+        run_bootstrap(data, sim_series, list(set_seeds), partials_dir, n, n_workers, n_threads, keep_models)
+        save_reduced(name, list(set_seeds))
+
+    elif mode == 'slurm':
+        slurm_task_id = int(args[2]) # in the sbatch file: #SBATCH --array=1-<n_tasks>
+        n_tasks = int(args[3])
+        n_threads = int(args[4])
+
+        # every task runs every n_tasks-th seed
+        task_seeds = list(set_seeds)[slurm_task_id-1::n_tasks]
+        data = load_model_data(sim_series['spec'], WD)
+        run_bootstrap(data, sim_series, task_seeds, partials_dir, n, 1, n_threads, keep_models)
+
+    elif mode == 'reduce':
+        save_reduced(name, list(set_seeds))
+
+    elif mode == 'ensemble':
+        n_threads = int(args[2])
+        data = load_model_data(sim_series['spec'], WD)
+        save_ensemble(name, list(set_seeds), data, n_threads)
+
+    else:
+        raise ValueError(f"Unknown mode '{mode}', use 'pool', 'slurm', 'reduce' or 'ensemble'")
+
+    elapsed_time = time.time() - start_time
+    print(f"Elapsed time: {elapsed_time:.2f} seconds")
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: shap_analysis.py (conversion of units of b1)
+
+This script calculates the annual CO2 emission of parcels with a trained model,
+by predicting NEE for every half hour of a year and adding up the predictions.
+In shap_analysis.py, the slope of the Shapley values of Exp_PeatD is converted by
+hand from umol m-2 s-1 to kg ha-1 yr-1 (4.22 tCO2 ha-1 yr-1 per 10 cm drainage).
+Here, the model is integrated over the meteorological drivers of a full year
+instead, for many parcels and drainage scenarios at once.
+
+The features of the model come from two tables:
+    parcels:    a row per parcel with the features that do not change in time
+                (e.g. EVI, SuC, Wat, Bld and Exp_PeatD, or PeatD, ahn and GWS),
+                and optionally the area of the parcel in ha (area)
+    drivers:    a row per half hour with Datetime and the features that change
+                in time (e.g. PAR_abs, Tsfc and RH of a KNMI station)
+A scenario is the parcels table with other values, e.g. water_table_scenario
+raises the groundwater level of all parcels by 10 cm and calculates OWD and
+Exp_PeatD again with the rules of the cleaning scripts (cleaning.py). The current
+situation is calculated in the same way (raised by 0 cm), so it only differs
+from the other scenarios by the groundwater level.
+
+The drivers should cover one calendar year. Time steps without a value of all
+drivers are not predicted. If the drivers cover less than min_coverage (default
+95%) of the time steps of the year, no totals are calculated; otherwise the sum of
+the predictions is scaled to the whole year (divided by the coverage, i.e. the
+average prediction times the length of the year), and the coverage is reported
+with the totals.
+
+The model input of all scenarios, parcels and half hours (scenarios x parcels x
+timesteps rows) does not fit in memory, so the parcels are predicted in chunks
+of at most max_rows rows. The float32 input of a chunk is assembled once in a
+buffer that is used again for the next chunk, and is predicted with every model
+of the ensemble (the bootstrap models of scenario_engine.py) before the next
+chunk is assembled. The bootstrap intervals are the 5th and 95th percentile of
+the annual totals of the models, as in boot_ensemble.py.
+
+Run as:
+    python annual_upscaling.py <parcels csv> <drivers csv> <partials dir> <n_seeds> [<raise cm> ...]
+        e.g. python annual_upscaling.py parcels.csv knmi_2022.csv boot_partials/Tsfc/ 100 10 20
+
+Input: the parcels, the half-hourly drivers and the stored bootstrap models
+Output: annual CO2 emission per scenario and parcel (kg CO2 ha-1 yr-1), and per
+        scenario for all parcels together (t CO2 yr-1), with bootstrap intervals
+
+Functions:
+    umol_to_kg_ha:          flux in umol m-2 s-1 integrated over seconds to kg CO2 ha-1
+    water_table_scenario:   parcels with a higher (or lower) groundwater level
+    load_ensemble:          the stored bootstrap models
+    driver_coverage:        the fraction of the year that the drivers cover
+    annual_totals:          annual CO2 emission of every model, scenario and parcel
+    summarize_totals:       the totals with bootstrap intervals, as dataframes
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '05_model_interpretation', 'simulations'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_spatial_preprocessing', 'reclassify_and_clean_datasets'))
+from scenario_engine import load_model
+from model_specs import model_specs
+from boot_ensemble import summarize
+from fit_utils import apply_scaler
+from cleaning import open_water_depth, exp_peat_depth
+
+#%% Units
+
+def umol_to_kg_ha(flux_seconds):
+    """
+    Returns a CO2 flux in umol m-2 s-1, integrated over time in seconds (umol m-2),
+    in kg CO2 ha-1, as the conversion of b1 in shap_analysis.py.
+    """
+    mol_m2 = flux_seconds * (10 ** -6) # umol to mol
+    gram_m2 = mol_m2 * 44.0095 # CO2
+    kg_m2 = gram_m2 / 1000 # gram to kg
+    return kg_m2 * (10 ** 4) # m2 to ha
+
+#%% Scenarios
+
+def water_table_scenario(parcels, raise_cm):
+    """
+    parcels: parcels with PeatD, ahn and GWS (in m)
+    raise_cm: cm by which the groundwater level is raised (negative: lowered)
+
+    Returns the parcels with the raised groundwater level, and OWD and Exp_PeatD
+    calculated again as in the cleaning scripts. OWD is at least 0 (groundwater
+    at the surface).
+    """
+    parcels = parcels.copy()
+    parcels['GWS'] = parcels['GWS'] + raise_cm/100
+    parcels['OWD'] = np.maximum(open_water_depth(parcels['ahn'], parcels['GWS']), 0)
+    parcels['Exp_PeatD'] = exp_peat_depth(parcels['PeatD'], parcels['OWD'])
+    return parcels
+
+#%% Models
+
+def load_ensemble(partials_dir, seeds):
+    """
+    Returns the scaler and model of every stored bootstrap model (see save_model
+    in scenario_engine.py).
+    """
+    ensemble = []
+    for i in seeds:
+        sc, xgbr, rows = load_model(partials_dir, i)
+        ensemble.append((sc, xgbr))
+    return ensemble
+
+#%% Annual totals
+
+def time_step(drivers):
+    """
+    Returns the time step of the drivers in seconds (the median of the
+    differences of Datetime, 1800 s for half-hourly drivers).
+    """
+    times = pd.to_datetime(drivers['Datetime'])
+    return float(np.median(np.diff(times.to_numpy()).astype('timedelta64[s]').astype(np.float64)))
+
+
+def driver_coverage(drivers, time_feats, dt):
+    """
+    drivers: a row per time step with Datetime and the features that change in time
+    time_feats: the features of the drivers that the model uses
+    dt: time step in seconds (time_step)
+
+    Returns the fraction of the time steps of the year that the drivers cover, and
+    the rows of the drivers that are used: the first row of every time, with a
+    value of all features. Raises a ValueError if the drivers are not of one
+    calendar year.
+    """
+    times = pd.to_datetime(drivers['Datetime'])
+    years = times.dt.year.unique()
+    if len(years) != 1:
+        raise ValueError(f'The drivers should cover one calendar year, not {[int(y) for y in sorted(years)]}')
+
+    year = pd.Timestamp(year=int(years[0]), month=1, day=1)
+    year_seconds = (year + pd.DateOffset(years=1) - year).total_seconds()
+    use = (drivers[time_feats].notna().all(axis=1) & ~times.duplicated()).to_numpy()
+    return use.sum() * dt / year_seconds, use
+
+
+def annual_totals(ensemble, feats, scenarios, drivers, max_rows=2000000, n_threads=None, min_coverage=0.95):
+    """
+    ensemble: list of (scaler, model), e.g. load_ensemble, or [(None, xgbr)] for one model
+    feats: features of the models, in the order in which they are trained
+    scenarios: dictionary with per scenario the parcels table (same parcels, same order)
+    drivers: a row per time step with Datetime and the features that change in
+             time, of one calendar year
+    max_rows: maximum number of rows of the model input of one chunk
+    n_threads: number of threads XGBoost may use for predicting
+    min_coverage: minimum fraction of the year that the drivers should cover
+
+    Returns the annual emission in kg CO2 ha-1 of every model, scenario and parcel
+    (models x scenarios x parcels): the sum of the predictions over the time steps
+    with drivers, times the time step, scaled to the whole year; and the coverage
+    (driver_coverage). Raises a ValueError if the coverage is below min_coverage.
+    """
+    names = list(scenarios)
+    time_feats = [feat for feat in feats if feat in drivers.columns]
+    parcel_feats = [feat for feat in feats if feat not in time_feats]
+    dt = time_step(drivers)
+
+    coverage, use = driver_coverage(drivers, time_feats, dt)
+    if coverage < min_coverage:
+        raise ValueError(f'The drivers cover {coverage:.1%} of the year, less than min_coverage '
+                         f'({min_coverage:.0%}), so the annual totals would be incomplete')
+    drivers = drivers[use]
+
+    # all scenarios of a parcel after each other, as units of (scenario, parcel)
+    units = np.stack([scenarios[name][parcel_feats].to_numpy(dtype=np.float32) for name in names], axis=1)
+    n_parcels = units.shape[0]
+    units = units.reshape(-1, len(parcel_feats))
+    D = drivers[time_feats].to_numpy(dtype=np.float32)
+    n_steps = len(D)
+
+    for sc, xgbr in ensemble:
+        xgbr.set_params(n_jobs = n_threads)
+
+    # one buffer for the model input of a chunk of units, used again for every chunk
+    chunk = max(1, max_rows // n_steps)
+    buffer = np.empty((min(chunk, len(units)) * n_steps, len(feats)), dtype=np.float32)
+    time_cols = [feats.index(feat) for feat in time_feats]
+    parcel_cols = [feats.index(feat) for feat in parcel_feats]
+
+    totals = np.empty((len(ensemble), len(units)), dtype=np.float64)
+    for start in range(0, len(units), chunk):
+        stop = min(start + chunk, len(units))
+        X = buffer[:(stop-start) * n_steps]
+        X3 = X.reshape(stop-start, n_steps, len(feats))
+        X3[:, :, time_cols] = D[None, :, :]
+        X3[:, :, parcel_cols] = units[start:stop, None, :]
+
+        for m, (sc, xgbr) in enumerate(ensemble):
+            pred = xgbr.predict(apply_scaler(sc, X)).reshape(stop-start, n_steps)
+            totals[m, start:stop] = pred.sum(axis=1, dtype=np.float64)
+
+    # scaled to the whole year
+    totals = umol_to_kg_ha(totals * dt / coverage)
+    return totals.reshape(len(ensemble), n_parcels, len(names)).transpose(0, 2, 1), coverage
+
+
+def summarize_totals(totals, scenarios):
+    """
+    totals: annual emission of every model, scenario and parcel (annual_totals)
+    scenarios: the scenarios of annual_totals
+
+    Returns a dataframe with the average, 5th and 95th percentile of the annual
+    emission of every scenario and parcel (kg CO2 ha-1 yr-1), and a dataframe with
+    the same for all parcels together (t CO2 yr-1, with the area of the parcels;
+    with the average per ha if the parcels have no area).
+    """
+    names = list(scenarios)
+    parcels = scenarios[names[0]]
+
+    per_parcel = summarize(totals)
+    index = pd.MultiIndex.from_product([names, parcels.index], names=['scenario', 'parcel'])
+    per_parcel = pd.DataFrame({key: values.ravel() for key, values in per_parcel.items()}, index=index)
+
+    if 'area' in parcels.columns:
+        regional = (totals * parcels['area'].to_numpy()).sum(axis=2) / 1000 # kg to t
+    else:
+        regional = totals.mean(axis=2) / 1000
+    regional = pd.DataFrame(summarize(regional), index=pd.Index(names, name='scenario'))
+
+    return per_parcel, regional
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    parcels_path, drivers_path, partials_dir = args[0], args[1], args[2]
+    n_seeds = int(args[3]) if len(args) > 3 else 100
+    raises = [float(arg) for arg in args[4:]]
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    feats = list(model_specs['M5']['feats'])
+
+    parcels = pd.read_csv(parcels_path, index_col=0)
+    drivers = pd.read_csv(drivers_path)
+
+    # the current situation in the same way as the scenarios (OWD at least 0), if
+    # the groundwater level of the parcels is known
+    if {'PeatD', 'ahn', 'GWS'} <= set(parcels.columns):
+        scenarios = {'current': water_table_scenario(parcels, 0)}
+    elif raises:
+        raise ValueError('The water table scenarios need PeatD, ahn and GWS of the parcels')
+    else:
+        scenarios = {'current': parcels}
+    for raise_cm in raises:
+        scenarios[f'raise{raise_cm:g}cm'] = water_table_scenario(parcels, raise_cm)
+
+    ensemble = load_ensemble(partials_dir, range(n_seeds))
+    totals, coverage = annual_totals(ensemble, feats, scenarios, drivers)
+    per_parcel, regional = summarize_totals(totals, scenarios)
+    regional['coverage'] = coverage
+    print(f'the drivers cover {coverage:.1%} of the year, the totals are scaled to the whole year')
+
+    per_parcel.to_csv(f'{WD}annual_emission_parcels.csv')
+    regional.to_csv(f'{WD}annual_emission_regional.csv')
+    print(regional)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+edited from: prepare_data_for_simulations.py (create_df) and sim_bootstrap.py
+
+This script evaluates drainage interventions with a trained model (M5) or the
+bootstrap ensemble of M5, for the observations of the merged dataset or for a
+parcels table. Before, an intervention (e.g. a recommended Air Exposed Peat Depth
+of 20 - 38 cm) could only be tested by changing the ranges of create_df and
+running the bootstrap again.
+
+An intervention changes Exp_PeatD of every row, as the water management would:
+    ('target', t):  the groundwater level is set so that OWD = t cm, so
+                    Exp_PeatD = min(PeatD, t)
+    ('shift', d):   the groundwater level is lowered by d cm (raised if d < 0):
+                    OWD + d (at least 0), and Exp_PeatD calculated again with the
+                    rule of the cleaning scripts (exp_peat_depth in cleaning.py)
+All other features stay the same. The result of an intervention is the change of
+the mean predicted CO2 flux of the rows (or parcels, weighted by area) with
+respect to the current Exp_PeatD, in umol m-2 s-1 and in t CO2 ha-1 yr-1 (as
+the conversion in shap_analysis.py), with the 5th and 95th percentile over the
+models of the ensemble.
+
+All interventions are predicted in one batch: the features of the rows are
+copied once into a float32 buffer for as many interventions as fit in max_rows
+rows, and for every chunk of interventions only the Exp_PeatD column of the
+buffer is filled in. The current Exp_PeatD is predicted in the same batch, so
+hundreds of targets take a few predictions per model.
+
+Run as:
+    python drainage_scenarios.py <partials dir> <n_seeds>
+        the interventions are targets of 0 to 125 cm and shifts of -50 to 50 cm
+
+Input: the merged dataset (or a parcels table) and the stored bootstrap models
+Output: the change of the CO2 flux for every intervention, with bootstrap intervals
+
+Functions:
+    intervention_name:      name of an intervention, e.g. target30cm or shift-10cm
+    intervention_exp_peatd: Exp_PeatD of the rows after an intervention
+    evaluate_interventions: mean predicted CO2 flux of every model and intervention
+    summarize_interventions: the changes of the CO2 flux with bootstrap intervals
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '04_model_evaluation'))
+from annual_upscaling import umol_to_kg_ha, load_ensemble
+from boot_ensemble import summarize
+from model_specs import model_specs, load_model_data
+from fit_utils import apply_scaler, to_float32
+from cleaning import exp_peat_depth
+
+#%% Interventions
+
+def intervention_name(intervention):
+    kind, value = intervention
+    return f'{kind}{value:g}cm'
+
+
+def intervention_exp_peatd(data, intervention):
+    """
+    data: rows with PeatD and OWD (in cm)
+    intervention: ('target', t) or ('shift', d), see above
+
+    Returns Exp_PeatD of the rows after the intervention.
+    """
+    kind, value = intervention
+    PeatD = data['PeatD'].to_numpy(dtype=np.float64)
+    if kind == 'target':
+        OWD = np.full(len(data), float(value))
+    elif kind == 'shift':
+        OWD = np.maximum(data['OWD'].to_numpy(dtype=np.float64) + value, 0)
+    else:
+        raise ValueError(f"Unknown intervention '{kind}', use 'target' or 'shift'")
+    return exp_peat_depth(PeatD, OWD)
+
+#%% Evaluate
+
+def evaluate_interventions(ensemble, feats, data, interventions, max_rows=2000000, n_threads=None):
+    """
+    ensemble: list of (scaler, model), e.g. load_ensemble, or [(None, xgbr)] for one model
+    feats: features of the models, in the order in which they are trained
+    data: rows (observations or parcels) with the features, PeatD and OWD, and
+          optionally the area of every parcel (area)
+    interventions: list of interventions, e.g. [('target', 30), ('shift', -10)]
+    max_rows: maximum number of rows of the model input of one prediction
+    n_threads: number of threads XGBoost may use for predicting
+
+    Returns the mean predicted CO2 flux of every model, for the current Exp_PeatD
+    (first column) and every intervention (models x (1 + interventions)).
+    """
+    col = feats.index('Exp_PeatD')
+    X = to_float32(data[feats])
+    weights = data['area'].to_numpy(dtype=np.float64) if 'area' in data.columns else np.ones(len(data))
+
+    # Exp_PeatD of every scenario: the current one, and after every intervention
+    E = np.empty((1 + len(interventions), len(data)), dtype=np.float32)
+    E[0] = X[:, col]
+    for k, intervention in enumerate(interventions, 1):
+        E[k] = intervention_exp_peatd(data, intervention)
+
+    for sc, xgbr in ensemble:
+        xgbr.set_params(n_jobs = n_threads)
+
+    # chunks of rows, and chunks of scenarios of these rows. The features of the
+    # rows are copied into the buffer once per chunk of rows
+    row_chunk = min(len(data), max_rows)
+    scen_chunk = max(1, min(len(E), max_rows // row_chunk))
+    buffer = np.empty((scen_chunk, row_chunk, len(feats)), dtype=np.float32)
+
+    sums = np.zeros((len(ensemble), len(E)))
+    for r0 in range(0, len(data), row_chunk):
+        r1 = min(r0 + row_chunk, len(data))
+        buffer[:, :r1-r0] = X[None, r0:r1]
+        for s0 in range(0, len(E), scen_chunk):
+            s1 = min(s0 + scen_chunk, len(E))
+            block = buffer[:s1-s0, :r1-r0]
+            block[:, :, col] = E[s0:s1, r0:r1]
+            Xb = block.reshape(-1, len(feats))
+            for m, (sc, xgbr) in enumerate(ensemble):
+                pred = xgbr.predict(apply_scaler(sc, Xb)).reshape(s1-s0, r1-r0)
+                sums[m, s0:s1] += pred.astype(np.float64) @ weights[r0:r1]
+
+    return sums / weights.sum()
+
+
+def summarize_interventions(means, interventions):
+    """
+    means: mean predicted CO2 flux of every model and intervention (evaluate_interventions)
+    interventions: the interventions of evaluate_interventions
+
+    Returns a dataframe with per intervention the average, 5th and 95th
+    percentile over the models of the mean CO2 flux (umol m-2 s-1), of the change
+    with respect to the current Exp_PeatD (umol m-2 s-1) and of the change in
+    t CO2 ha-1 yr-1.
+    """
+    delta = means[:, 1:] - means[:, :1]
+    delta_t_ha_yr = umol_to_kg_ha(delta * 60 * 60 * 24 * 365.25) / 1000 # s to year, kg to t
+
+    result = {}
+    for name, values in [('CO2flx', means[:, 1:]), ('delta', delta), ('delta_t_ha_yr', delta_t_ha_yr)]:
+        for key, stat in summarize(values).items():
+            result[f'{name}_{key}'] = stat
+
+    index = pd.Index([intervention_name(intervention) for intervention in interventions], name='intervention')
+    return pd.DataFrame(result, index=index)
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    partials_dir = args[0]
+    n_seeds = int(args[1]) if len(args) > 1 else 100
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    feats = list(model_specs['M5']['feats'])
+
+    data = load_model_data('M5', WD)
+    interventions = ([('target', t) for t in range(126)] +
+                     [('shift', d) for d in range(-50, 51, 5)])
+
+    ensemble = load_ensemble(partials_dir, range(n_seeds))
+    means = evaluate_interventions(ensemble, feats, data, interventions)
+    result = summarize_interventions(means, interventions)
+
+    result.to_csv(f'{WD}drainage_scenarios.csv')
+    print(result)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script fills the gaps in the half-hourly NEE of the towers with a trained
+model (M5) or its bootstrap ensemble, as an alternative to the MDS gap-filled NEE
+of the tower data (NEE_CO2_MDS), which is dropped in the cleaning scripts. The
+cleaned tower data has gaps: the half hours that were not measured, and the rows
+that are thrown out by the quality rules (e.g. QC_CO2flx, PAR_abs or Tsfc NaN)
+and by the trimming of CO2flx.
+
+For every site, all half hours from the first to the last time of the site are
+made at once (half_hour_grid), and the observed CO2flx (the cleaned tower data)
+and the features (the tower data after prepare_tower in cleaning.py, before the
+rows are thrown out) are put on these half hours with one lookup of a key of
+site and half hour. The gaps for which all features of the model are known are
+predicted in one batch per model of the ensemble, for all sites and years at once.
+Only the gaps within the training domain of the model are filled: the model is
+trained on rows with PAR_abs > 0 and Tsfc (tower_post_filter in cleaning.py), so
+night gaps (PAR_abs <= 0) are not predicted, and are left for another method
+(e.g. NEE_CO2_MDS) with their own fill flag.
+
+The result has a row per site and half hour with:
+    CO2flx:     the observed NEE (NaN in the gaps)
+    NEE_filled: the observed NEE, or in the gaps the average prediction of the
+                ensemble
+    NEE_q05, NEE_q95: 5th and 95th percentile of the predictions of the
+                ensemble in the gaps (the bootstrap interval)
+    fill_flag:  0 observed, 1 filled by the model, 2 gap without the features
+                (NaN), 3 gap outside the training domain (PAR_abs <= 0 or no
+                Tsfc, e.g. night), not filled (NaN)
+    NEE_CO2_MDS: the MDS gap-filled NEE, if it is in the features table
+fill_summary gives the number of rows of every fill flag per site, and the
+difference between the model and MDS in the filled gaps.
+
+Run as:
+    python gap_filling.py <partials dir> <n_seeds>
+
+Input: the tower data (reclassified and cleaned) and the stored bootstrap models
+Output: the gap-filled tower NEE, and the summary per site
+
+Functions:
+    half_hour_grid: all half hours of every site
+    gap_fill:       the gap-filled NEE of all sites
+    fill_summary:   the fill flags and the comparison with MDS per site
+"""
+#%% Import packages
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from annual_upscaling import load_ensemble
+from model_specs import model_specs
+from boot_ensemble import summarize
+from fit_utils import apply_scaler, to_float32
+from cleaning import prepare_tower
+
+#%% Half hours
+
+def half_hour_grid(sites, times, freq='30min'):
+    """
+    sites, times: site and time of all rows (observed and features)
+    freq: time step
+
+    Returns a dataframe with site and Datetime of all time steps from the first to
+    the last time of every site, sorted by site and time, and the first time and
+    the position of the first row of every site (to find the rows of a time).
+    """
+    step = pd.Timedelta(freq).value
+    codes, names = pd.factorize(pd.Series(sites), sort=True)
+    t = pd.to_datetime(pd.Series(times)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    start = np.full(len(names), np.iinfo(np.int64).max)
+    end = np.full(len(names), np.iinfo(np.int64).min)
+    np.minimum.at(start, codes, t)
+    np.maximum.at(end, codes, t)
+    n_steps = (end - start) // step + 1
+
+    first_row = np.concatenate([[0], np.cumsum(n_steps)[:-1]])
+    site_codes = np.repeat(np.arange(len(names)), n_steps)
+    offsets = np.arange(n_steps.sum()) - np.repeat(first_row, n_steps)
+    grid = pd.DataFrame({'site': names[site_codes],
+                         'Datetime': (np.repeat(start, n_steps) + offsets * step).astype('datetime64[ns]')})
+    return grid, {'names': names, 'start': start, 'first_row': first_row, 'n_steps': n_steps, 'step': step}
+
+
+def grid_rows(grid_index, sites, times):
+    """
+    Returns the row in the grid of every site and time (-1 if the time is not on
+    a time step of the grid).
+    """
+    code = grid_index['names'].get_indexer(pd.Series(sites))
+    t = pd.to_datetime(pd.Series(times)).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    known = code >= 0
+    step_no = np.where(known, t - grid_index['start'][code], -1)
+    on_grid = known & (step_no % grid_index['step'] == 0) & (step_no >= 0)
+    step_no = step_no // grid_index['step']
+    on_grid &= step_no < grid_index['n_steps'][code]
+    return np.where(on_grid, grid_index['first_row'][code] + step_no, -1)
+
+#%% Gap filling
+
+def gap_fill(observed, features, feats, ensemble, freq='30min', n_threads=None):
+    """
+    observed: cleaned tower data with site, Datetime and CO2flx
+    features: tower data with site, Datetime and the features of the model for
+              all rows (e.g. after prepare_tower), and optionally NEE_CO2_MDS
+    feats: features of the models, in the order in which they are trained
+    ensemble: list of (scaler, model), e.g. load_ensemble, or [(None, xgbr)] for one model
+    freq: time step
+    n_threads: number of threads XGBoost may use for predicting
+
+    Returns the gap-filled NEE of all sites (see above). Only gaps with PAR_abs > 0
+    and Tsfc are filled, the domain of the training data.
+    """
+    grid, grid_index = half_hour_grid(pd.concat([observed['site'], features['site']]),
+                                      pd.concat([observed['Datetime'], features['Datetime']]), freq)
+
+    # observed CO2flx and features on the half hours (the first row of a half hour)
+    obs_rows = grid_rows(grid_index, observed['site'], observed['Datetime'])
+    CO2flx = np.full(len(grid), np.nan)
+    keep = obs_rows >= 0
+    CO2flx[obs_rows[keep][::-1]] = observed['CO2flx'].to_numpy(dtype=np.float64)[keep][::-1]
+
+    feat_rows = grid_rows(grid_index, features['site'], features['Datetime'])
+    domain_feats = [feat for feat in ['PAR_abs', 'Tsfc'] if feat not in feats]
+    cols = feats + domain_feats + (['NEE_CO2_MDS'] if 'NEE_CO2_MDS' in features.columns else [])
+    values = np.full((len(grid), len(cols)), np.nan, dtype=np.float32)
+    keep = feat_rows >= 0
+    values[feat_rows[keep][::-1]] = to_float32(features[cols])[keep][::-1]
+
+    gaps = np.isnan(CO2flx)
+    known = ~np.isnan(values[:, :len(feats)]).any(axis=1)
+    # the training domain: the rows of tower_post_filter (PAR_abs > 0 and Tsfc)
+    domain = (values[:, cols.index('PAR_abs')] > 0) & ~np.isnan(values[:, cols.index('Tsfc')])
+    fill = gaps & known & domain
+
+    # one prediction per model for the gaps of all sites
+    X = np.ascontiguousarray(values[fill, :len(feats)])
+    preds = np.empty((len(ensemble), len(X)), dtype=np.float32)
+    for m, (sc, xgbr) in enumerate(ensemble):
+        xgbr.set_params(n_jobs = n_threads)
+        if len(X) != 0:
+            preds[m] = xgbr.predict(apply_scaler(sc, X))
+    stats = summarize(preds)
+
+    grid['CO2flx'] = CO2flx
+    grid['NEE_filled'] = CO2flx
+    grid['NEE_q05'] = np.nan
+    grid['NEE_q95'] = np.nan
+    grid.loc[fill, 'NEE_filled'] = stats['mean']
+    grid.loc[fill, 'NEE_q05'] = stats['q05']
+    grid.loc[fill, 'NEE_q95'] = stats['q95']
+    grid['fill_flag'] = np.select([~gaps, fill, ~known], [0, 1, 2], 3).astype(np.int8)
+    if 'NEE_CO2_MDS' in cols:
+        grid['NEE_CO2_MDS'] = values[:, -1]
+    return grid
+
+
+def fill_summary(filled):
+    """
+    Returns per site the number of observed, filled and unfilled half hours, and
+    of the gaps outside the training domain, and if NEE_CO2_MDS is known, the mean
+    difference (bias) and RMSE of the model with respect to MDS in the filled half
+    hours.
+    """
+    summary = pd.crosstab(filled['site'], filled['fill_flag']).reindex(columns=[0, 1, 2, 3], fill_value=0)
+    summary.columns = ['observed', 'filled', 'unfilled', 'outside_domain']
+
+    if 'NEE_CO2_MDS' in filled.columns:
+        rows = (filled['fill_flag'] == 1) & filled['NEE_CO2_MDS'].notna()
+        diff = (filled['NEE_filled'] - filled['NEE_CO2_MDS'])[rows]
+        summary['bias_MDS'] = diff.groupby(filled['site'][rows]).mean()
+        summary['RMSE_MDS'] = np.sqrt((diff ** 2).groupby(filled['site'][rows]).mean())
+    return summary
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    partials_dir = args[0]
+    n_seeds = int(args[1]) if len(args) > 1 else 100
+
+    WD = 'C:/Users/ariet/Documents/Climate Studies/WSG Thesis/data/'
+    feats = list(model_specs['M5']['feats'])
+
+    # features of all rows: the tower data after the cleaning steps per row, before
+    # the rows are thrown out on PAR_abs, Tsfc and CO2flx. NEE_CO2_MDS is dropped in
+    # prepare_tower, so it is kept aside
+    twr = pd.read_csv(f"{WD}tower_1129_reclassified.csv", index_col=0)
+    MDS = twr['NEE_CO2_MDS']
+    features = prepare_tower(twr)
+    features['NEE_CO2_MDS'] = MDS.reindex(features.index)
+    features['Datetime'] = features['datetime']
+
+    observed = pd.read_csv(f"{WD}tower_1129_final.csv", index_col=0)
+    observed['Datetime'] = pd.to_datetime(observed['datetime'])
+
+    ensemble = load_ensemble(partials_dir, range(n_seeds))
+    filled = gap_fill(observed, features, feats, ensemble)
+    summary = fill_summary(filled)
+
+    filled.to_csv(f"{WD}tower_1129_gapfilled.csv")
+    summary.to_csv(f"{WD}tower_1129_gapfilled_summary.csv")
+    print(summary)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+@author: arietma
+
+This script predicts NEE (CO2flx) wall-to-wall over Fryslân with a trained model
+(e.g. M5), instead of only at the observations or for the simulation series. The
+features of the model are made per grid cell from maps that are aligned (the same
+grid, e.g. 25 m in RD):
+    layers:     a map per feature (.tif, .npy or .asc), e.g. EVI of a MODIS
+                composite, and SuC, Wat and Bld as the fraction of the LGN classes
+                in every cell. Exp_PeatD can be a map, or is calculated from the
+                maps of PeatD, ahn and GWS (OWASIS) with the rules of the cleaning
+                scripts (cleaning.py)
+    constants:  a number per feature, e.g. PAR_abs, Tsfc and RH of the KNMI
+                station for the time of the map
+Cells where a map has no data (NaN) are not predicted (NaN in the output), nor
+cells with OWD < 0 (open water, thrown out in the cleaning scripts) if Exp_PeatD
+is calculated from the maps.
+
+ESRI ASCII grids (.asc) cannot be read per window without parsing all rows before
+the window, so they are converted once to a .npy file (with the grid in a .json
+file) next to the .asc file, which is read with a memory map. The conversion is
+used again as long as it is newer than the .asc file.
+
+The map is divided in tiles. Every tile is read from the maps with a window (so
+only the tile is in memory), its features are assembled as one float32 array and
+predicted with one call of the model. The tiles are divided over a process pool,
+in which every worker loads the model once. At most two tiles per worker are
+waiting to be written, so the memory that is needed depends on the tile size
+and the number of workers, not on the size of the map. The output is a tiled
+GeoTIFF (with rasterio), or a .npy file (memory map) with the grid in a .json file.
+
+Run as:
+    python nee_maps.py <model .ubj> <layers .json> <output .tif|.npy> <n_workers> [<tile size>]
+        the layers file is a dictionary with per feature the path of the map or
+        a number, e.g. {"EVI": "EVI_2022193.tif", "PAR_abs": 800, "Tsfc": 15, ...}
+
+Input: the trained model (model_registry.py) and the maps of the features
+Output: map of the predicted NEE
+
+Functions:
+    load_booster:   the scaler, model and features of a stored model
+    open_layer:     grid and reader of a map, without reading the values
+    asc_to_npy:     converts a .asc map to a .npy map, once
+    read_window:    the values of a tile of a map
+    make_tiles:     the windows of the tiles of a grid
+    tile_features:  the features of a tile as one float32 array
+    predict_map:    predicts all tiles on a process pool and writes the output map
+"""
+#%% Import packages
+
+import os
+import sys
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from xgboost import XGBRegressor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '04_model_evaluation'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '02_spatial_preprocessing', 'reclassify_and_clean_datasets'))
+from model_specs import model_specs
+from model_registry import scaler_from_params
+from fit_utils import apply_scaler
+from cleaning import open_water_depth, exp_peat_depth
+
+#%% Model
+
+def load_booster(model_path, spec='M5'):
+    """
+    model_path: booster (.ubj) of model_registry.py or scenario_engine.py
+    spec: model spec of which the features are used if there is no metadata
+          (.json of model_registry.py) next to the booster
+
+    Returns the scaler (None for tree models), the model and its features.
+    """
+    xgbr = XGBRegressor()
+    xgbr.load_model(model_path)
+
+    meta_path = model_path[:-len('.ubj')] + '.json'
+    if not os.path.exists(meta_path):
+        return None, xgbr, list(model_specs[spec]['feats'])
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    sc = None
+    if meta['scaler'] is not None:
+        sc = scaler_from_params(meta['scaler']['mean'], meta['scaler']['scale'],
+                                meta['scaler']['var'], meta['n_rows'])
+    return sc, xgbr, meta['feats']
+
+#%% Maps
+
+def open_layer(path):
+    """
+    Returns the layer of a map: a dictionary with the path, the format and the
+    grid (x0 and y0 of the top left corner, res, nrows and ncols, as read_map in
+    footprint_store.py). The values are not read. A .asc map is opened as its .npy
+    conversion (asc_to_npy).
+    """
+    if path.endswith('.npy'):
+        with open(path[:-len('.npy')] + '.json') as f:
+            grid = json.load(f)
+        return {'path': path, 'format': 'npy', 'grid': grid}
+
+    if path.endswith('.asc'):
+        return open_layer(asc_to_npy(path))
+
+    import rasterio
+    with rasterio.open(path) as src:
+        t = src.transform
+        return {'path': path, 'format': 'tif', 'nodata': src.nodata,
+                'grid': {'x0': t.c, 'y0': t.f, 'res': t.a, 'nrows': src.height, 'ncols': src.width}}
+
+
+def asc_header(path):
+    """
+    Returns the grid and the nodata value of a .asc map.
+    """
+    header = {}
+    with open(path) as f:
+        for _ in range(6):
+            key, value = f.readline().split()
+            header[key.lower()] = float(value)
+    res = header['cellsize']
+    nrows, ncols = int(header['nrows']), int(header['ncols'])
+    x0 = header['xllcorner'] if 'xllcorner' in header else header['xllcenter'] - res/2
+    yll = header['yllcorner'] if 'yllcorner' in header else header['yllcenter'] - res/2
+    return {'x0': x0, 'y0': yll + nrows*res, 'res': res, 'nrows': nrows, 'ncols': ncols}, header.get('nodata_value')
+
+
+def asc_to_npy(path):
+    """
+    Converts a .asc map to <name>.npy (float32, nodata as NaN) and <name>.json (the
+    grid), row by row, so only one pass over the .asc file is needed. Returns the
+    path of the .npy file. The conversion is skipped if the .npy file is newer than
+    the .asc file.
+    """
+    npy_path = path[:-len('.asc')] + '.npy'
+    if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(path):
+        return npy_path
+
+    grid, nodata = asc_header(path)
+    out = np.lib.format.open_memmap(f'{npy_path}.tmp', mode='w+', dtype=np.float32,
+                                    shape=(grid['nrows'], grid['ncols']))
+    with open(path) as f:
+        for _ in range(6):
+            f.readline()
+        for row in range(grid['nrows']):
+            values = np.array(f.readline().split(), dtype=np.float32)
+            if nodata is not None:
+                values[values == np.float32(nodata)] = np.nan
+            out[row] = values
+    out.flush()
+    del out
+
+    with open(npy_path[:-len('.npy')] + '.json', 'w') as f:
+        json.dump(grid, f, indent=4)
+    os.replace(f'{npy_path}.tmp', npy_path)
+    return npy_path
+
+
+def read_window(layer, window):
+    """
+    layer: layer of a map (open_layer)
+    window: rows and columns of the tile (row0, row1, col0, col1)
+
+    Returns the values of the tile (2D, float32, nodata as NaN).
+    """
+    row0, row1, col0, col1 = window
+    if layer['format'] == 'npy':
+        values = np.load(layer['path'], mmap_mode='r')[row0:row1, col0:col1]
+        return np.array(values, dtype=np.float32)
+
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(layer['path']) as src:
+        values = src.read(1, window=Window(col0, row0, col1-col0, row1-row0)).astype(np.float32)
+
+    if layer['nodata'] is not None:
+        values[values == np.float32(layer['nodata'])] = np.nan
+    return values
+
+
+def make_tiles(grid, tile_size=512):
+    """
+    Returns the windows (row0, row1, col0, col1) of the tiles of a grid.
+    """
+    return [(row0, min(row0+tile_size, grid['nrows']), col0, min(col0+tile_size, grid['ncols']))
+            for row0 in range(0, grid['nrows'], tile_size)
+            for col0 in range(0, grid['ncols'], tile_size)]
+
+
+def check_aligned(layers):
+    """
+    Returns the grid of the maps, or raises a ValueError if the maps do not have
+    the same grid.
+    """
+    grids = {name: layer['grid'] for name, layer in layers.items()}
+    first_name, first = next(iter(grids.items()))
+    for name, grid in grids.items():
+        if any(not np.isclose(grid[key], first[key]) for key in ['x0', 'y0', 'res', 'nrows', 'ncols']):
+            raise ValueError(f'The map of {name} is not aligned with the map of {first_name}: {grid} != {first}')
+    return first
+
+#%% Features
+
+def tile_features(layers, constants, feats, window):
+    """
+    layers: layers of the maps (open_layer), per feature, or PeatD, ahn and GWS
+            for Exp_PeatD
+    constants: values of the features that are the same for every cell
+    feats: features of the model, in the order in which the model is trained
+    window: rows and columns of the tile
+
+    Returns the features of the cells of the tile with data in all maps and, if
+    Exp_PeatD is calculated from the maps, with OWD >= 0 (float32, cells x feats),
+    and the mask of these cells in the tile.
+    """
+    row0, row1, col0, col1 = window
+    shape = (row1-row0, col1-col0)
+
+    values = {name: read_window(layer, window) for name, layer in layers.items()}
+
+    # before Exp_PeatD is calculated, as exp_peat_depth gives OWD where PeatD is NaN
+    valid = np.ones(shape, dtype=bool)
+    for v in values.values():
+        valid &= ~np.isnan(v)
+
+    if 'Exp_PeatD' in feats and 'Exp_PeatD' not in values and 'Exp_PeatD' not in constants:
+        OWD = open_water_depth(values.pop('ahn'), values.pop('GWS'))
+        values['Exp_PeatD'] = exp_peat_depth(values.pop('PeatD'), OWD)
+        # only cells with OWD >= 0, as the rows of the cleaning scripts
+        valid &= OWD >= 0
+
+    X = np.empty((valid.sum(), len(feats)), dtype=np.float32)
+    for j, feat in enumerate(feats):
+        X[:, j] = values[feat][valid] if feat in values else constants[feat]
+    return X, valid
+
+#%% Predict
+
+# model and maps in every worker, loaded once by _init_worker
+_worker = {}
+
+def _init_worker(model_path, layer_paths, constants, n_threads):
+    sc, xgbr, feats = load_booster(model_path)
+    xgbr.set_params(n_jobs = n_threads)
+    _worker.update(sc=sc, xgbr=xgbr, feats=feats, constants=constants,
+                   layers={name: open_layer(path) for name, path in layer_paths.items()})
+
+
+def _predict_tile(window):
+    X, valid = tile_features(_worker['layers'], _worker['constants'], _worker['feats'], window)
+    pred = np.full(valid.shape, np.nan, dtype=np.float32)
+    if len(X) != 0:
+        pred[valid] = _worker['xgbr'].predict(apply_scaler(_worker['sc'], X))
+    return window, pred
+
+
+def open_output(path, grid, tile_size):
+    """
+    Creates the output map (NaN), and returns a function that writes a tile.
+    """
+    if path.endswith('.npy'):
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(grid['nrows'], grid['ncols']))
+        out[:] = np.nan
+        with open(path[:-len('.npy')] + '.json', 'w') as f:
+            json.dump(grid, f, indent=4)
+
+        def write(window, pred):
+            row0, row1, col0, col1 = window
+            out[row0:row1, col0:col1] = pred
+        return write, out.flush
+
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+    dst = rasterio.open(path, 'w', driver='GTiff', dtype='float32', count=1, nodata=np.nan,
+                        height=grid['nrows'], width=grid['ncols'], crs='EPSG:28992',
+                        transform=from_origin(grid['x0'], grid['y0'], grid['res'], grid['res']),
+                        tiled=True, blockxsize=tile_size, blockysize=tile_size, compress='deflate')
+
+    def write(window, pred):
+        row0, row1, col0, col1 = window
+        dst.write(pred, 1, window=Window(col0, row0, col1-col0, row1-row0))
+    return write, dst.close
+
+
+def predict_map(model_path, layer_paths, constants, out_path, n_workers=1, tile_size=512, n_threads=1):
+    """
+    model_path: booster (.ubj) of the model
+    layer_paths: path of the map per feature (or PeatD, ahn and GWS for Exp_PeatD)
+    constants: values of the features that are the same for every cell
+    out_path: output map (.tif or .npy)
+    n_workers: number of worker processes, every worker predicts one tile at a time
+    tile_size: number of rows and columns of a tile (a multiple of 16 for .tif)
+    n_threads: number of threads XGBoost may use in every worker
+
+    Writes the map of the predicted NEE, and returns its grid.
+    """
+    # .asc maps are read per window from a .npy conversion, converted here once
+    # and not in every worker
+    layer_paths = {name: asc_to_npy(path) if path.endswith('.asc') else path
+                   for name, path in layer_paths.items()}
+    grid = check_aligned({name: open_layer(path) for name, path in layer_paths.items()})
+    tiles = make_tiles(grid, tile_size)
+    write, close = open_output(out_path, grid, tile_size)
+
+    if n_workers == 1:
+        _init_worker(model_path, layer_paths, constants, n_threads)
+        for window in tiles:
+            write(*_predict_tile(window))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(model_path, layer_paths, constants, n_threads)) as pool:
+            # submit new tiles only when tiles are written, so at most two tiles
+            # per worker are in memory
+            todo = iter(tiles)
+            running = set()
+            for window in todo:
+                running.add(pool.submit(_predict_tile, window))
+                if len(running) >= 2*n_workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(*future.result())
+            for future in running:
+                write(*future.result())
+    close()
+    print(f'{out_path}: {len(tiles)} tiles of {tile_size} x {tile_size} cells')
+    return grid
+
+#%% Run
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    model_path, layers_path, out_path = args[0], args[1], args[2]
+    n_workers = int(args[3]) if len(args) > 3 else 1
+    tile_size = int(args[4]) if len(args) > 4 else 512
+
+    with open(layers_path) as f:
+        layers = json.load(f)
+    layer_paths = {name: path for name, path in layers.items() if isinstance(path, str)}
+    constants = {name: value for name, value in layers.items() if not isinstance(value, str)}
+
+    predict_map(model_path, layer_paths, constants, out_path, n_workers, tile_size)